@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+admission.py -- admission control for conference registration
+
+Each conference is limited to REGISTRATION_RATE registrations per
+second, and all registrations together to GLOBAL_REGISTRATION_RATE, both
+counted in memcache so every instance sees the same limits. The rate is
+a sliding window: per-second counters, with the previous second's count
+weighted by how much of it still lies within the last second. That
+smooths the double burst a fixed window allows at its edge, at the cost
+of one memcache RPC per registration for the counters plus one for the
+previous second. A request over either rate is refused with 503 before
+any datastore work (Endpoints v1 turns any status it doesn't know, such
+as 429, into 404). The exception carries retryAfter in seconds; the
+message says it too, and webapp2 handlers send it as Retry-After. Once a
+conference is known to be sold out a memcache flag turns registrations
+away with 409 without opening a transaction.
+
+If memcache is unavailable requests are admitted.
+
+"""
+
+import httplib
+import random
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import ConflictException
+
+REGISTRATION_RATE = 20          # per conference, per second
+GLOBAL_REGISTRATION_RATE = 200  # all conferences, per second
+SOLD_OUT_SECONDS = 60           # a stale flag heals itself this fast
+
+MEMCACHE_BUCKET_KEY = 'ADMIT:%s:%d'
+MEMCACHE_SOLD_OUT_KEY = 'SOLD_OUT:%s'
+
+
+class ServiceUnavailableException(endpoints.ServiceException):
+    """ServiceUnavailableException -- exception mapped to HTTP 503 response"""
+    http_status = httplib.SERVICE_UNAVAILABLE
+
+    def __init__(self, message=None, retryAfter=None):
+        super(ServiceUnavailableException, self).__init__(message)
+        self.retryAfter = retryAfter
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _retryAfter():
+    """Seconds to wait: the next bucket, spread so retries don't re-burst."""
+    return 1 + random.randint(0, 2)
+
+
+def _busy(message):
+    retry = _retryAfter()
+    return ServiceUnavailableException('%s, retry after %d seconds' % (message, retry),
+                                       retryAfter=retry)
+
+
+def _rate(previous, current, elapsed):
+    """Registrations in the last second: the current second's count plus
+    the share of the previous second's that still falls inside it."""
+    return (previous or 0) * (1 - elapsed) + current
+
+
+def admit(wsck):
+    """Count a registration to conference wsck or refuse it."""
+    if memcache.get(MEMCACHE_SOLD_OUT_KEY % wsck):
+        raise ConflictException("There are no seats available.")
+
+    now = time.time()
+    second = int(now)
+    keys = dict((scope, MEMCACHE_BUCKET_KEY % (scope, second)) for scope in (wsck, '*'))
+    previous = memcache.get_multi([MEMCACHE_BUCKET_KEY % (scope, second - 1)
+                                   for scope in (wsck, '*')])
+    # one RPC for both counters; the keys are per second so they never
+    # need resetting and memcache evicts them
+    counts = memcache.offset_multi({keys[wsck]: 1, keys['*']: 1}, initial_value=0)
+    if counts.get(keys['*']) is None or counts.get(keys[wsck]) is None:
+        # memcache is down: admit
+        return
+    last = lambda scope: previous.get(MEMCACHE_BUCKET_KEY % (scope, second - 1))
+    if _rate(last('*'), counts[keys['*']], now - second) > GLOBAL_REGISTRATION_RATE:
+        raise _busy('Registration is busy')
+    if _rate(last(wsck), counts[keys[wsck]], now - second) > REGISTRATION_RATE:
+        raise _busy('Too many registrations for this conference')
+
+
+def markSoldOut(wsck):
+    memcache.set(MEMCACHE_SOLD_OUT_KEY % wsck, True, time=SOLD_OUT_SECONDS)
+
+
+def clearSoldOut(wsck):
+    memcache.delete(MEMCACHE_SOLD_OUT_KEY % wsck)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+agenda.py -- precomputed per-user agenda
+
+A user's agenda is one time-ordered list of the conferences they are
+registered for and the sessions on their wishlist, each flagged when it
+overlaps another item of the same kind. It is built once per change and
+kept in memcache under the user id, so reading it is a single memcache
+get. Sessions come from their conference's materialized schedule
+(schedule.py), which already carries the speaker names.
+
+Registration and wishlist changes drop the cached agenda and queue
+/tasks/refresh_agenda to rebuild it; a read that finds nothing builds it
+inline. Edits to a conference or session the user follows show up within
+AGENDA_CACHE_SECONDS.
+
+"""
+
+import itertools
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+import repository
+import schedule
+
+MEMCACHE_AGENDA_KEY = 'AGENDA:%s'
+AGENDA_CACHE_SECONDS = 60 * 60
+REFRESH_AGENDA_URL = '/tasks/refresh_agenda'
+
+# conferences run all day: their end sorts after any session time
+DAY_END = '24:00'
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _conferenceItem(conf):
+    return {
+        'kind': 'conference',
+        'start': conf.startDate.isoformat() if conf.startDate else None,
+        'end': '%s %s' % (conf.endDate.isoformat(), DAY_END) if conf.endDate else None,
+        'websafeKey': conf.key.urlsafe(),
+        'name': conf.name,
+        'websafeConferenceKey': conf.key.urlsafe(),
+        'city': conf.city,
+    }
+
+
+def _sessionItem(c_key, entry):
+    start = end = None
+    if entry[schedule.DATE] and entry[schedule.STARTTIME]:
+        start = '%s %s' % (entry[schedule.DATE], entry[schedule.STARTTIME])
+        began = datetime.strptime(start, '%Y-%m-%d %H:%M')
+        end = (began + timedelta(minutes=entry[schedule.DURATION] or 0)).strftime('%Y-%m-%d %H:%M')
+    return {
+        'kind': 'session',
+        'start': start,
+        'end': end,
+        'websafeKey': entry[schedule.KEY],
+        'name': entry[schedule.NAME],
+        'websafeConferenceKey': c_key.urlsafe(),
+        'speaker': entry[schedule.SPEAKER],
+        'typeofsession': entry[schedule.TYPE],
+    }
+
+
+def _flagOverlaps(items):
+    """Mark conferences that overlap conferences, sessions that overlap sessions."""
+    timed = [item for item in items if item['start'] and item['end']]
+    for a, b in itertools.combinations(timed, 2):
+        if a['kind'] == b['kind'] and a['start'] < b['end'] and b['start'] < a['end']:
+            a['overlaps'] = b['overlaps'] = True
+
+
+def build(prof):
+    """Agenda items of a profile, in time order; undated items last."""
+    items = []
+    conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+    for conf in repository.getMulti(conf_keys):
+        if conf:
+            items.append(_conferenceItem(conf))
+
+    # one schedule read per conference instead of a get and a speaker
+    # lookup per session
+    wanted = {}
+    for s_key in prof.favoriteSessions:
+        wanted.setdefault(s_key.parent(), set()).add(s_key.urlsafe())
+    for c_key, keys in wanted.iteritems():
+        for entry in schedule.getSchedule(c_key):
+            if entry[schedule.KEY] in keys:
+                items.append(_sessionItem(c_key, entry))
+
+    for item in items:
+        item['overlaps'] = False
+    _flagOverlaps(items)
+    items.sort(key=lambda item: (item['start'] is None, item['start'], item['kind'], item['name']))
+    return items
+
+
+def getAgenda(user_id):
+    """The cached agenda of a user, built on a miss."""
+    mc_key = MEMCACHE_AGENDA_KEY % user_id
+    items = memcache.get(mc_key)
+    if items is None:
+        prof = repository.get(ndb.Key(Profile, user_id))
+        items = build(prof) if prof else []
+        # add, not set: a refresh that raced this read wins
+        memcache.add(mc_key, items, time=AGENDA_CACHE_SECONDS)
+    return items
+
+
+def invalidate(user_id):
+    """Drop a user's agenda after a registration or wishlist change and
+    queue its rebuild."""
+    memcache.delete(MEMCACHE_AGENDA_KEY % user_id)
+    try:
+        taskqueue.add(url=REFRESH_AGENDA_URL, params={'user': user_id})
+    except taskqueue.Error:
+        # the next read rebuilds it
+        logging.exception('could not queue agenda refresh for %s', user_id)
+
+
+def refreshTask(user_id):
+    """Task entry point: rebuild and store a user's agenda."""
+    prof = repository.get(ndb.Key(Profile, user_id))
+    items = build(prof) if prof else []
+    memcache.set(MEMCACHE_AGENDA_KEY % user_id, items, time=AGENDA_CACHE_SECONDS)
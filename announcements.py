@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- cached announcement and featured speaker
+
+Kept apart from the Endpoints services so the hourly cron and the cache
+refresh task only import the models they need.
+
+"""
+
+from google.appengine.ext import ndb
+
+from cache import ReadThroughCache
+from models import Conference
+from models import Session
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = 'featured_speaker'
+
+ANNOUNCEMENT_CACHE = ReadThroughCache(MEMCACHE_ANNOUNCEMENTS_KEY,
+    'announcements.announcementText', soft_ttl=60 * 60)
+FEATURED_SPEAKER_CACHE = ReadThroughCache(MEMCACHE_FEATURED_SPEAKER_KEY,
+    'announcements.featuredSpeaker', soft_ttl=24 * 60 * 60)
+FEATURED_SCAN_LIMIT = 5000      # live sessions counted on a cache miss
+FEATURED_CANDIDATES = 10        # top (conference, speaker) pairs looked up
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def announcementText():
+    """Build the nearly sold out announcement from the datastore."""
+    confs = Conference.query(ndb.AND(
+        Conference.archived == False,
+        Conference.seatsAvailable <= 5,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+
+    if confs:
+        # If there are almost sold out conferences, format announcement
+        return '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(conf.name for conf in confs))
+    return ""
+
+
+def cacheAnnouncement():
+    """Rebuild the announcement and store it; used by the hourly cron."""
+    # an empty announcement is cached too, so a miss means eviction
+    announcement = announcementText()
+    ANNOUNCEMENT_CACHE.set(announcement)
+    return announcement
+
+
+def featuredSpeaker():
+    """Rebuild the featured speaker after the cache lost it.
+
+    The featured speaker is the one with the most sessions in a single
+    conference that is not archived, counted over at most
+    FEATURED_SCAN_LIMIT live sessions. Speakers that no longer exist are
+    skipped. Returns a dict with speaker name and session names, or None.
+    """
+    counts = {}
+    live = Session.query(Session.archived == False)
+    for session in live.iter(projection=[Session.speaker], limit=FEATURED_SCAN_LIMIT,
+                             batch_size=500):
+        if session.speaker is None:
+            continue
+        pair = (session.key.parent(), session.speaker)
+        counts[pair] = counts.get(pair, 0) + 1
+
+    ranked = sorted(counts.iteritems(), key=lambda item: item[1], reverse=True)
+    ranked = [pair for pair, count in ranked[:FEATURED_CANDIDATES] if count >= 2]
+    speakers = ndb.get_multi([s_key for c_key, s_key in ranked])
+    for (c_key, s_key), speaker in zip(ranked, speakers):
+        if speaker is None:
+            continue
+        sessions = Session.query(ancestor=c_key).filter(Session.speaker == s_key).fetch()
+        return {'speaker': speaker.name,
+                'sessions': [session.name for session in sessions]}
+    return None
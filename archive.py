@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+archive.py -- moves finished conferences out of the hot query set
+
+A conference whose endDate has passed is flagged archived, together with
+its sessions, in one transaction (they share its entity group). The
+archived flag is indexed and the conference and session queries that
+scan across conferences (queryConferences, the nearly sold out
+announcement, the featured speaker, sessionBySpeaker and
+nonWorkshopAfterSeven) filter on archived == False unless the caller
+passes includeArchived. Queries for one conference's sessions still see
+everything.
+
+The nightly cron archives ARCHIVE_BATCH conferences per request and
+chains tasks until none are left.
+
+"""
+
+import logging
+from datetime import date
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import catalog
+from models import Conference
+from models import Session
+
+ARCHIVE_BATCH = 100
+ARCHIVE_TASK_URL = '/tasks/archive'
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _archiveConference(c_key, today):
+    """Flag a finished conference and its sessions; False if there was nothing to do."""
+    conf = c_key.get()
+    if not conf or conf.archived or not conf.endDate or conf.endDate >= today:
+        return False
+    conf.archived = True
+    sessions = Session.query(ancestor=c_key).fetch()
+    for session in sessions:
+        session.archived = True
+    ndb.put_multi([conf] + sessions)
+    return True
+
+
+def archivePast(today=None):
+    """Archive up to ARCHIVE_BATCH finished conferences, chaining a task for the rest."""
+    today = today or date.today()
+    keys = Conference.query(Conference.archived == False,
+                            Conference.endDate < today).fetch(ARCHIVE_BATCH, keys_only=True)
+    archived = 0
+    for c_key in keys:
+        if ndb.transaction(lambda: _archiveConference(c_key, today)):
+            archived += 1
+    if archived:
+        # the catalog drops archived rows on its next refresh
+        catalog.invalidate()
+    if len(keys) == ARCHIVE_BATCH:
+        taskqueue.add(url=ARCHIVE_TASK_URL, params={'today': today.isoformat()})
+    logging.info('archived %d of %d finished conferences', archived, len(keys))
+    return archived
+
+
+def archiveTask(today):
+    """Task entry point: continue archiving with the cron's cutoff date."""
+    archivePast(datetime.strptime(today, '%Y-%m-%d').date())
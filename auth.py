@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+auth.py -- user id lookup shared by the Conference and Session APIs
+
+"""
+
+import json
+import os
+import time
+
+from google.appengine.api import urlfetch
+
+# request-local memo (os.environ is per request on App Engine)
+USER_ID_ENV = 'CONFERENCE_USER_ID'
+USER_AUTH_ENV = 'CONFERENCE_USER_AUTH'
+
+
+def getUserId():
+    """A workaround implementation for getting userid.
+
+    The tokeninfo lookup is a urlfetch, so the result is remembered for the
+    rest of the request; a batch of operations authenticates once.
+    """
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    if auth and os.environ.get(USER_AUTH_ENV) == auth:
+        return os.environ[USER_ID_ENV]
+    bearer, token = auth.split()
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    user = {}
+    wait = 1
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            break
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+                   % ('access_token', token))
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    user_id = user.get('user_id', '')
+    if user_id:
+        os.environ[USER_AUTH_ENV] = auth
+        os.environ[USER_ID_ENV] = user_id
+    return user_id
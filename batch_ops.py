@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+batch_ops.py -- run several Conference/Session API operations in one call
+
+Each operation names an API method ('conference.getConference',
+'session.sessionByConf', ...) and carries its request as a JSON object.
+The caller is authenticated once for the whole batch and each result
+comes back with its own HTTP-style status.
+
+Before any operation runs, every operation's reads are started at once
+as ndb tasklets: the entities its keys name, the caller's profile, for
+getConferencesToAttend the attended conferences and their organizers,
+and for getAnnouncement the cached announcement. ndb merges the
+concurrent gets into batch RPCs that are in flight together with the
+memcache reads, so a batch waits about as long as its slowest read
+instead of the sum of them. The endpoint methods then run in request
+order and find what they read in the ndb context cache and the
+announcement's instance cache.
+
+"""
+
+import logging
+
+import endpoints
+from protorpc import messages
+from protorpc import protojson
+from google.appengine.ext import ndb
+
+from announcements import ANNOUNCEMENT_CACHE
+from auth import getUserId
+from models import BatchResponseForm
+from models import BatchResultForm
+from models import Profile
+import repository
+
+BATCH_MAX_OPERATIONS = 20
+KEY_PARAMS = ('websafeConferenceKey', 'websafeSessionKey', 'websafeKey')
+# operations that read the conferences in the caller's profile
+FOLLOW_ATTENDING = ('conference.getConferencesToAttend',)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _resolve(apis, method_name):
+    """Return the bound remote method for 'api.method'."""
+    api_name, _, name = (method_name or '').partition('.')
+    service = apis.get(api_name)
+    method = getattr(service, name, None) if service else None
+    if name == 'batch' or not hasattr(method, 'remote'):
+        raise endpoints.NotFoundException('Unknown method: %s' % method_name)
+    return method
+
+
+def _decode(method, params):
+    """Decode an operation's JSON params into the method's request type."""
+    try:
+        return protojson.decode_message(method.remote.request_type, params or '{}')
+    except (messages.Error, ValueError) as e:
+        raise endpoints.BadRequestException('Invalid params: %s' % e)
+
+
+def _keys(request, user_id):
+    """Keys an operation's request names, their parents and the caller's profile."""
+    keys = set()
+    if user_id:
+        keys.add(ndb.Key(Profile, user_id))
+    for param in KEY_PARAMS:
+        value = getattr(request, param, None)
+        if not value:
+            continue
+        try:
+            key = ndb.Key(urlsafe=value)
+        except Exception:
+            # bad keys are reported by the operation itself
+            continue
+        keys.add(key)
+        # conference -> organiser profile, session -> conference
+        if key.parent():
+            keys.add(key.parent())
+    return list(keys)
+
+
+@ndb.tasklet
+def _warm(method_name, request, user_id):
+    """Read what one operation will need, alongside the other operations."""
+    announcement = None
+    if method_name == 'conference.getAnnouncement':
+        announcement = ANNOUNCEMENT_CACHE.warmAsync()
+    entities = yield repository.getMultiAsync(_keys(request, user_id))
+    if method_name in FOLLOW_ATTENDING and user_id:
+        profile = next((e for e in entities if isinstance(e, Profile)
+                        and e.key.id() == user_id), None)
+        if profile:
+            c_keys = []
+            for wsck in profile.conferenceKeysToAttend:
+                try:
+                    c_keys.append(ndb.Key(urlsafe=wsck))
+                except Exception:
+                    continue
+            # a conference's parent is its organizer's profile
+            yield repository.getMultiAsync(
+                c_keys + list(set(k.parent() for k in c_keys if k.parent())))
+    if announcement is not None:
+        yield announcement
+
+
+def _prefetch(prepared, user_id):
+    """Run every operation's reads concurrently and wait for all of them."""
+    futures = [_warm(op.method, request, user_id)
+               for op, method, request, error in prepared if request]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        # the operation reads again and reports its own error
+        if future.get_exception():
+            logging.warning('batch prefetch failed: %s', future.get_exception())
+
+
+def run(apis, operations):
+    """Run operations in order against apis ({'conference': ConferenceApi(), ...})."""
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise endpoints.BadRequestException(
+            'At most %d operations per batch' % BATCH_MAX_OPERATIONS)
+
+    # authenticate once; the user id is memoized for the whole request
+    user_id = getUserId() if endpoints.get_current_user() else None
+
+    prepared = []
+    for op in operations:
+        try:
+            method = _resolve(apis, op.method)
+            prepared.append((op, method, _decode(method, op.params), None))
+        except endpoints.ServiceException as e:
+            prepared.append((op, None, None, e))
+    _prefetch(prepared, user_id)
+
+    results = []
+    for op, method, request, error in prepared:
+        if error is None:
+            try:
+                response = method(request)
+                results.append(BatchResultForm(
+                    id=op.id, status=200,
+                    body=protojson.encode_message(response)))
+                continue
+            except endpoints.ServiceException as e:
+                error = e
+            except Exception:
+                logging.exception('batch operation %s failed', op.method)
+                error = endpoints.InternalServerErrorException('Internal error')
+        results.append(BatchResultForm(
+            id=op.id, status=error.http_status, error=str(error)))
+    return BatchResponseForm(results=results)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+bench_catalog.py -- queryConferences filtering: in-memory catalog vs datastore
+
+Fills the datastore stub with 1k/10k/100k conferences and times the same
+filter sets through the instance catalog and through the datastore query
+plan. Run it with the App Engine SDK:
+
+    python bench_catalog.py /path/to/google_appengine
+
+"""
+
+import random
+import sys
+import time
+from datetime import date
+
+SIZES = (1000, 10000, 100000)
+REPEAT = 5
+CITIES = ['London', 'Paris', 'Berlin', 'Tokyo', 'Chicago', 'Austin',
+          'Sydney', 'Toronto', 'Madrid', 'Seoul']
+TOPICS = ['Web', 'Cloud', 'Mobile', 'Data', 'Security', 'Games', 'AI',
+          'DevOps']
+
+FILTER_SETS = [
+    ('city', [('city', '=', 'London')]),
+    ('topic+month range', [('topics', '=', 'Cloud'), ('month', '>', '6')]),
+    ('two inequalities', [('maxAttendees', '>', '500'), ('month', '<', '4')]),
+    ('city+topic+seats', [('city', '=', 'Paris'), ('topics', '=', 'Web'),
+                          ('maxAttendees', '>=', '800')]),
+]
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _setup(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+    return tb
+
+
+def _populate(n):
+    from google.appengine.ext import ndb
+    from models import Conference
+    rnd = random.Random(n)
+    confs = []
+    for i in xrange(n):
+        month = rnd.randint(1, 12)
+        seats = rnd.randint(10, 1000)
+        confs.append(Conference(
+            parent=ndb.Key('Profile', 'bench%d' % (i % 50)),
+            name='Conference %06d' % i,
+            description='Benchmark conference %d' % i,
+            organizerUserId='bench%d' % (i % 50),
+            city=rnd.choice(CITIES),
+            topics=rnd.sample(TOPICS, 2),
+            month=month,
+            startDate=date(2026, month, 1),
+            endDate=date(2026, month, 3),
+            maxAttendees=seats,
+            seatsAvailable=seats))
+    for start in xrange(0, n, 500):
+        ndb.put_multi(confs[start:start + 500])
+    return confs
+
+
+def _filters(spec):
+    return [{'field': f, 'operator': op, 'value': v} for f, op, v in spec]
+
+
+def _time(fn):
+    best = None
+    for _ in range(REPEAT):
+        start = time.time()
+        count = len(fn())
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, count
+
+
+def main(sdk_path):
+    tb = _setup(sdk_path)
+    import catalog
+    import query_planner
+
+    print '%8s  %-20s %8s %12s %12s %8s' % (
+        'size', 'filters', 'matches', 'catalog ms', 'datastore ms', 'speedup')
+    for n in SIZES:
+        tb.deactivate()
+        tb = _setup(sdk_path)
+        confs = _populate(n)
+        local = catalog.ConferenceCatalog()
+        for conf in confs:
+            local.upsert(conf)
+        for label, spec in FILTER_SETS:
+            mem_ms, count = _time(lambda: local.query(_filters(spec)))
+            ds_ms, _ = _time(lambda: query_planner.plan(_filters(spec)).fetch())
+            print '%8d  %-20s %8d %12.3f %12.1f %7.0fx' % (
+                n, label, count, mem_ms, ds_ms, ds_ms / max(mem_ms, 0.001))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
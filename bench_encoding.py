@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+bench_encoding.py -- protobuf vs JSON for ConferenceForms and SessionForms
+
+Encodes 100 and 1000 item responses with protorpc.protojson and
+protorpc.protobuf and prints encode time and payload size, raw and
+gzipped (what a mobile client actually downloads). Run it with the App
+Engine SDK:
+
+    python bench_encoding.py /path/to/google_appengine
+
+"""
+
+import gzip
+import random
+import sys
+import time
+from StringIO import StringIO
+
+SIZES = (100, 1000)
+REPEAT = 5
+CITIES = ['London', 'Paris', 'Berlin', 'Tokyo', 'Chicago']
+TOPICS = ['Web', 'Cloud', 'Mobile', 'Data', 'Security']
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _setup(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def _conferences(n):
+    from models import ConferenceForm
+    from models import ConferenceForms
+    rnd = random.Random(n)
+    return ConferenceForms(items=[ConferenceForm(
+        name='Conference %06d' % i,
+        description='Benchmark conference %d' % i,
+        organizerUserId='1234567890%d' % (i % 50),
+        topics=rnd.sample(TOPICS, 2),
+        city=rnd.choice(CITIES),
+        startDate='2026-%02d-01' % rnd.randint(1, 12),
+        endDate='2026-%02d-03' % rnd.randint(1, 12),
+        month=rnd.randint(1, 12),
+        maxAttendees=500,
+        seatsAvailable=rnd.randint(0, 500),
+        websafeKey='ahFzfmRzc2Rldm5hbm8tMTAwMHI7CxIHUHJvZmlsZSIV%06d' % i,
+        organizerDisplayName='Organiser %d' % (i % 50)) for i in xrange(n)])
+
+
+def _sessions(n):
+    from models import SessionForm
+    from models import SessionForms
+    from models import SessionType
+    rnd = random.Random(n)
+    types = list(SessionType)
+    return SessionForms(items=[SessionForm(
+        name='Session %06d' % i,
+        highlights='Highlights of session %d' % i,
+        speaker='Speaker %d' % (i % 40),
+        duration=rnd.choice([30, 45, 60]),
+        typeofsession=rnd.choice(types),
+        date='2026-05-%02d' % rnd.randint(1, 3),
+        starttime='%02d:00' % rnd.randint(9, 18),
+        websafeKey='ahFzfmRzc2Rldm5hbm8tMTAwMHJWCxIHUHJvZmlsZSIV%06d' % i)
+        for i in xrange(n)])
+
+
+def _gzipped(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return len(buf.getvalue())
+
+
+def _time(encode, message):
+    best = None
+    for _ in range(REPEAT):
+        start = time.time()
+        data = encode(message)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, data
+
+
+def main(sdk_path):
+    _setup(sdk_path)
+    from protorpc import protobuf
+    from protorpc import protojson
+
+    print '%-16s %6s %-9s %10s %10s %10s' % (
+        'message', 'items', 'encoding', 'encode ms', 'bytes', 'gzip bytes')
+    for label, build in (('ConferenceForms', _conferences), ('SessionForms', _sessions)):
+        for n in SIZES:
+            message = build(n)
+            for name, encode in (('json', protojson.encode_message),
+                                 ('protobuf', protobuf.encode_message)):
+                ms, data = _time(encode, message)
+                print '%-16s %6d %-9s %10.2f %10d %10d' % (
+                    label, n, name, ms, len(data), _gzipped(data))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
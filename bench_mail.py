@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+bench_mail.py -- confirmation digest throughput and failure handling
+
+Queues confirmations on the pull queue against the taskqueue and mail
+stubs, drains them with mailer.sendConfirmationDigests and reports
+payloads and digests per second. Then mixes in a malformed payload and a
+recipient whose mail always fails, and checks that every other
+recipient gets exactly one digest, the bad payload is dropped, and the
+failing digest is retried until MAX_SEND_ATTEMPTS and then dropped.
+Exits non-zero if a check fails.
+
+    python bench_mail.py /path/to/google_appengine
+
+"""
+
+import os
+import sys
+import time
+from collections import Counter
+from collections import namedtuple
+
+PAYLOADS = 2000
+RECIPIENTS = 400
+BROKEN = 'broken@example.com'
+
+Conf = namedtuple('Conf', ['name', 'city', 'startDate', 'endDate', 'maxAttendees', 'topics'])
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _setup(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_memcache_stub()
+    tb.init_app_identity_stub()
+    tb.init_mail_stub()
+    # queue.yaml declares the pull queue
+    tb.init_taskqueue_stub(root_path=os.path.dirname(os.path.abspath(__file__)))
+    return tb
+
+
+def _queue(count, recipients, prefix):
+    import mailer
+    for i in range(count):
+        mailer.queueConfirmation('user%d@example.com' % (i % recipients),
+                                 Conf('Conference %d' % i, 'London', '2026-05-01',
+                                      '2026-05-02', 100, ['Python']),
+                                 '%s-%d' % (prefix, i))
+
+
+def _sentTo(mail_stub, skip=0):
+    return Counter(message.to for message in mail_stub.get_sent_messages()[skip:])
+
+
+def _check(label, ok):
+    print '%-52s %s' % (label, 'ok' if ok else 'FAILED')
+    return ok
+
+
+def _throughput(mail_stub):
+    import mailer
+    _queue(PAYLOADS, RECIPIENTS, 'bench')
+    start = time.time()
+    digests = mailer.sendConfirmationDigests()
+    seconds = time.time() - start
+    print '%d payloads, %d digests in %.2fs: %.0f payloads/s, %.0f digests/s' % (
+        PAYLOADS, digests, seconds, PAYLOADS / seconds, digests / seconds)
+    sent = _sentTo(mail_stub)
+    return _check('one digest per recipient',
+                  digests == RECIPIENTS and set(sent.values()) == set([1]))
+
+
+def _failures(mail_stub, taskqueue_stub):
+    from google.appengine.api import taskqueue
+    import mailer
+
+    before = len(mail_stub.get_sent_messages())
+    queued = lambda: len(taskqueue_stub.GetTasks(mailer.MAIL_QUEUE))
+    send = mailer._sendDigest
+
+    def failing(email, confs):
+        if email == BROKEN:
+            raise ValueError('injected failure')
+        send(email, confs)
+    mailer._sendDigest = failing
+    mailer.LEASE_SECONDS = 1
+
+    queue = taskqueue.Queue(mailer.MAIL_QUEUE)
+    queue.add([taskqueue.Task(payload='{not json', method='PULL'),
+               taskqueue.Task(payload='{"name": "no recipient"}', method='PULL')])
+    mailer.queueConfirmation(BROKEN, Conf('Broken', None, None, None, 0, []), 'broken')
+    _queue(50, 10, 'mixed')
+
+    mailer.sendConfirmationDigests()
+    sent = _sentTo(mail_stub, before)
+    ok = _check('good recipients mailed once despite a failure',
+                set(sent.values()) == set([1]) and len(sent) == 10)
+    ok = _check('only the failing digest stays queued', queued() == 1) and ok
+
+    for _ in range(mailer.MAX_SEND_ATTEMPTS):
+        time.sleep(mailer.LEASE_SECONDS + 0.1)
+        mailer.sendConfirmationDigests()
+    ok = _check('failing digest dropped after MAX_SEND_ATTEMPTS',
+                queued() == 0) and ok
+    return _check('nothing mailed twice',
+                  set(_sentTo(mail_stub, before).values()) == set([1])) and ok
+
+
+def main(sdk_path):
+    tb = _setup(sdk_path)
+    mail_stub = tb.get_stub('mail')
+    ok = _throughput(mail_stub)
+    ok = _failures(mail_stub, tb.get_stub('taskqueue')) and ok
+    tb.deactivate()
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    sys.exit(0 if main(sys.argv[1]) else 1)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+bench_stale.py -- tail latency of reads under injected datastore delay
+
+Wraps the datastore stub so a share of RPCs stall far beyond the read
+budget (honouring the RPC deadline the way the real datastore does),
+then times getConference and sessionByConf against it. Every call must
+finish within the read budget (plus slack), however many RPCs it makes,
+and slow calls must come back as stale copies. Then checks the two
+fallback paths with every RPC stalled: a read with a known-good copy
+returns it marked stale and queues its refresh, and a read without one
+fails with 503 and a retry hint, both within the budget. Exits non-zero
+if a bound or check fails.
+
+    python bench_stale.py /path/to/google_appengine
+
+"""
+
+import random
+import sys
+import time
+from datetime import date
+from datetime import time as daytime
+
+CALLS = 200
+SLOW_SHARE = 0.2        # share of RPCs that stall
+SLOW_SECONDS = 3.0
+FAST_SECONDS = 0.002
+SLACK_SECONDS = 0.1     # stub and serialization overhead
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _setup(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=sys.path[0] or '.')
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+    return tb
+
+
+def _slowDatastore(rnd):
+    """Replace the datastore stub with one whose RPCs sometimes stall."""
+    from google.appengine.api import apiproxy_rpc
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.runtime import apiproxy_errors
+
+    stub = apiproxy_stub_map.apiproxy.GetStub('datastore_v3')
+    state = {'slow': False, 'share': SLOW_SHARE}
+
+    class DeadlineRPC(apiproxy_rpc.RPC):
+        def _MakeCallImpl(self):
+            delay = SLOW_SECONDS if state['slow'] and rnd.random() < state['share'] else FAST_SECONDS
+            if self.deadline is not None and delay > self.deadline:
+                time.sleep(self.deadline)
+                self._exception = apiproxy_errors.DeadlineExceededError(
+                    'injected delay of %.1fs' % delay)
+                self._state = apiproxy_rpc.RPC.FINISHING
+                return
+            time.sleep(delay)
+            super(DeadlineRPC, self)._MakeCallImpl()
+
+    class SlowStub(object):
+        def __getattr__(self, name):
+            return getattr(stub, name)
+
+        def CreateRPC(self):
+            return DeadlineRPC(stub=self)
+
+        def MakeSyncCall(self, service, call, request, response, request_id=None):
+            stub.MakeSyncCall(service, call, request, response)
+
+    apiproxy_stub_map.apiproxy.ReplaceStub('datastore_v3', SlowStub())
+    return state
+
+
+def _populate():
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import Speaker
+    p_key = Profile(id='bench', displayName='Bench').put()
+    conf = Conference(parent=p_key, name='Bench conference', city='London',
+                      organizerUserId='bench', startDate=date(2026, 5, 1),
+                      month=5, maxAttendees=100, seatsAvailable=100)
+    conf.put()
+    speaker = Speaker(name='Bench speaker').put()
+    ndb.put_multi([Session(parent=conf.key, name='Session %d' % i,
+                           speaker=speaker, duration=30,
+                           date=date(2026, 5, 1), starttime=daytime(9 + i % 8, 0))
+                   for i in range(20)])
+    return conf.key.urlsafe()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _run(label, call, bound):
+    import endpoints
+    latencies, stale, errors = [], 0, 0
+    for _ in range(CALLS):
+        start = time.time()
+        try:
+            response = call()
+            stale += bool(response.stale)
+        except endpoints.ServiceException:
+            errors += 1
+        latencies.append(time.time() - start)
+    worst = max(latencies)
+    ok = worst <= bound
+    print '%-16s %8.1f %8.1f %8.1f %8.1f %6d %6d  %s' % (
+        label, _percentile(latencies, 0.5) * 1000,
+        _percentile(latencies, 0.99) * 1000, worst * 1000, bound * 1000,
+        stale, errors, 'ok' if ok else 'OVER BOUND')
+    return ok
+
+
+def _check(label, ok):
+    print '%-52s %s' % (label, 'ok' if ok else 'FAILED')
+    return ok
+
+
+def _timed(call):
+    start = time.time()
+    try:
+        return call(), None, time.time() - start
+    except Exception as e:
+        return None, e, time.time() - start
+
+
+def _fallbacks(tb, state, get_conf, by_conf, bound):
+    """With every RPC stalled: stale copy if there is one, else 503."""
+    from google.appengine.api import memcache
+    import stale
+
+    state['share'] = 1.0
+    ok = True
+    for label, call in (('getConference', get_conf), ('sessionByConf', by_conf)):
+        response, error, seconds = _timed(call)
+        ok = _check('%s serves its stale copy within budget' % label,
+                    error is None and response.stale and seconds <= bound) and ok
+    refreshes = [t for t in tb.get_stub('taskqueue').GetTasks('default')
+                 if t['url'] == '/tasks/refresh_response']
+    ok = _check('stale reads queue their refresh', len(refreshes) >= 2) and ok
+
+    memcache.flush_all()
+    response, error, seconds = _timed(get_conf)
+    ok = _check('no known-good copy: 503 with retry hint within budget',
+                isinstance(error, stale.ServiceUnavailableException) and
+                error.http_status == 503 and error.retryAfter and seconds <= bound) and ok
+    state['share'] = SLOW_SHARE
+    return ok
+
+
+def main(sdk_path):
+    tb = _setup(sdk_path)
+    import stale
+    from conference import ConferenceApi
+    from conference import CONF_GET_REQUEST
+    from con_session import SessionApi
+    from con_session import SESSION_FOR_CONFERENCE_GET_REQUEST
+
+    wsck = _populate()
+    state = _slowDatastore(random.Random(0))
+    conf_api, session_api = ConferenceApi(), SessionApi()
+    get_conf = lambda: conf_api.getConference(
+        CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck))
+    by_conf = lambda: session_api.sessionByConf(
+        SESSION_FOR_CONFERENCE_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck))
+
+    # fast reads store the known-good copies
+    get_conf()
+    by_conf()
+    state['slow'] = True
+
+    print '%-16s %8s %8s %8s %8s %6s %6s' % (
+        'endpoint', 'p50 ms', 'p99 ms', 'max ms', 'bound', 'stale', '503')
+    # both make two RPCs (getConference: conference + organiser profile;
+    # sessionByConf: query + speaker batch get) and share one budget
+    bound = stale.READ_BUDGET + SLACK_SECONDS
+    ok = _run('getConference', get_conf, bound)
+    ok = _run('sessionByConf', by_conf, bound) and ok
+    ok = _fallbacks(tb, state, get_conf, by_conf, bound) and ok
+    tb.deactivate()
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    sys.exit(0 if main(sys.argv[1]) else 1)
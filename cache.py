@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- two-tier read-through cache with stampede protection
+
+Values live in memcache (L2) wrapped in an envelope carrying a soft expiry,
+and each instance keeps a short-lived copy (L1). Once the soft expiry
+passes, the first reader to win a memcache add() lease queues a background
+refresh and everyone keeps serving the stale value until it lands. On a
+hard miss (evicted or never set) the lease holder rebuilds inline while
+the other readers poll memcache for its result instead of all running the
+rebuild query at once.
+
+Rebuild functions are given as dotted paths ('module.function') so the
+refresh task only imports what it needs.
+
+"""
+
+import logging
+import time
+
+import webapp2
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+LEASE_SUFFIX = ':lease'
+WAIT_POLLS = 10
+WAIT_INTERVAL = 0.1         # seconds between polls while another request rebuilds
+
+CACHES = {}                 # memcache key -> ReadThroughCache
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class ReadThroughCache(object):
+    """One memcache key backed by a rebuild function."""
+
+    def __init__(self, key, rebuild, soft_ttl, local_ttl=10, lease_seconds=30):
+        self.key = key
+        self.rebuild = rebuild
+        self.soft_ttl = soft_ttl
+        self.local_ttl = local_ttl
+        self.lease_seconds = lease_seconds
+        self._local = None                  # (envelope, local expiry)
+        CACHES[key] = self
+
+    def _envelope(self, value):
+        return {'value': value, 'freshUntil': time.time() + self.soft_ttl}
+
+    def _keep(self, envelope):
+        self._local = (envelope, time.time() + self.local_ttl)
+        return envelope['value']
+
+    def _acquireLease(self):
+        return memcache.add(self.key + LEASE_SUFFIX, 1, time=self.lease_seconds)
+
+    def _releaseLease(self):
+        memcache.delete(self.key + LEASE_SUFFIX)
+
+    def get(self):
+        """Return the cached value, rebuilding or refreshing as needed."""
+        now = time.time()
+        local = self._local
+        if local and local[1] > now:
+            return local[0]['value']
+
+        envelope = memcache.get(self.key)
+        if envelope is not None:
+            if envelope['freshUntil'] <= now and self._acquireLease():
+                self._refreshInBackground()
+            return self._keep(envelope)
+
+        # hard miss: exactly one request rebuilds, the rest wait for it
+        if self._acquireLease():
+            return self.refresh()
+        for _ in range(WAIT_POLLS):
+            time.sleep(WAIT_INTERVAL)
+            envelope = memcache.get(self.key)
+            if envelope is not None:
+                return self._keep(envelope)
+        logging.warning('gave up waiting for %s to be rebuilt', self.key)
+        return None
+
+    @ndb.tasklet
+    def warmAsync(self):
+        """Load a fresh memcache copy into L1 without blocking other reads.
+
+        A stale or missing value is left for get() to refresh or rebuild.
+        """
+        local = self._local
+        if local and local[1] > time.time():
+            return
+        envelope = yield ndb.get_context().memcache_get(self.key)
+        if envelope is not None and envelope['freshUntil'] > time.time():
+            self._keep(envelope)
+
+    def set(self, value):
+        """Store a freshly computed value in both tiers."""
+        envelope = self._envelope(value)
+        # no hard expiry: a stale copy is still served while refreshing
+        memcache.set(self.key, envelope)
+        self._keep(envelope)
+
+    def refresh(self):
+        """Rebuild the value now and store it; releases the lease."""
+        try:
+            value = webapp2.import_string(self.rebuild)()
+            self.set(value)
+            return value
+        finally:
+            self._releaseLease()
+
+    def _refreshInBackground(self):
+        try:
+            taskqueue.add(params={'key': self.key, 'rebuild': self.rebuild},
+                          url='/tasks/refresh_cache')
+        except taskqueue.Error:
+            logging.exception('could not queue refresh of %s', self.key)
+            self._releaseLease()
+
+
+def refreshCache(key, rebuild):
+    """Task entry point: rebuild the cache registered under key."""
+    # importing the rebuild function's module registers its cache
+    webapp2.import_string(rebuild)
+    CACHES[key].refresh()
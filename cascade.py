@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+cascade.py -- batched delete of a conference and everything hanging off it
+
+deleteConference removes the Conference entity and takes it out of the
+rollups in one transaction, so reads stop seeing it at once, and then
+queues the cascade as a chain of named tasks:
+
+  - 'group': keys_only ancestor queries delete the rest of the entity
+    group (sessions, schedule, conference rollup) DELETE_BATCH keys at
+    a time, with the sessions' search documents;
+  - 'profiles': registrations and wishlists are not indexed, so the
+    profiles are walked PROFILE_BATCH at a time and each one that still
+    holds the conference or one of its sessions is fixed in its own
+    transaction.
+
+Task names carry the conference, stage and batch number, so a retried
+task can't fork the chain. Read paths skip keys that no longer resolve,
+so nothing breaks while the cascade is running.
+
+"""
+
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import agenda
+import catalog
+from models import Profile
+import repository
+import rollups
+import schedule
+import search_index
+
+DELETE_BATCH = 200          # also the Search API's limit per delete
+PROFILE_BATCH = 100
+CASCADE_TASK_URL = '/tasks/delete_conference'
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def deleteConference(c_key):
+    """Delete a conference and queue the removal of what depends on it.
+
+    Returns the deleted Conference, or None if there was none.
+    """
+    @repository.transactional(xg=True)
+    def txn():
+        conf = repository.get(c_key)
+        if conf is None:
+            return None
+        counts = rollups.conferenceDeltas(conf, sign=-1)
+        rollups.sessionTypeDeltas(rollups.sessionsByType(c_key), sign=-1, counts=counts)
+        rollups.increment(counts)
+        repository.deleteMulti([c_key])
+        _enqueue(c_key, 'group', 0, transactional=True)
+        return conf
+
+    conf = txn()
+    if conf is not None:
+        search_index.unindex(search_index.CONFERENCE_INDEX, [c_key])
+        catalog.remove(c_key.urlsafe())
+    return conf
+
+
+def _enqueue(c_key, stage, batch, cursor=None, transactional=False):
+    params = {'conference': c_key.urlsafe(), 'stage': stage,
+              'batch': batch, 'cursor': cursor or ''}
+    if transactional:
+        # transactional tasks can't be named; it only runs if the delete commits
+        taskqueue.add(url=CASCADE_TASK_URL, params=params, transactional=True)
+        return
+    try:
+        taskqueue.add(name='delete-%s-%s-%d' % (c_key.urlsafe(), stage, batch),
+                      url=CASCADE_TASK_URL, params=params)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def _deleteGroup(c_key, batch):
+    """Delete one batch of the conference's entity group."""
+    keys = ndb.Query(ancestor=c_key).fetch(DELETE_BATCH, keys_only=True)
+    sessions = [key for key in keys if key.kind() == 'Session']
+    if sessions:
+        search_index.unindex(search_index.SESSION_INDEX, sessions)
+    ndb.delete_multi(keys)
+    if len(keys) == DELETE_BATCH:
+        _enqueue(c_key, 'group', batch + 1)
+    else:
+        memcache.delete(schedule.MEMCACHE_SCHEDULE_KEY % c_key.urlsafe())
+        _enqueue(c_key, 'profiles', 0)
+    return len(keys)
+
+
+@ndb.transactional
+def _cleanProfile(p_key, wsck, c_key):
+    prof = p_key.get()
+    if prof is None:
+        return False
+    favorites = [s_key for s_key in prof.favoriteSessions if s_key.parent() != c_key]
+    if wsck not in prof.conferenceKeysToAttend and len(favorites) == len(prof.favoriteSessions):
+        return False
+    prof.conferenceKeysToAttend = [k for k in prof.conferenceKeysToAttend if k != wsck]
+    prof.favoriteSessions = favorites
+    prof.put()
+    return True
+
+
+def _cleanProfiles(c_key, batch, cursor):
+    """Remove the conference and its sessions from one page of profiles."""
+    wsck = c_key.urlsafe()
+    profiles, next_cursor, more = Profile.query().fetch_page(
+        PROFILE_BATCH, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    cleaned = 0
+    for prof in profiles:
+        # only profiles that hold a reference pay for a transaction
+        if (wsck in prof.conferenceKeysToAttend or
+                any(s_key.parent() == c_key for s_key in prof.favoriteSessions)):
+            if _cleanProfile(prof.key, wsck, c_key):
+                agenda.invalidate(prof.key.id())
+                cleaned += 1
+    if more and next_cursor:
+        _enqueue(c_key, 'profiles', batch + 1, next_cursor.urlsafe())
+    return cleaned
+
+
+def cascadeTask(wsck, stage, batch, cursor=None):
+    """Task entry point: run one batch of a conference's cascade."""
+    c_key = ndb.Key(urlsafe=wsck)
+    if stage == 'group':
+        count = _deleteGroup(c_key, batch)
+    else:
+        count = _cleanProfiles(c_key, batch, cursor)
+    logging.info('delete %s: %s batch %d handled %d entities', wsck, stage, batch, count)
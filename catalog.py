@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""
+catalog.py -- instance-resident columnar catalog of conferences
+
+The catalog of current (not archived) conferences is small enough to keep
+in every instance, so queryConferences answers from memory instead of
+going to the datastore.
+Rows are stored column-wise (arrays for the integer properties, lists for
+the rest) with secondary indexes on city, topic, month and maxAttendees,
+which makes any mix of filters, including inequalities on several fields,
+a matter of set intersections and a residual scan.
+
+Writers bump a generation counter in memcache. The next query on each
+instance notices the new generation and pulls only the conferences whose
+'updated' timestamp moved since its last refresh. A deleted conference
+can't be found that way, so deletes bump a reset counter instead and
+every instance reloads its catalog.
+
+"""
+
+import bisect
+import threading
+import time
+from array import array
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+
+from models import Conference
+import query_planner
+import repository
+
+MEMCACHE_CATALOG_GENERATION_KEY = 'CATALOG_GENERATION'
+MEMCACHE_CATALOG_RESET_KEY = 'CATALOG_RESET'
+MEMCACHE_CATALOG_CHANGED_KEY = 'CATALOG_CHANGED'
+CATALOG_MAX_AGE = 300                    # refresh at least this often (s)
+CATALOG_SKEW = timedelta(seconds=30)     # re-read overlap for lagging indexes
+
+COMPARATORS = repository.COMPARATORS
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class ConferenceRow(object):
+    """Read-only view of one catalog row, shaped like a Conference."""
+    __slots__ = ('websafeKey', 'name', 'description', 'organizerUserId',
+                 'topics', 'city', 'startDate', 'endDate', 'month',
+                 'maxAttendees', 'seatsAvailable')
+
+    def __init__(self, catalog, i):
+        self.websafeKey = catalog.keys[i]
+        self.name = catalog.names[i]
+        self.description = catalog.descriptions[i]
+        self.organizerUserId = catalog.organizers[i]
+        self.topics = list(catalog.topics[i])
+        self.city = catalog.cities[i]
+        self.startDate = catalog.startDates[i]
+        self.endDate = catalog.endDates[i]
+        self.month = catalog.months[i]
+        self.maxAttendees = catalog.maxAttendees[i]
+        self.seatsAvailable = catalog.seatsAvailable[i]
+
+
+class ConferenceCatalog(object):
+    """Columnar conference store with secondary indexes."""
+
+    def __init__(self):
+        self.rows = {}                  # websafe key -> row id
+        self.keys = []
+        self.names = []
+        self.descriptions = []
+        self.organizers = []
+        self.topics = []                # tuples
+        self.cities = []
+        self.startDates = []
+        self.endDates = []
+        self.months = array('l')
+        self.maxAttendees = array('l')
+        self.seatsAvailable = array('l')
+        self.live = set()               # row ids of current conferences
+        self.byCity = {}
+        self.byTopic = {}
+        self.byMonth = {}
+        self._byMaxAttendees = None     # sorted (value, row id), built lazily
+
+    def __len__(self):
+        return len(self.live)
+
+    def _unindex(self, i):
+        self.byCity.get(self.cities[i], set()).discard(i)
+        self.byMonth.get(self.months[i], set()).discard(i)
+        for topic in self.topics[i]:
+            self.byTopic.get(topic, set()).discard(i)
+
+    def _index(self, i):
+        self.byCity.setdefault(self.cities[i], set()).add(i)
+        self.byMonth.setdefault(self.months[i], set()).add(i)
+        for topic in self.topics[i]:
+            self.byTopic.setdefault(topic, set()).add(i)
+
+    def upsert(self, conf):
+        """Insert or replace the row for a Conference entity.
+
+        Archived conferences are dropped from the catalog.
+        """
+        wsck = conf.key.urlsafe()
+        i = self.rows.get(wsck)
+        if conf.archived:
+            self.drop(wsck)
+            return
+        values = (conf.name, conf.description, conf.organizerUserId,
+                  tuple(conf.topics), conf.city, conf.startDate, conf.endDate,
+                  conf.month or 0, conf.maxAttendees or 0,
+                  conf.seatsAvailable or 0)
+        if i is None:
+            i = self.rows[wsck] = len(self.keys)
+            self.keys.append(wsck)
+            for column, value in zip(self._columns(), values):
+                column.append(value)
+        else:
+            self._unindex(i)
+            for column, value in zip(self._columns(), values):
+                column[i] = value
+        self.live.add(i)
+        self._index(i)
+        self._byMaxAttendees = None
+
+    def drop(self, wsck):
+        """Take a conference out of the catalog."""
+        i = self.rows.get(wsck)
+        if i is not None and i in self.live:
+            self._unindex(i)
+            self.live.discard(i)
+            self._byMaxAttendees = None
+
+    def _columns(self):
+        return (self.names, self.descriptions, self.organizers, self.topics,
+                self.cities, self.startDates, self.endDates, self.months,
+                self.maxAttendees, self.seatsAvailable)
+
+    def _column(self, field):
+        return {
+            'name': self.names,
+            'city': self.cities,
+            'topics': self.topics,
+            'month': self.months,
+            'maxAttendees': self.maxAttendees,
+            'startDate': self.startDates,
+            'endDate': self.endDates,
+        }[field]
+
+    def _maxAttendeesRange(self, op, value):
+        """Row ids whose maxAttendees satisfies op value, via bisect."""
+        if self._byMaxAttendees is None:
+            self._byMaxAttendees = sorted(
+                (self.maxAttendees[i], i) for i in self.live)
+        values = self._byMaxAttendees
+        if op == '>':
+            lo, hi = bisect.bisect_right(values, (value, float('inf'))), len(values)
+        elif op == '>=':
+            lo, hi = bisect.bisect_left(values, (value, -1)), len(values)
+        elif op == '<':
+            lo, hi = 0, bisect.bisect_left(values, (value, -1))
+        elif op == '<=':
+            lo, hi = 0, bisect.bisect_right(values, (value, float('inf')))
+        else:
+            lo, hi = bisect.bisect_left(values, (value, -1)), \
+                bisect.bisect_right(values, (value, float('inf')))
+        return set(i for v, i in values[lo:hi])
+
+    def _candidates(self, filtr):
+        """Row ids for filtr from a secondary index, or None if not indexed."""
+        field, op, value = filtr['field'], filtr['operator'], filtr['value']
+        if op == '=':
+            index = {'city': self.byCity, 'topics': self.byTopic,
+                     'month': self.byMonth}.get(field)
+            if index is not None:
+                return index.get(value, set())
+        if field == 'maxAttendees' and op != '!=':
+            return self._maxAttendeesRange(op, value)
+        if field == 'month' and op != '=':
+            compare = COMPARATORS[op]
+            ids = set()
+            for month, rows in self.byMonth.iteritems():
+                if compare(month, value):
+                    ids |= rows
+            return ids
+        return None
+
+    def _matches(self, i, filtr):
+        value = self._column(filtr['field'])[i]
+        op = filtr['operator']
+        if isinstance(value, tuple):
+            return any(repository.compare(op, v, filtr['value']) for v in value)
+        return repository.compare(op, value, filtr['value'])
+
+    def query(self, filters, inequality_field=None):
+        """Return ConferenceRows matching every filter.
+
+        filters are formatted as by _formatFilters and may hold
+        inequalities on any number of fields. Rows come back ordered by
+        the first inequality field, then name, like the datastore query.
+        """
+        query_planner.convertFilters(filters)
+        ids = None
+        residual = []
+        # intersect the index hits, smallest first; scan for the rest
+        indexed = []
+        for filtr in filters:
+            candidates = self._candidates(filtr)
+            if candidates is None:
+                residual.append(filtr)
+            else:
+                indexed.append(candidates)
+        for candidates in sorted(indexed, key=len):
+            ids = set(candidates) if ids is None else ids & candidates
+            if not ids:
+                return []
+        if ids is None:
+            ids = self.live
+        ids = [i for i in ids if i in self.live and
+               all(self._matches(i, f) for f in residual)]
+
+        names = self.names
+        if inequality_field:
+            column = self._column(inequality_field)
+            # startDate and endDate may be None, sorted first as in the datastore
+            ids.sort(key=lambda i: (repository.sortKey(column[i]), names[i]))
+        else:
+            ids.sort(key=names.__getitem__)
+        return [ConferenceRow(self, i) for i in ids]
+
+
+class _InstanceCatalog(object):
+    """The per-instance catalog plus its refresh bookkeeping."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.catalog = None
+        self.generation = None
+        self.reset = None
+        self.refreshedAt = None         # datastore time of the last refresh
+        self.checkedAt = 0
+
+    def _load(self, since=None):
+        # a refresh also reads newly archived conferences, to drop them
+        filters = ([('updated', '>=', since - CATALOG_SKEW)] if since else
+                   [('archived', '=', False)])
+        for conf in repository.query(Conference, filters=filters):
+            self.catalog.upsert(conf)
+
+    def current(self):
+        """Return the catalog, refreshing it first if it is out of date."""
+        counters = memcache.get_multi([MEMCACHE_CATALOG_GENERATION_KEY,
+                                       MEMCACHE_CATALOG_RESET_KEY])
+        generation = counters.get(MEMCACHE_CATALOG_GENERATION_KEY)
+        reset = counters.get(MEMCACHE_CATALOG_RESET_KEY)
+        with self.lock:
+            stale = (self.catalog is None or generation != self.generation or
+                     reset != self.reset or
+                     time.time() - self.checkedAt > CATALOG_MAX_AGE)
+            if stale:
+                started = datetime.utcnow()
+                if self.catalog is None or reset != self.reset:
+                    # deletions don't show up in an 'updated' refresh
+                    self.catalog = ConferenceCatalog()
+                    self._load()
+                else:
+                    self._load(self.refreshedAt)
+                self.generation = generation
+                self.reset = reset
+                self.refreshedAt = started
+                self.checkedAt = time.time()
+            return self.catalog
+
+
+_instance = _InstanceCatalog()
+
+
+def query(filters, inequality_field=None):
+    """Evaluate formatted conference filters against the local catalog."""
+    catalog = _instance.current()
+    with _instance.lock:
+        return catalog.query(filters, inequality_field)
+
+
+def version():
+    """(generation, reset, time of the last change) of the conference set.
+
+    Read from memcache, so every instance sees the same version whatever
+    its own catalog has caught up with.
+    """
+    counters = memcache.get_multi([MEMCACHE_CATALOG_GENERATION_KEY,
+                                   MEMCACHE_CATALOG_RESET_KEY,
+                                   MEMCACHE_CATALOG_CHANGED_KEY])
+    return (counters.get(MEMCACHE_CATALOG_GENERATION_KEY),
+            counters.get(MEMCACHE_CATALOG_RESET_KEY),
+            counters.get(MEMCACHE_CATALOG_CHANGED_KEY))
+
+
+def warm():
+    """Load the catalog on this instance ahead of the first query."""
+    _instance.current()
+
+
+def invalidate():
+    """Signal every instance that conferences (or what their responses
+    show, such as organizer names) changed."""
+    memcache.set(MEMCACHE_CATALOG_CHANGED_KEY, datetime.utcnow())
+    memcache.incr(MEMCACHE_CATALOG_GENERATION_KEY, initial_value=0)
+
+
+def remove(wsck):
+    """Drop a deleted conference here and have every other instance
+    reload its catalog."""
+    with _instance.lock:
+        if _instance.catalog is not None:
+            _instance.catalog.drop(wsck)
+    memcache.set(MEMCACHE_CATALOG_CHANGED_KEY, datetime.utcnow())
+    memcache.incr(MEMCACHE_CATALOG_RESET_KEY, initial_value=0)
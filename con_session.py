@@ -7,8 +7,7 @@ Session API endpoint
 
 
 from datetime import datetime
-import json
-import os
+import logging
 import time
 
 import endpoints
@@ -16,11 +15,7 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
-from google.appengine.ext.db import GqlQuery
 
 from models import Session
 from models import SessionForm
@@ -28,10 +23,27 @@ from models import SessionForms
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerPageForm
+from models import SpeakerProfileForm
 from models import SpeakerQueryForm
 from models import Profile
 from models import SessionType
 from models import FeaturedSpeakerForm
+from models import FacetForm
+from models import FacetValueForm
+from models import SearchQueryForm
+from models import SessionSearchForms
+from models import ScheduleEntryForm
+from models import ScheduleForm
+from announcements import FEATURED_SPEAKER_CACHE
+from auth import getUserId as _getUserId
+import agenda
+import field_masks
+import query_planner
+import repository
+import schedule
+import speakers
+import stale
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -45,47 +57,81 @@ MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
 	SessionForm,
-	websafeConferenceKey=messages.StringField(1)
+	websafeConferenceKey=messages.StringField(1),
+	requestId=messages.StringField(2)
 )
 
 SESSION_FOR_CONFERENCE_GET_REQUEST = endpoints.ResourceContainer(
-    websafeConferenceKey=messages.StringField(1)
+    websafeConferenceKey=messages.StringField(1),
+    fieldMask=messages.StringField(2)
 )
 
 SESSION_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
-    typeOfSession=messages.EnumField(SessionType, 2)
+    typeOfSession=messages.EnumField(SessionType, 2),
+    fieldMask=messages.StringField(3)
 )
 
-SESSION_KEY_POST = endpoints.ResourceContainer(
-    websafeSessionKey=messages.StringField(1)
+SESSION_BY_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    SpeakerForm,
+    fieldMask=messages.StringField(3),
+    includeArchived=messages.BooleanField(4),
+    pageSize=messages.IntegerField(5, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(6)
 )
 
+SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    websafeSpeakerKey=messages.StringField(1),
+    fieldMask=messages.StringField(2),
+    includeArchived=messages.BooleanField(3),
+    pageSize=messages.IntegerField(4, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(5)
+)
 
-def _getUserId():
-    """A workaround implementation for getting userid."""
-    auth = os.getenv('HTTP_AUTHORIZATION')
-    bearer, token = auth.split()
-    token_type = 'id_token'
-    if 'OAUTH_USER_ID' in os.environ:
-        token_type = 'access_token'
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-           % (token_type, token))
-    user = {}
-    wait = 1
-    for i in range(3):
-        resp = urlfetch.fetch(url)
-        if resp.status_code == 200:
-            user = json.loads(resp.content)
-            break
-        elif resp.status_code == 400 and 'invalid_token' in resp.content:
-            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                   % ('access_token', token))
-        else:
-            time.sleep(wait)
-            wait = wait + i
-    return user.get('user_id', '')
+SPEAKER_POST_REQUEST = endpoints.ResourceContainer(
+    SpeakerProfileForm,
+    websafeSpeakerKey=messages.StringField(6)
+)
 
+SESSION_LIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1)
+)
+
+SESSION_QUERY_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1),
+    includeArchived=messages.BooleanField(2)
+)
+
+SCHEDULE_GET_REQUEST = endpoints.ResourceContainer(
+    websafeConferenceKey=messages.StringField(1),
+    date=messages.StringField(2),
+    startTime=messages.StringField(3),
+    endTime=messages.StringField(4)
+)
+
+SESSION_KEY_POST = endpoints.ResourceContainer(
+    websafeSessionKey=messages.StringField(1),
+    requestId=messages.StringField(2)
+)
+
+OPERATORS = {
+            'EQ':   '=',
+            'GT':   '>',
+            'GTEQ': '>=',
+            'LT':   '<',
+            'LTEQ': '<=',
+            'NE':   '!='
+            }
+
+FIELDS =    {
+            'TYPE': 'typeofsession',
+            'SPEAKER': 'speaker',
+            'DATE': 'date',
+            'START_TIME': 'starttime',
+            'DURATION': 'duration',
+            }
 
 
 @endpoints.api(name='session', version='v1',
@@ -95,17 +141,27 @@ def _getUserId():
 class SessionApi(remote.Service):
     """Session API v0.1"""
 
-    def _copySessionToForm(self, session):
-        """Create SessionForm object from Session entity"""
+    def _speakerNames(self, sessions):
+        """Return {speaker key: name} for sessions, with one batch get"""
+        keys = list(set(session.speaker for session in sessions if session.speaker))
+        return dict((speaker.key, speaker.name)
+                    for speaker in repository.getMulti(keys) if speaker)
+
+    def _copySessionToForm(self, session, fields=None, speakerNames=None):
+        """Create SessionForm object from Session entity, limited to the fields mask if given"""
         sf = SessionForm()
         for field in sf.all_fields():
+            if fields is not None and field.name not in fields:
+                continue
             if hasattr(session, field.name):
             #need strings for date/time property and speaker - Enum for session
                 if field.name in ['date', 'starttime']:
                     setattr(sf, field.name, str(getattr(session, field.name)))
                 #get the speaker name from the key
                 elif field.name == 'speaker':
-                    setattr(sf, field.name, getattr(session, field.name).get().name)
+                    if speakerNames is None:
+                        speakerNames = self._speakerNames([session])
+                    setattr(sf, field.name, speakerNames.get(getattr(session, field.name)))
                 #get enum for session
                 elif field.name == 'typeofsession' and getattr(session, field.name) is not None:
                     setattr(sf, field.name, getattr(SessionType, getattr(session, field.name)))
@@ -116,17 +172,24 @@ class SessionApi(remote.Service):
         sf.check_initialized()
         return sf
 
-    def _copySessionToForms(self, sessions):
+    def _copySessionToForms(self, sessions, fields=None, speakerNames=None):
         """
         Create SessionForms for multiple sessions
         :param sessions: List of session entities
+        :param fields: optional set of SessionForm field names to copy
+        :param speakerNames: optional {speaker key: name} already known
         :return: SessionForms for given sessions
         """
         sfs = SessionForms()
         sfList = []
 
+        #one batch get for the speaker names instead of a get per session
+        names = speakerNames or {}
+        if speakerNames is None and field_masks.wants(fields, 'speaker'):
+            names = self._speakerNames(sessions)
+
         for session in sessions:
-            sfList.append(self._copySessionToForm(session))
+            sfList.append(self._copySessionToForm(session, fields, names))
 
         return SessionForms(items=sfList)
 
@@ -140,7 +203,7 @@ class SessionApi(remote.Service):
         # get Profile from datastore
         user_id = _getUserId()
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = repository.get(p_key)
         # create new Profile if not there
         if not profile:
             raise endpoints.BadRequestException('No profile exists')
@@ -156,11 +219,10 @@ class SessionApi(remote.Service):
         :param request: form request data
         :return: List of SpeakerFrom for query result
         """
-        speakers = Speaker()
         if request.name is None:
-           speakers = speakers.query().fetch()
+           speakers = repository.query(Speaker)
         else:
-           speakers = speakers.query(Speaker.name == request.name).fetch()
+           speakers = repository.query(Speaker, filters=[('name', '=', request.name)])
         sfList = []
 
         for speaker in speakers:
@@ -170,13 +232,39 @@ class SessionApi(remote.Service):
             sfList.append(sf)
         return SpeakerForms(items=sfList)
 
-    @endpoints.method(SpeakerForm,SpeakerForm, path='speaker', http_method='POST', 
+    def _copySpeakerToForm(self, speaker):
+        """Create SpeakerProfileForm from a Speaker entity"""
+        return SpeakerProfileForm(name=speaker.name,
+                                  websafeKey=speaker.key.urlsafe(),
+                                  bio=speaker.bio,
+                                  organization=speaker.organization,
+                                  photoUrl=speaker.photoUrl)
+
+    def _speakerKey(self, websafeSpeakerKey):
+        """Key for a websafe speaker key; 404 if it isn't one"""
+        try:
+            sp_key = ndb.Key(urlsafe=websafeSpeakerKey)
+        except Exception:
+            raise endpoints.NotFoundException('No speaker found with key: %s' % websafeSpeakerKey)
+        if sp_key.kind() != Speaker._get_kind():
+            raise endpoints.NotFoundException('No speaker found with key: %s' % websafeSpeakerKey)
+        return sp_key
+
+    def _speakerPage(self, sp_key, request):
+        """speakers.page for the request's pageToken, pageSize and includeArchived"""
+        try:
+            return speakers.page(sp_key, request.pageToken, request.pageSize,
+                                 request.includeArchived)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken")
+
+    @endpoints.method(SpeakerProfileForm,SpeakerProfileForm, path='speaker', http_method='POST', 
     	name='createSpeaker')
     def createSpeaker(self, request):
         """
         Add a speaker
-        :param request: form data with speaker name
-        :return: the request that was processed
+        :param request: form data with speaker name, optional bio, organization and photoUrl
+        :return: the speaker created, with its websafeKey
         """
     	if not request.name:
     		raise endpoints.BadRequestException("Speaker name required")
@@ -184,19 +272,96 @@ class SessionApi(remote.Service):
     	data = {field.name: getattr(request, field.name) for field in request.all_fields()}
     	speaker = Speaker()
     	speaker.name = data["name"]
+    	speaker.bio = data["bio"]
+    	speaker.organization = data["organization"]
+    	speaker.photoUrl = data["photoUrl"]
+    	speaker.creatorUserId = _getUserId() if endpoints.get_current_user() else None
+    	#a new speaker has no sessions to index yet
+    	speaker.sessionsIndexed = True
 
-    	speaker.put()
+    	repository.put(speaker)
 
-        return request
+        return self._copySpeakerToForm(speaker)
+
+    @endpoints.method(SPEAKER_POST_REQUEST, SpeakerProfileForm, path='speaker/{websafeSpeakerKey}',
+                      http_method='POST', name='updateSpeaker')
+    def updateSpeaker(self, request):
+        """
+        Update a speaker's bio, organization and photoUrl. Only the user who
+        created the speaker or the organizer of a conference the speaker has a
+        session in may do so. The name can't be changed here, schedules and
+        search documents carry it.
+        :param request: SpeakerProfileForm with the fields to change + speaker key
+        :return: the updated speaker
+        """
+        if not endpoints.get_current_user():
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = _getUserId()
+        sp_key = self._speakerKey(request.websafeSpeakerKey)
+        speaker = repository.get(sp_key)
+        if speaker is None:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.websafeSpeakerKey)
+        if speaker.creatorUserId != user_id and not speakers.organizes(sp_key, user_id):
+            raise endpoints.ForbiddenException(
+                'Only the speaker\'s creator or one of their organizers can update it')
+
+        @repository.transactional()
+        def txn():
+            speaker = repository.get(sp_key)
+            if speaker is None:
+                return None
+            for field in ('bio', 'organization', 'photoUrl'):
+                if getattr(request, field) is not None:
+                    setattr(speaker, field, getattr(request, field))
+            repository.put(speaker)
+            return speaker
+
+        speaker = txn()
+        if speaker is None:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.websafeSpeakerKey)
+        return self._copySpeakerToForm(speaker)
+
+    @endpoints.method(SPEAKER_GET_REQUEST, SpeakerPageForm, path='speaker/{websafeSpeakerKey}',
+                      http_method='GET', name='getSpeaker')
+    def getSpeaker(self, request):
+        """
+        Speaker page: the profile and one page of sessions across conferences,
+        in date and time order, from the speaker's session index
+        :param request: speaker key, optional fieldMask, includeArchived, pageSize
+                        and pageToken (nextPageToken of the previous page)
+        :return: SpeakerPageForm
+        """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
+        sp_key = self._speakerKey(request.websafeSpeakerKey)
+        speaker, sessions, cursor = self._speakerPage(sp_key, request)
+        if speaker is None:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.websafeSpeakerKey)
+
+        sfs = self._copySessionToForms(sessions, fields, {sp_key: speaker.name})
+        field_masks.report('getSpeaker', fields, sfs, started)
+        return SpeakerPageForm(
+            speaker=self._copySpeakerToForm(speaker),
+            items=sfs.items,
+            nextPageToken=cursor)
 
     @endpoints.method(SESSION_POST_REQUEST,SessionForm, path='createSession', http_method='POST',
                       name='createSession')
     def createSession(self, request):
         """
-        Create session entity
-        :param request: SessionForm + conference key
+        Create session entity; a repeated requestId replays the first response
+        :param request: SessionForm + conference key, optional requestId
         :return: Session entity created in SessionForm
         """
+        import idempotency
+        return idempotency.replay('session.createSession', request,
+                                  SessionForm, lambda: self._createSessionObject(request))
+
+    def _createSessionObject(self, request):
+        import search_index
         #Move this to a method if we need to do it somewhere else
         user = endpoints.get_current_user()
         print "user: %s" % user
@@ -210,7 +375,7 @@ class SessionApi(remote.Service):
         print "user id: %s" % user_id
 
         #Get the conference object for the websafe key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = repository.get(ndb.Key(urlsafe=request.websafeConferenceKey))
 
         if not conf:
             raise endpoints.BadRequestException("Invalid conference key")
@@ -221,19 +386,17 @@ class SessionApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         print data
         del data['websafeConferenceKey']
+        del data['requestId']
 
         #I'm ok with 'None' entries, except for Speaker
         #Requires DB be seeded with an undefined Speaker
         #We could check if the speaker doesn't exist and add them first
         #but it wouldn't jive with the overall design and how I envision the APIs
         #being consumed. Might consider using the speaker key and not the name as well.
-        if data['speaker'] is None:
-            data['speaker'] = Speaker.query(Speaker.name == 'Undefined').get().key
-        else:
-            speaker = Speaker.query(Speaker.name == data['speaker']).get().key
-            if not speaker:
-                raise endpoints.BadRequestException("Unknown speaker")
-            data['speaker'] = speaker
+        speaker = repository.first(Speaker, filters=[('name', '=', data['speaker'] or 'Undefined')])
+        if not speaker:
+            raise endpoints.BadRequestException("Unknown speaker")
+        data['speaker'] = speaker.key
 
         if data['date']:
             data['date'] = datetime.strptime(data['date'], "%Y-%m-%d").date()
@@ -245,56 +408,136 @@ class SessionApi(remote.Service):
             data['typeofsession'] = str(data['typeofsession'])
 
         data['parent'] = conf.key
+        data['archived'] = conf.archived
 
         ##### Memcaching #######
         #Get sessions for parent conference with the same speaker
-        sessions = Session.query(ancestor=data['parent']).filter(Session.speaker == data['speaker']).fetch()
+        sessions = repository.query(Session, ancestor=data['parent'],
+                                    filters=[('speaker', '=', data['speaker'])])
         #We haven't committed this speaker yet, so any return indicates speaker > 1
         if sessions:
             session_names = [session.name for session in sessions]
             session_names.append(data['name'])
             cache = {'speaker': request.speaker if request.speaker is not None else 'Undefined',
                      'sessions': session_names}
-            if not memcache.set('featured_speaker', cache):
-                print ("memcache ain't working")
+            FEATURED_SPEAKER_CACHE.set(cache)
 
 
 
-        return self._copySessionToForm((Session(**data).put()).get())
+        #session and its schedule entry are written in one transaction
+        speaker_name = speaker.name
+        session = Session(**data)
+        schedule.addSession(session, speaker_name)
+        search_index.indexSession(session, speaker_name)
+        return self._copySessionToForm(session)
 
-    @endpoints.method(SpeakerForm, SessionForms, path='sessionBySpeaker', http_method='GET',
+    def _formatSessionFilters(self, filters):
+        """
+        Turn search filters into query planner filters for the datastore fallback
+        :param filters: ConferenceQueryForm filters using the session field names
+        :return: (conference key or None, formatted filters)
+        """
+        ancestor = None
+        formatted_filters = []
+        for f in filters:
+            if f.field == 'CONFERENCE' and f.operator == 'EQ':
+                ancestor = ndb.Key(urlsafe=f.value)
+                continue
+            try:
+                filtr = {'field': FIELDS[f.field], 'operator': OPERATORS[f.operator],
+                         'value': f.value}
+            except KeyError:
+                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+            #speakers are searched by name but stored by key
+            if filtr['field'] == 'speaker':
+                speaker = repository.first(Speaker, filters=[('name', '=', f.value)])
+                filtr['value'] = speaker.key if speaker else None
+            formatted_filters.append(filtr)
+        return ancestor, formatted_filters
+
+    @endpoints.method(SearchQueryForm, SessionSearchForms, path='searchSessions', http_method='POST',
+                      name='searchSessions')
+    def searchSessions(self, request):
+        """
+        Search sessions by text, ranges on several fields and facets
+        :param request: SearchQueryForm with TYPE, SPEAKER, CONFERENCE, DATE,
+                        START_TIME and DURATION filters
+        :return: SessionSearchForms
+        """
+        from google.appengine.api import search
+        import search_index
+        sessions = None
+        if not search_index.isDatastoreCursor(request.cursor):
+            try:
+                keys, facets, cursor = search_index.searchSessions(request)
+                sessions = [session for session in repository.getMulti(keys) if session]
+                source = 'search'
+            except search.Error:
+                logging.exception('Session search failed, using datastore')
+
+        if sessions is None:
+            ancestor, filters = self._formatSessionFilters(request.filters)
+            sessions, cursor = search_index.datastorePage(
+                query_planner.plan(filters, model=Session, ancestor=ancestor,
+                                   include_archived=True).fetch(),
+                request, ('name', 'highlights'), search_index.SESSION_SORTS)
+            facets = []
+            source = 'datastore'
+
+        return SessionSearchForms(
+            items=self._copySessionToForms(sessions).items,
+            facets=[FacetForm(name=name, values=[
+                FacetValueForm(value=unicode(value), count=count)
+                for value, count in values]) for name, values in facets],
+            cursor=cursor,
+            source=source)
+
+    @endpoints.method(SESSION_BY_SPEAKER_GET_REQUEST, SessionForms, path='sessionBySpeaker', http_method='GET',
                       name='sessionBySpeaker')
     def sessionBySpeaker(self,request):
         """
         Gets sessions by speaker. Either name or key can be used. If both are used,
-        name is used first and if not found, key is used.
-        :param request: Request with speaker name and/or key
-        :return: SessionForms
+        name is used first and if not found, key is used. Sessions come a page at
+        a time from the speaker's session index, in date and time order.
+        :param request: Request with speaker name and/or key, optional fieldMask,
+                        includeArchived, pageSize and pageToken
+        :return: SessionForms with nextPageToken while there are more
         """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
         if (not request.name and not request.websafeKey):
             raise endpoints.BadRequestException("Must have name or key")
         s_key = None
         if request.name:
-            speaker = Speaker().query(Speaker.name == request.name).get()
+            speaker = repository.first(Speaker, filters=[('name', '=', request.name)])
             if speaker is not None:
                 s_key = speaker.key
         #fall through to key if name was passed but not found and key is present
         if (s_key is None and request.websafeKey):
-            s_key = ndb.Key(urlsafe=request.websafeKey)
+            s_key = self._speakerKey(request.websafeKey)
 
         if s_key is None:
             raise endpoints.BadRequestException("Invalid name and/or key")
 
-        return self._copySessionToForms(Session().query(Session.speaker == s_key).fetch())
+        speaker, sessions, cursor = self._speakerPage(s_key, request)
+        if speaker is None:
+            raise endpoints.BadRequestException("Invalid name and/or key")
+
+        sfs = self._copySessionToForms(sessions, fields, {s_key: speaker.name})
+        sfs.nextPageToken = cursor
+        field_masks.report('sessionBySpeaker', fields, sfs, started)
+        return sfs
 
     @endpoints.method(SESSION_FOR_CONFERENCE_GET_REQUEST, SessionForms, path='sessionByConf', http_method='GET',
                     name='sessionByConf')
     def sessionByConf(self, request):
         """
         Gets all session by conference
-        :param request: conference key
+        :param request: conference key, optional fieldMask
         :return: SessionForms
         """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
         if not request.websafeConferenceKey:
             endpoints.BadRequestException("Must have key")
 
@@ -303,16 +546,61 @@ class SessionApi(remote.Service):
         if not c_key:
             endpoints.BadRequestException("Invalid key")
 
-        return self._copySessionToForms(Session.query(ancestor = c_key).fetch())
+        def build():
+            #projection query when the mask fits the session list index
+            sessions = repository.query(Session, ancestor=c_key,
+                                        projection=field_masks.projection(Session, fields))
+            return self._copySessionToForms(sessions, fields)
+        sfs = stale.serve('session.sessionByConf', request, SessionForms, build)
+        field_masks.report('sessionByConf', fields, sfs, started)
+        return sfs
+
+    @endpoints.method(SCHEDULE_GET_REQUEST, ScheduleForm,
+                      path='conference/{websafeConferenceKey}/schedule', http_method='GET',
+                      name='getSchedule')
+    def getSchedule(self, request):
+        """
+        Agenda of a conference from its materialized schedule
+        :param request: conference key, optional date (YYYY-MM-DD) and start time window (HH:MM, end exclusive)
+        :return: ScheduleForm sorted by date and start time
+        """
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException("Invalid conference key")
+        if c_key.kind() != 'Conference':
+            raise endpoints.BadRequestException("Invalid conference key")
+
+        # the schedule compares zero-padded strings, and strptime also
+        # accepts '9:00' or '2026-5-1'
+        try:
+            date, start, end = [
+                datetime.strptime(value, fmt).strftime(fmt) if value else None
+                for value, fmt in ((request.date, "%Y-%m-%d"),
+                                   (request.startTime, "%H:%M"),
+                                   (request.endTime, "%H:%M"))]
+        except ValueError:
+            raise endpoints.BadRequestException("Use YYYY-MM-DD for date and HH:MM for times")
+
+        entries = schedule.window(schedule.getSchedule(c_key), date, start, end)
+        return ScheduleForm(
+            websafeConferenceKey=request.websafeConferenceKey,
+            items=[ScheduleEntryForm(date=e[schedule.DATE], starttime=e[schedule.STARTTIME],
+                                     duration=e[schedule.DURATION], typeofsession=e[schedule.TYPE],
+                                     speaker=e[schedule.SPEAKER], websafeKey=e[schedule.KEY],
+                                     name=e[schedule.NAME])
+                   for e in entries])
 
     @endpoints.method(SESSION_BY_TYPE_GET_REQUEST, SessionForms, path='sessionByType', http_method='GET',
                       name='sessionByType')
     def sessionByType(self, request):
         """
         Get all sessions by type for a given conference
-        :param request: conference key and SessionType enum
+        :param request: conference key and SessionType enum, optional fieldMask
         :return: SessionForms
         """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
         if (not request.websafeConferenceKey and not request.typeOfSession):
             raise endpoints.BadRequestException("Both key and type must be specified")
 
@@ -326,17 +614,26 @@ class SessionApi(remote.Service):
         if not c_key:
             endpoints.BadRequestException("Invalid key")
 
-        return self._copySessionToForms(Session.query(ancestor = c_key).
-                                        filter(Session.typeofsession == str(request.typeOfSession)).fetch())
+        sfs = self._copySessionToForms(
+            repository.query(Session, ancestor=c_key,
+                             filters=[('typeofsession', '=', str(request.typeOfSession))]),
+            fields)
+        field_masks.report('sessionByType', fields, sfs, started)
+        return sfs
 
     @endpoints.method(SESSION_KEY_POST,SessionForm, path='addSessionToWishlist', http_method='POST',
                       name='addSessionToWishlist')
     def addSessionToWishlist(self,request):
         """
         Add the session to the user's list of favorite sessions
-        :param request: key for session
+        :param request: key for session, optional requestId
         :return: SessionForm for session selected as favorite
         """
+        import idempotency
+        return idempotency.replay('session.addSessionToWishlist', request,
+                                  SessionForm, lambda: self._addToWishlist(request))
+
+    def _addToWishlist(self, request):
         if not request.websafeSessionKey:
             raise endpoints.BadRequestException('Need a session key')
 
@@ -345,38 +642,54 @@ class SessionApi(remote.Service):
         if not session:
             raise endpoints.BadRequestException('Invalid session')
 
+        entity = repository.get(session)
+        if entity is None:
+            raise endpoints.NotFoundException('No session found with key: %s' % request.websafeSessionKey)
+
         profile = self._getProfileFromUser()
-        profile.favoriteSessions.append(session)
-        profile.put()
+        # adding a session twice leaves one entry
+        if session not in profile.favoriteSessions:
+            profile.favoriteSessions.append(session)
+            repository.put(profile)
+            agenda.invalidate(profile.key.id())
 
-        return self._copySessionToForm(session.get())
+        return self._copySessionToForm(entity)
 
-    @endpoints.method(message_types.VoidMessage,SessionForms, path='getSessionsInWishlist', http_method='GET',
+    @endpoints.method(SESSION_LIST_GET_REQUEST,SessionForms, path='getSessionsInWishlist', http_method='GET',
                       name='getSessionsInWishlist')
     def getSessionsInWishlist(self,request):
         """
         All sessions in wishlist for current user
         """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
         profile = self._getProfileFromUser()
 
         if not profile:
             raise endpoints.BadRequestException('Profile does not exist for user')
 
-        return SessionForms(items=[self._copySessionToForm(session)
-                                   for session in ndb.get_multi(profile.favoriteSessions)])
+        sfs = self._copySessionToForms(
+            [session for session in repository.getMulti(profile.favoriteSessions) if session], fields)
+        field_masks.report('getSessionsInWishlist', fields, sfs, started)
+        return sfs
 
 
-    @endpoints.method(message_types.VoidMessage,SessionForms, path='nonWorkshopAfterSeven', http_method='GET',
+    @endpoints.method(SESSION_QUERY_GET_REQUEST,SessionForms, path='nonWorkshopAfterSeven', http_method='GET',
                       name='nonWorkshopAfterSeven')
     def nonWorkshopAfterSeven(self,request):
         """
         get sessions after 1900 and and not a workshop
         """
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, SessionForm)
         #can't have inequality filters w/ multiple properties
-        afterSevenSessions = Session.query(ndb.AND(
-            Session.starttime >= datetime.strptime('19:00',"%H:%M").time(),
-            Session.starttime != None
-        )).fetch()
+        filters = [
+            ('starttime', '>=', datetime.strptime('19:00',"%H:%M").time()),
+            ('starttime', '!=', None),
+        ]
+        if not request.includeArchived:
+            filters.append(('archived', '=', False))
+        afterSevenSessions = repository.query(Session, filters=filters)
 
         sessions = []
         for session in afterSevenSessions:
@@ -384,18 +697,21 @@ class SessionApi(remote.Service):
                 sessions.append(session)
 
 
-        return self._copySessionToForms(sessions)
+        sfs = self._copySessionToForms(sessions, fields)
+        field_masks.report('nonWorkshopAfterSeven', fields, sfs, started)
+        return sfs
 
     @endpoints.method(message_types.VoidMessage,FeaturedSpeakerForm, path='featuredSpeaker', http_method='GET',
                       name='featuredSpeaker')
     def featuredSpeaker(self, request):
         """
         Returning the featured speakers in the memcache since the project doesn't
-        give me any details for this endpoint
+        give me any details for this endpoint. A memcache miss is rebuilt from
+        the datastore by a single request.
         """
-        fs = memcache.get('featured_speaker')
+        fs = FEATURED_SPEAKER_CACHE.get()
         if not fs:
-            raise endpoints.BadRequestException('Memcache miss')
+            raise endpoints.NotFoundException('No featured speaker')
 
         fsf = FeaturedSpeakerForm()
 
@@ -14,8 +14,7 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
-import json
-import os
+import logging
 import time
 
 import endpoints
@@ -23,11 +22,19 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
-from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 
+from announcements import ANNOUNCEMENT_CACHE
+import admission
+import agenda
+import announcements
+from auth import getUserId as _getUserId
+import catalog
+import field_masks
+import query_planner
+import repository
+import rollups
+import stale
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
@@ -39,7 +46,17 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSearchForms
+from models import FacetForm
+from models import FacetValueForm
+from models import SearchQueryForm
 from models import TeeShirtSize
+from models import BatchRequestForm
+from models import BatchResponseForm
+from models import RollupForm
+from models import RollupForms
+from models import AgendaItemForm
+from models import AgendaForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -48,7 +65,6 @@ from settings import ANDROID_AUDIENCE
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -73,6 +89,8 @@ FIELDS =    {
             'TOPIC': 'topics',
             'MONTH': 'month',
             'MAX_ATTENDEES': 'maxAttendees',
+            'START_DATE': 'startDate',
+            'END_DATE': 'endDate',
             }
 
 CONF_GET_REQUEST = endpoints.ResourceContainer(
@@ -85,32 +103,12 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1),
+)
 
-def _getUserId():
-    """A workaround implementation for getting userid."""
-    auth = os.getenv('HTTP_AUTHORIZATION')
-    bearer, token = auth.split()
-    token_type = 'id_token'
-    if 'OAUTH_USER_ID' in os.environ:
-        token_type = 'access_token'
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-           % (token_type, token))
-    user = {}
-    wait = 1
-    for i in range(3):
-        resp = urlfetch.fetch(url)
-        if resp.status_code == 200:
-            user = json.loads(resp.content)
-            break
-        elif resp.status_code == 400 and 'invalid_token' in resp.content:
-            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                   % ('access_token', token))
-        else:
-            time.sleep(wait)
-            wait = wait + i
-    return user.get('user_id', '')
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
 @endpoints.api(name='conference', version='v1', audiences=[ANDROID_AUDIENCE],
@@ -121,10 +119,13 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, fields=None):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
         for field in cf.all_fields():
+            # only copy the fields in the mask, if there is one
+            if fields is not None and field.name not in fields:
+                continue
             if hasattr(conf, field.name):
                 # convert Date to date string; just copy others
                 if field.name.endswith('Date'):
@@ -133,7 +134,7 @@ class ConferenceApi(remote.Service):
                     setattr(cf, field.name, getattr(conf, field.name))
             elif field.name == "websafeKey":
                 setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
+        if displayName and field_masks.wants(fields, 'organizerDisplayName'):
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
@@ -141,6 +142,8 @@ class ConferenceApi(remote.Service):
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
+        import mailer
+        import search_index
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
@@ -154,6 +157,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['stale']
+        del data['requestId']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -176,22 +181,26 @@ class ConferenceApi(remote.Service):
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+        c_id = repository.allocateId(Conference, parent=p_key)
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = Conference(**data)
+        repository.transaction(
+            lambda: (repository.put(conf), rollups.increment(rollups.conferenceDeltas(conf))),
+            xg=True)
+        search_index.indexConference(conf)
+        catalog.invalidate()
+        # a retry that got past the request id check still mails once
+        mailer.queueConfirmation(user.email(), request, '%s:%s' % (
+            user_id, request.requestId) if request.requestId else c_key.urlsafe())
         return request
 
 
-    @ndb.transactional()
+    @repository.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -202,7 +211,7 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
         # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = repository.get(ndb.Key(urlsafe=request.websafeConferenceKey))
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -213,6 +222,9 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # take the old values out of the rollups, the new ones go back in below
+        deltas = rollups.conferenceDeltas(conf, sign=-1)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
@@ -226,16 +238,19 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
+        repository.put(conf)
+        rollups.increment(rollups.conferenceDeltas(conf, counts=deltas))
+        prof = repository.get(ndb.Key(Profile, user_id))
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
-        """Create new conference."""
-        return self._createConferenceObject(request)
+        """Create new conference; a repeated requestId replays the first response."""
+        import idempotency
+        return idempotency.replay('conference.createConference', request,
+                                  ConferenceForm, lambda: self._createConferenceObject(request))
 
 
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
@@ -243,64 +258,90 @@ class ConferenceApi(remote.Service):
             http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        import search_index
+        cf = self._updateConferenceObject(request)
+        # reindex outside the transaction so only committed data is searchable
+        search_index.indexConference(repository.get(ndb.Key(urlsafe=request.websafeConferenceKey)))
+        catalog.invalidate()
+        admission.clearSoldOut(request.websafeConferenceKey)
+        return cf
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
-            path='conference/{websafeConferenceKey}',
-            http_method='GET', name='getConference')
-    def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/delete',
+            http_method='POST', name='deleteConference')
+    def deleteConference(self, request):
+        """Delete a conference; its sessions and registrations go in the background."""
+        import cascade
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException('Invalid conference key')
+        conf = repository.get(c_key)
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        if _getUserId() != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+        return BooleanMessage(data=cascade.deleteConference(c_key) is not None)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+            path='conference/{websafeConferenceKey}',
+            http_method='GET', name='getConference')
+    def getConference(self, request):
+        """Return requested conference (by websafeConferenceKey)."""
+        def build():
+            # get Conference object from request; bail if not found
+            conf = repository.get(ndb.Key(urlsafe=request.websafeConferenceKey))
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            prof = repository.get(conf.key.parent())
+            # return ConferenceForm
+            return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return stale.serve('conference.getConference', request, ConferenceForm, build)
+
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
+        started = time.time()
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        fields = field_masks.parse(request.fieldMask, ConferenceForm)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, _getUserId()))
-        prof = ndb.Key(Profile, _getUserId()).get()
+        # create ancestor query for all key matches for this user;
+        # a projection when the mask fits a projection index
+        confs = repository.query(Conference, ancestor=ndb.Key(Profile, _getUserId()),
+                                 projection=field_masks.projection(Conference, fields))
+        prof = repository.get(ndb.Key(Profile, _getUserId()))
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+        cfs = ConferenceForms(
+            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName'), fields)
+                   for conf in confs]
         )
+        field_masks.report('getConferencesCreated', fields, cfs, started)
+        return cfs
 
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
+        """Return a query plan for the submitted filters."""
         inequality_filter, filters = self._formatFilters(request.filters)
+        # the planner decides which filters the datastore sees, the rest
+        # (and the ordering) are applied after the fetch
+        return query_planner.plan(filters, inequality_filter)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-
-
-    def _formatFilters(self, filters):
+    def _formatFilters(self, filters, single_inequality=True):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
         inequality_field = None
@@ -319,9 +360,9 @@ class ConferenceApi(remote.Service):
                 # check if inequality operation has been used in previous filters
                 # disallow the filter if inequality was performed on a different field before
                 # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
+                if single_inequality and inequality_field and inequality_field != filtr["field"]:
                     raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
+                elif not inequality_field:
                     inequality_field = filtr["field"]
 
             formatted_filters.append(filtr)
@@ -334,23 +375,87 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, ConferenceForm)
+        # answered from the instance catalog, which takes inequalities
+        # on any number of fields; _getQuery is the datastore equivalent.
+        # Archived conferences are only in the datastore.
+        inequality_filter, filters = self._formatFilters(
+            request.filters, single_inequality=False)
+
+        def build():
+            if request.includeArchived:
+                conferences = query_planner.plan(
+                    filters, inequality_filter, include_archived=True).fetch()
+            else:
+                conferences = catalog.query(filters, inequality_filter)
+            names = {}
+            if field_masks.wants(fields, 'organizerDisplayName'):
+                names = self._organizerNames(conferences)
+
+            # return individual ConferenceForm object per Conference
+            return ConferenceForms(
+                    items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId), fields) \
+                    for conf in conferences]
+            )
+        cfs = stale.serve('conference.queryConferences', request, ConferenceForms, build)
+        field_masks.report('queryConferences', fields, cfs, started)
+        return cfs
+
 
+    def _organizerNames(self, conferences):
+        """Return {organizerUserId: displayName} for conferences."""
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        organisers = set(ndb.Key(Profile, conf.organizerUserId) for conf in conferences)
+        profiles = repository.getMulti(list(organisers))
 
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
+        return names
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+
+    @endpoints.method(SearchQueryForm, ConferenceSearchForms,
+            path='searchConferences',
+            http_method='POST',
+            name='searchConferences')
+    def searchConferences(self, request):
+        """Search conferences by text, ranges on several fields and facets."""
+        from google.appengine.api import search
+        import search_index
+        conferences = None
+        if not search_index.isDatastoreCursor(request.cursor):
+            try:
+                keys, facets, cursor = search_index.searchConferences(request)
+                conferences = [conf for conf in repository.getMulti(keys) if conf]
+                source = 'search'
+            except search.Error:
+                logging.exception('Conference search failed, using datastore')
+
+        if conferences is None:
+            # datastore fallback: no facets, everything but the planned
+            # filters evaluated in memory
+            inequality_filter, filters = self._formatFilters(
+                request.filters, single_inequality=False)
+            conferences, cursor = search_index.datastorePage(
+                query_planner.plan(filters, inequality_filter,
+                                   include_archived=True).fetch(), request,
+                ('name', 'description'), search_index.CONFERENCE_SORTS)
+            facets = []
+            source = 'datastore'
+
+        names = self._organizerNames(conferences)
+        return ConferenceSearchForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                   for conf in conferences],
+            facets=[FacetForm(name=name, values=[
+                FacetValueForm(value=unicode(value), count=count)
+                for value, count in values]) for name, values in facets],
+            cursor=cursor,
+            source=source)
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
@@ -380,7 +485,7 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = _getUserId()
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = repository.get(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -389,7 +494,7 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            repository.put(profile)
 
         return profile      # return Profile
 
@@ -401,6 +506,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -410,7 +516,10 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         #else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        repository.put(prof)
+            if prof.displayName != displayName:
+                # conference responses and feeds show organizer names
+                catalog.invalidate()
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -437,34 +546,15 @@ class ConferenceApi(remote.Service):
         """Create Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        return announcements.cacheAnnouncement()
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return Announcement from memcache, rebuilding it if evicted."""
+        return StringMessage(data=ANNOUNCEMENT_CACHE.get() or "")
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -475,9 +565,54 @@ class ConferenceApi(remote.Service):
         return StringMessage(data=self._cacheAnnouncement())
 
 
+# - - - Batch - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(BatchRequestForm, BatchResponseForm,
+            path='batch', http_method='POST', name='batch')
+    def batch(self, request):
+        """Run several conference/session operations in one round-trip."""
+        import batch_ops
+        from con_session import SessionApi
+        return batch_ops.run({'conference': self, 'session': SessionApi()},
+                             request.operations)
+
+
+# - - - Rollups - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _copyRollupsToForms(counts):
+        """Flatten {dimension: {value: {metric: n}}} into RollupForms."""
+        items = []
+        for dimension in sorted(counts):
+            for value, metrics in sorted(counts[dimension].iteritems()):
+                # everything under this value was removed again
+                if not any(metrics.values()):
+                    continue
+                items.append(RollupForm(dimension=dimension, value=value, **metrics))
+        return RollupForms(items=items)
+
+
+    @endpoints.method(message_types.VoidMessage, RollupForms,
+            path='rollups', http_method='GET', name='getRollups')
+    def getRollups(self, request):
+        """Conferences, capacity and seats sold by city/month/topic, sessions by type."""
+        return self._copyRollupsToForms(rollups.totals())
+
+
+    @endpoints.method(CONF_GET_REQUEST, RollupForms,
+            path='conference/{websafeConferenceKey}/rollup',
+            http_method='GET', name='getConferenceRollup')
+    def getConferenceRollup(self, request):
+        """Sessions per type of one conference."""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        return self._copyRollupsToForms(
+            {'type': dict((type_, {'sessions': n}) for type_, n in
+                          rollups.sessionsByType(c_key).iteritems())})
+
+
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
+    @repository.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -486,7 +621,7 @@ class ConferenceApi(remote.Service):
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = repository.get(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -500,12 +635,15 @@ class ConferenceApi(remote.Service):
 
             # check if seats avail
             if conf.seatsAvailable <= 0:
+                # later attempts are turned away before the transaction
+                admission.markSoldOut(wsck)
                 raise ConflictException(
                     "There are no seats available.")
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            rollups.increment(rollups.seatDeltas(conf, 1))
             retval = True
 
         # unregister
@@ -516,38 +654,50 @@ class ConferenceApi(remote.Service):
                 # unregister user, add back one seat
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                rollups.increment(rollups.seatDeltas(conf, -1))
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        repository.putMulti([prof, conf])
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
+        started = time.time()
+        fields = field_masks.parse(request.fieldMask, ConferenceForm)
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # deleted conferences stay listed until the cascade cleans the profile
+        conferences = [conf for conf in repository.getMulti(conf_keys) if conf]
 
         # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
         names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        if field_masks.wants(fields, 'organizerDisplayName'):
+            names = self._organizerNames(conferences)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
+        cfs = ConferenceForms(items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId), fields)\
          for conf in conferences]
         )
+        field_masks.report('getConferencesToAttend', fields, cfs, started)
+        return cfs
+
+
+    @endpoints.method(message_types.VoidMessage, AgendaForm,
+            path='agenda', http_method='GET', name='getAgenda')
+    def getAgenda(self, request):
+        """Return the user's conferences and wishlisted sessions in time order."""
+        # one memcache read when the precomputed agenda is there
+        if not endpoints.get_current_user():
+            raise endpoints.UnauthorizedException('Authorization required')
+        return AgendaForm(items=[AgendaItemForm(**item)
+                                 for item in agenda.getAgenda(_getUserId())])
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -555,7 +705,11 @@ class ConferenceApi(remote.Service):
             http_method='POST', name='registerForConference')
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        admission.admit(request.websafeConferenceKey)
+        retval = self._conferenceRegistration(request)
+        catalog.invalidate()
+        agenda.invalidate(_getUserId())
+        return retval
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -563,7 +717,12 @@ class ConferenceApi(remote.Service):
             http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        retval = self._conferenceRegistration(request, reg=False)
+        if retval.data:
+            admission.clearSoldOut(request.websafeConferenceKey)
+            agenda.invalidate(_getUserId())
+        catalog.invalidate()
+        return retval
 
 
 
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""
+export.py -- streaming NDJSON/CSV export of conferences, sessions,
+    speakers and registrations
+
+Entities are read with query iterators in fixed size batches and written
+out row by row, so memory stays flat no matter how big the kind is. Each
+call handles one slice and hands back a cursor for the next one; the
+nightly export chains slices through the task queue.
+
+A nightly export is identified by its UTC date, so a retried cron finds
+its slice tasks already named and starts nothing new. Each run deletes
+the chunks of exports older than EXPORT_KEEP_DAYS.
+
+"""
+
+import csv
+import json
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportChunk
+from models import Profile
+from models import Session
+from models import Speaker
+
+EXPORT_BATCH_SIZE = 200          # entities per datastore RPC
+EXPORT_SLICE_ROWS = 1000         # entities per request / task slice
+EXPORT_SLICE_BYTES = 900 * 1024  # keep a stored chunk under the 1MB limit
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_ID_FORMAT = '%Y%m%d'
+EXPORT_KEEP_DAYS = 7
+EXPIRE_BATCH = 500
+
+CONFERENCE_COLUMNS = ['websafeKey', 'name', 'description', 'organizerUserId',
+                      'topics', 'city', 'startDate', 'endDate', 'month',
+                      'maxAttendees', 'seatsAvailable']
+SESSION_COLUMNS = ['websafeKey', 'websafeConferenceKey', 'name', 'highlights',
+                   'speakerKey', 'duration', 'typeofsession', 'date',
+                   'starttime']
+SPEAKER_COLUMNS = ['websafeKey', 'name', 'bio', 'organization', 'photoUrl']
+REGISTRATION_COLUMNS = ['userId', 'displayName', 'mainEmail',
+                        'websafeConferenceKey']
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _conferenceRows(conf):
+    yield {
+        'websafeKey': conf.key.urlsafe(),
+        'name': conf.name,
+        'description': conf.description,
+        'organizerUserId': conf.organizerUserId,
+        'topics': conf.topics,
+        'city': conf.city,
+        'startDate': conf.startDate,
+        'endDate': conf.endDate,
+        'month': conf.month,
+        'maxAttendees': conf.maxAttendees,
+        'seatsAvailable': conf.seatsAvailable,
+    }
+
+
+def _sessionRows(session):
+    # speaker is exported as a key; resolving names would cost a get per row
+    yield {
+        'websafeKey': session.key.urlsafe(),
+        'websafeConferenceKey': session.key.parent().urlsafe(),
+        'name': session.name,
+        'highlights': session.highlights,
+        'speakerKey': session.speaker.urlsafe() if session.speaker else None,
+        'duration': session.duration,
+        'typeofsession': session.typeofsession,
+        'date': session.date,
+        'starttime': session.starttime,
+    }
+
+
+def _speakerRows(speaker):
+    yield {
+        'websafeKey': speaker.key.urlsafe(),
+        'name': speaker.name,
+        'bio': speaker.bio,
+        'organization': speaker.organization,
+        'photoUrl': speaker.photoUrl,
+    }
+
+
+def _registrationRows(prof):
+    # one row per (attendee, conference) pair
+    for wsck in prof.conferenceKeysToAttend:
+        yield {
+            'userId': prof.key.id(),
+            'displayName': prof.displayName,
+            'mainEmail': prof.mainEmail,
+            'websafeConferenceKey': wsck,
+        }
+
+
+EXPORTS = {
+    'conferences': (Conference, CONFERENCE_COLUMNS, _conferenceRows),
+    'sessions': (Session, SESSION_COLUMNS, _sessionRows),
+    'speakers': (Speaker, SPEAKER_COLUMNS, _speakerRows),
+    'registrations': (Profile, REGISTRATION_COLUMNS, _registrationRows),
+}
+
+
+def _toText(value):
+    """Convert a property value to the string written to CSV."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ';'.join(_toText(v) for v in value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _toJson(value):
+    """Convert a property value to something json can encode."""
+    if isinstance(value, list):
+        return [_toJson(v) for v in value]
+    if value is None or isinstance(value, (basestring, int, long, float)):
+        return value
+    return str(value)
+
+
+class _CountingWriter(object):
+    """File-like wrapper that remembers how many bytes went through it."""
+
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.out.write(data)
+
+
+class _ListWriter(object):
+    """File-like object collecting writes into a list."""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def write(self, data):
+        self.buf.append(data)
+
+
+def contentType(fmt):
+    """Return the HTTP content type for an export format."""
+    if fmt == 'csv':
+        return 'text/csv; charset=utf-8'
+    return 'application/x-ndjson; charset=utf-8'
+
+
+def exportSlice(kind, fmt, out, cursor=None, header=True,
+                max_rows=EXPORT_SLICE_ROWS, max_bytes=EXPORT_SLICE_BYTES):
+    """Write one slice of kind to out as NDJSON or CSV.
+
+    Returns (websafe cursor, more) where the cursor resumes right after the
+    last exported entity.
+    """
+    model, columns, rows = EXPORTS[kind]
+    out = _CountingWriter(out)
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        if header:
+            writer.writerow(columns)
+        write = lambda row: writer.writerow([_toText(row[c]) for c in columns])
+    else:
+        write = lambda row: out.write(json.dumps(OrderedDict(
+            (c, _toJson(row[c])) for c in columns)) + '\n')
+
+    start = Cursor(urlsafe=cursor) if cursor else None
+    it = model.query().iter(batch_size=EXPORT_BATCH_SIZE,
+                            start_cursor=start, produce_cursors=True)
+    count = 0
+    for entity in it:
+        for row in rows(entity):
+            write(row)
+        count += 1
+        if count >= max_rows or out.bytes >= max_bytes:
+            break
+    else:
+        return None, False
+
+    if not it.has_next():
+        return None, False
+    return it.cursor_after().urlsafe(), True
+
+
+def _enqueueSlice(export_id, kind, fmt, part, cursor=None):
+    """Enqueue one export slice; named so a retried parent can't fork it."""
+    try:
+        taskqueue.add(name='export-%s-%s-%s-%d' % (export_id, kind, fmt, part),
+                      params={'exportId': export_id, 'kind': kind,
+                              'format': fmt, 'part': part,
+                              'cursor': cursor or ''},
+                      url='/tasks/export')
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def expireExports(now=None):
+    """Delete the chunks of exports older than EXPORT_KEEP_DAYS."""
+    cutoff = ((now or datetime.utcnow()) -
+              timedelta(days=EXPORT_KEEP_DAYS)).strftime(EXPORT_ID_FORMAT)
+    deleted = 0
+    while True:
+        keys = ExportChunk.query(ExportChunk.exportId < cutoff).fetch(
+            EXPIRE_BATCH, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+        if len(keys) < EXPIRE_BATCH:
+            return deleted
+
+
+def startExport(fmt='ndjson', kinds=None):
+    """Kick off a chained export task for each kind; return the export id.
+
+    The id is today's date, so a second call on the same day (a retried
+    cron) finds the first slice tasks already named and adds nothing.
+    """
+    now = datetime.utcnow()
+    expireExports(now)
+    export_id = now.strftime(EXPORT_ID_FORMAT)
+    for kind in (kinds or sorted(EXPORTS)):
+        _enqueueSlice(export_id, kind, fmt, 0)
+    return export_id
+
+
+def exportTask(export_id, kind, fmt, part, cursor=None):
+    """Export one slice into an ExportChunk and enqueue the next slice."""
+    chunk_id = '%s-%s-%s-%05d' % (export_id, kind, fmt, part)
+    # a retried task must not export its slice twice
+    chunk = ExportChunk.get_by_id(chunk_id)
+    if not chunk:
+        buf = []
+        next_cursor, more = exportSlice(kind, fmt, _ListWriter(buf),
+                                        cursor=cursor, header=(part == 0))
+        chunk = ExportChunk(id=chunk_id, exportId=export_id, kind=kind,
+                            format=fmt, part=part,
+                            data=''.join(buf).decode('utf-8'),
+                            nextCursor=next_cursor, final=not more)
+        chunk.put()
+    if not chunk.final:
+        _enqueueSlice(export_id, kind, fmt, part + 1, chunk.nextCursor)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+feeds.py -- public, cacheable JSON feeds for anonymous browsing
+
+Read-only views of the conference list, a conference and its schedule at
+/feeds/..., served by plain webapp2 handlers instead of the Endpoints
+SPI. The bodies are the same protojson messages as queryConferences,
+getConference and getSchedule. Each response carries Cache-Control:
+public, a weak ETag and Last-Modified, taken from versions every instance
+sees alike: the conference list from the catalog's memcache counters and
+change time, a conference from its entity and its organizer's profile,
+a schedule from its cached version. A request whose If-None-Match or
+If-Modified-Since still matches gets 304 before the body is built, so
+browsers and intermediate caches absorb repeat reads.
+
+A body that stale.serve answered from its stored copy (stale=True) is
+older than those validators. It goes out with Cache-Control: no-cache
+and no ETag or Last-Modified, so no cache keeps it or revalidates it
+against the current version.
+
+"""
+
+import calendar
+import hashlib
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+import catalog
+from models import Conference
+import repository
+import schedule
+
+FEED_MAX_AGE = 60           # seconds shared caches may serve without asking
+JSON_CONTENT_TYPE = 'application/json'
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class FeedNotFound(Exception):
+    pass
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def etag(*parts):
+    """Weak ETag for a version made of parts."""
+    # parts may include a non-ASCII organizer name
+    digest = hashlib.sha1(u':'.join(unicode(part) for part in parts).encode('utf-8')).hexdigest()
+    return 'W/"%s"' % digest[:20]
+
+
+def _opaque(tag):
+    # If-None-Match uses the weak comparison: W/ does not matter
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def notModified(headers, tag, modified):
+    """True if the client's cached copy for (tag, modified) is current."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = [_opaque(t) for t in if_none_match.split(',')]
+        return '*' in tags or _opaque(tag) in tags
+    since = parsedate_tz(headers.get('If-Modified-Since') or '')
+    return bool(since and modified and _timestamp(modified) <= mktime_tz(since))
+
+
+def _validators(headers, tag, modified):
+    headers['Cache-Control'] = 'public, max-age=%d' % FEED_MAX_AGE
+    headers['ETag'] = tag
+    if modified:
+        headers['Last-Modified'] = formatdate(_timestamp(modified), usegmt=True)
+
+
+def respond(handler, tag, modified, build):
+    """Write validators and caching headers, then a 304 or build()'s message."""
+    headers = handler.response.headers
+    if notModified(handler.request.headers, tag, modified):
+        _validators(headers, tag, modified)
+        handler.response.set_status(304)
+        return
+    message = build()
+    if getattr(message, 'stale', False):
+        headers['Cache-Control'] = 'no-cache'
+    else:
+        _validators(headers, tag, modified)
+    headers['Content-Type'] = JSON_CONTENT_TYPE
+    handler.response.write(protojson.encode_message(message))
+
+
+def _conferenceKey(wsck):
+    try:
+        c_key = ndb.Key(urlsafe=wsck)
+    except Exception:
+        raise FeedNotFound(wsck)
+    if c_key.kind() != Conference._get_kind():
+        raise FeedNotFound(wsck)
+    return c_key
+
+
+def _latest(*times):
+    times = [t for t in times if t]
+    return max(times) if times else None
+
+
+def _conference(wsck):
+    """A conference and its organizer's profile (None if missing)."""
+    c_key = _conferenceKey(wsck)
+    conf, prof = repository.getMulti([c_key, c_key.parent()])
+    if conf is None:
+        raise FeedNotFound(wsck)
+    return conf, prof
+
+
+def conferences():
+    """(ETag, Last-Modified, build) of the list of current conferences."""
+    generation, reset, modified = catalog.version()
+
+    def build():
+        from conference import ConferenceApi
+        from models import ConferenceQueryForms
+        return ConferenceApi().queryConferences(ConferenceQueryForms())
+    return etag('conferences', generation, reset, modified), modified, build
+
+
+def conference(wsck):
+    """(ETag, Last-Modified, build) of one conference."""
+    conf, prof = _conference(wsck)
+    # the response shows the organizer's display name
+    name = prof.displayName if prof else None
+    modified = _latest(conf.updated, prof.updated if prof else None)
+
+    def build():
+        from conference import CONF_GET_REQUEST
+        from conference import ConferenceApi
+        return ConferenceApi().getConference(
+            CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck))
+    return etag('conference', wsck, conf.updated, name), modified, build
+
+
+def conferenceSchedule(wsck):
+    """(ETag, Last-Modified, build) of a conference's schedule."""
+    conf, _ = _conference(wsck)
+    modified = schedule.lastModified(conf.key)
+
+    def build():
+        from con_session import SCHEDULE_GET_REQUEST
+        from con_session import SessionApi
+        return SessionApi().getSchedule(
+            SCHEDULE_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck))
+    return etag('schedule', wsck, modified), modified, build
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+field_masks.py -- fieldMask support for the list endpoints
+
+A fieldMask is a comma separated list of form field names
+('name,city,startDate,websafeKey'). List endpoints only serialize those
+fields, skip lookups the mask doesn't need (speaker names, organiser
+profiles), and when the mask fits one of the projection indexes below
+the ancestor query itself becomes a projection query, so the datastore
+returns index rows instead of whole entities.
+
+The parameter is called fieldMask rather than fields because 'fields' is
+already the standard partial-response parameter of Google APIs.
+
+"""
+
+import logging
+import random
+import time
+
+import endpoints
+from protorpc import protojson
+
+# composite indexes (ancestor: yes, see index.yaml) that can serve
+# projections of list views; the whole tuple is projected so it
+# matches the index exactly
+PROJECTIONS = {
+    'Conference': [('city', 'endDate', 'name', 'startDate')],
+    'Session': [('date', 'name', 'speaker', 'starttime', 'typeofsession')],
+}
+
+# form fields that are not a property of the same name
+DERIVED_FIELDS = ('websafeKey', 'organizerDisplayName')
+
+REPORT_SAMPLE_RATE = 0.05
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def parse(mask, form_class):
+    """Return the set of field names in mask, or None for no mask."""
+    if not mask:
+        return None
+    fields = set(f.strip() for f in mask.split(',') if f.strip())
+    unknown = fields - set(f.name for f in form_class.all_fields())
+    if unknown:
+        raise endpoints.BadRequestException(
+            'Unknown fields in fieldMask: %s' % ', '.join(sorted(unknown)))
+    return fields
+
+
+def projection(model, fields):
+    """Properties to project for a masked ancestor query, or None."""
+    if fields is None:
+        return None
+    props = fields.difference(DERIVED_FIELDS)
+    for index in PROJECTIONS.get(model._get_kind(), []):
+        if props.issubset(index):
+            return [model._properties[p] for p in index]
+    return None
+
+
+def wants(fields, name):
+    """True if the mask (None means everything) includes name."""
+    return fields is None or name in fields
+
+
+def report(endpoint, fields, response, started):
+    """Log payload size and latency for a sample of list responses."""
+    if random.random() >= REPORT_SAMPLE_RATE:
+        return
+    ms = (time.time() - started) * 1000
+    logging.info('%s mask=%s items=%d bytes=%d ms=%d', endpoint,
+                 ','.join(sorted(fields)) if fields else 'full',
+                 len(response.items), len(protojson.encode_message(response)), ms)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+idempotency.py -- replay of retried creates by client request id
+
+createConference, createSession and addSessionToWishlist take an optional
+requestId. The first call with a given (user, method, requestId) runs and
+its response is stored in a RequestRecord entity and in memcache; a retry
+gets that stored response back without running again, so it allocates no
+ids, writes no entities and queues no mail. A retry that arrives while
+the first call is still running gets 409 and should try again shortly.
+
+The record also keeps a hash of the request without its requestId. A
+call that reuses a requestId with a different request gets 400 instead
+of the other request's response.
+
+The create and its RequestRecord are not written in one transaction:
+the record is put after run() returns. If that put fails, or run()
+outlives the LEASE_SECONDS lease, a retry finds no record and runs the
+create again. Conference mail is still sent once (mailer names its
+tasks), but a second conference or session can be created.
+
+Records are honoured for RECORD_TTL and deleted by the nightly cron.
+
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+from auth import getUserId
+from models import ConflictException
+from models import RequestRecord
+import repository
+
+RECORD_TTL = timedelta(days=1)
+MEMCACHE_RECORD_KEY = 'REQUEST:%s'
+LEASE_SUFFIX = ':lease'
+LEASE_SECONDS = 60
+MAX_REQUEST_ID_LENGTH = 100
+EXPIRE_BATCH = 500
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def recordId(method_name, request_id):
+    return '%s:%s:%s' % (getUserId(), method_name, request_id)
+
+
+def requestHash(request):
+    """Hash of a request message's fields other than requestId."""
+    fields = json.loads(protojson.encode_message(request))
+    fields.pop('requestId', None)
+    return hashlib.sha1(json.dumps(fields, sort_keys=True)).hexdigest()
+
+
+def _stored(record_id):
+    """(request hash, encoded response) of an earlier call, or None."""
+    mc_key = MEMCACHE_RECORD_KEY % record_id
+    stored = memcache.get(mc_key)
+    if isinstance(stored, basestring):
+        # cached before the hash was kept
+        stored = (None, stored)
+    if stored is None:
+        record = repository.get(ndb.Key(RequestRecord, record_id))
+        if record and record.created > datetime.utcnow() - RECORD_TTL:
+            stored = (record.requestHash, record.response)
+            memcache.add(mc_key, stored, time=int(RECORD_TTL.total_seconds()))
+    return stored
+
+
+def replay(method_name, request, response_type, run):
+    """Run a create once per request id; repeats return the first response.
+
+    Without request.requestId (or a signed-in user, which run then
+    rejects) run is simply called.
+    """
+    request_id = request.requestId
+    if not request_id or not endpoints.get_current_user():
+        return run()
+    if len(request_id) > MAX_REQUEST_ID_LENGTH:
+        raise endpoints.BadRequestException(
+            'requestId is limited to %d characters' % MAX_REQUEST_ID_LENGTH)
+
+    record_id = recordId(method_name, request_id)
+    request_hash = requestHash(request)
+    stored = _stored(record_id)
+    if stored is not None:
+        stored_hash, encoded = stored
+        if stored_hash and stored_hash != request_hash:
+            raise endpoints.BadRequestException(
+                'requestId %s was already used for a different request' % request_id)
+        logging.info('replaying %s for request %s', method_name, request_id)
+        return protojson.decode_message(response_type, encoded)
+
+    lease = MEMCACHE_RECORD_KEY % record_id + LEASE_SUFFIX
+    if not memcache.add(lease, 1, time=LEASE_SECONDS):
+        raise ConflictException(
+            'Request %s is still being processed, retry shortly' % request_id)
+    try:
+        # a failed call leaves no record, so its retry runs again
+        response = run()
+        encoded = protojson.encode_message(response)
+        repository.put(RequestRecord(id=record_id, response=encoded,
+                                     requestHash=request_hash))
+        memcache.set(MEMCACHE_RECORD_KEY % record_id, (request_hash, encoded),
+                     time=int(RECORD_TTL.total_seconds()))
+        return response
+    finally:
+        memcache.delete(lease)
+
+
+def expireRecords():
+    """Delete request records older than RECORD_TTL; used by the nightly cron."""
+    cutoff = datetime.utcnow() - RECORD_TTL
+    deleted = 0
+    while True:
+        keys = RequestRecord.query(RequestRecord.created < cutoff).fetch(
+            EXPIRE_BATCH, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+        if len(keys) < EXPIRE_BATCH:
+            return deleted
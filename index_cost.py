@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+index_cost.py -- index write operations per put() for every model
+
+Reads the ndb models in models.py and the composite indexes in index.yaml
+(statically, so it runs without the App Engine SDK), finds the properties
+the code queries, projects or names in a composite index, and prints per
+model:
+
+  - write operations for a new put (and a delete) and for updating each
+    property, from the datastore's pricing rules:
+        new put:  2 + 2 per indexed value + 1 per composite index row
+        update:   1 + 4 per changed indexed value + 2 per changed
+                  composite index row
+  - indexed properties that no query uses, to mark indexed=False;
+  - the cost of the hot writes listed in HOT_WRITES.
+
+Repeated properties are counted with the sizes in REPEATED_SIZES.
+--baseline ignores indexed=False on properties that are indexable, which
+gives the cost of the same models before they were trimmed.
+
+    python index_cost.py [--baseline]
+
+"""
+
+import ast
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODELS_FILE = 'models.py'
+INDEX_FILE = 'index.yaml'
+
+# tools and benchmarks do not run production queries
+SKIP_PREFIXES = ('bench_', 'profile_', 'index_cost')
+
+# property types that are never indexed
+UNINDEXED_TYPES = frozenset(['TextProperty', 'BlobProperty', 'JsonProperty',
+                             'PickleProperty', 'LocalStructuredProperty'])
+
+OPERATORS = frozenset(['=', '!=', '<', '<=', '>', '>='])
+
+# values assumed for repeated properties
+REPEATED_SIZES = {
+    ('Conference', 'topics'): 3,
+    ('Profile', 'conferenceKeysToAttend'): 5,
+    ('Profile', 'favoriteSessions'): 10,
+}
+DEFAULT_REPEATED_SIZE = 3
+
+# key path length; an ancestor composite index has a row per ancestor
+KEY_DEPTH = {
+    'Conference': 2,
+    'Session': 3,
+    'ConferenceSchedule': 3,
+    'SpeakerSession': 2,
+    'ConferenceRollup': 3,
+}
+
+# (write, model, properties it changes, changed values per property)
+HOT_WRITES = [
+    ('registerForConference', 'Conference', ('seatsAvailable', 'updated'), 1),
+    ('registerForConference', 'Profile', ('conferenceKeysToAttend',), 1),
+    ('addSessionToWishlist', 'Profile', ('favoriteSessions',), 1),
+    ('saveProfile', 'Profile', ('displayName', 'teeShirtSize'), 1),
+    ('updateConference', 'Conference', ('description', 'updated'), 1),
+    ('rollups.applyPending', 'RollupShard', ('counts', 'updated'), 1),
+    ('schedule.addSession', 'ConferenceSchedule', ('entries', 'updated', 'version'), 1),
+    ('migrateTask checkpoint', 'MigrationShard',
+     ('cursor', 'batches', 'processed', 'changed', 'updated'), 1),
+]
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _path(name):
+    return os.path.join(ROOT, name)
+
+
+def _isModel(node):
+    return any(isinstance(b, ast.Attribute) and b.attr == 'Model' for b in node.bases)
+
+
+def _keyword(call, name):
+    for kw in call.keywords:
+        if kw.arg == name and isinstance(kw.value, ast.Name):
+            return kw.value.id == 'True'
+    return None
+
+
+def loadModels(baseline=False):
+    """{model: [(property, type, indexed, repeated)]} in declaration order."""
+    tree = ast.parse(open(_path(MODELS_FILE)).read(), MODELS_FILE)
+    models = {}
+    for node in tree.body:
+        if not (isinstance(node, ast.ClassDef) and _isModel(node)):
+            continue
+        props = models[node.name] = []
+        for stmt in node.body:
+            if not (isinstance(stmt, ast.Assign) and isinstance(stmt.value, ast.Call)
+                    and isinstance(stmt.value.func, ast.Attribute)
+                    and stmt.value.func.attr.endswith('Property')):
+                continue
+            type_ = stmt.value.func.attr
+            indexed = type_ not in UNINDEXED_TYPES
+            if indexed and not baseline and _keyword(stmt.value, 'indexed') is False:
+                indexed = False
+            repeated = bool(_keyword(stmt.value, 'repeated'))
+            for target in stmt.targets:
+                props.append((target.id, type_, indexed, repeated))
+    return models
+
+
+def loadIndexes():
+    """[(kind, ancestor, [properties])] from index.yaml."""
+    indexes = []
+    for line in open(_path(INDEX_FILE)):
+        line = line.split('#', 1)[0].strip()
+        if line.startswith('- kind:'):
+            indexes.append((line.split(':', 1)[1].strip(), False, []))
+        elif line.startswith('ancestor:') and indexes:
+            kind, _, props = indexes[-1]
+            indexes[-1] = (kind, line.split(':', 1)[1].strip() == 'yes', props)
+        elif line.startswith('- name:') and indexes:
+            indexes[-1][2].append(line.split(':', 1)[1].strip())
+    return indexes
+
+
+def _strings(node):
+    if isinstance(node, ast.Str):
+        return [node.s]
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return [s for elt in node.elts for s in _strings(elt)]
+    return []
+
+
+def _queriedModels(tree, models):
+    """Models a module queries: Model.query(...) or repository.query/first(Model, ...)."""
+    queried = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        func = node.func
+        if (func.attr == 'query' and isinstance(func.value, ast.Name)
+                and func.value.id in models):
+            queried.add(func.value.id)
+        elif (func.attr in ('query', 'first') and node.args
+                and isinstance(node.args[0], ast.Name) and node.args[0].id in models):
+            queried.add(node.args[0].id)
+    return queried
+
+
+def querySites(models, indexes):
+    """{(model, property): [where]} for every property a query relies on.
+
+    Matches Model.property references (filters, projections, orders),
+    the field_masks PROJECTIONS and index.yaml, and by property name
+    repository (property, operator, value) filter tuples and the FIELDS
+    maps the query endpoints filter through, on the models the same file
+    queries.
+    """
+    sites = {}
+
+    def use(model, name, where):
+        if name in [p[0] for p in models.get(model, ())]:
+            sites.setdefault((model, name), []).append(where)
+
+    for filename in sorted(os.listdir(ROOT)):
+        if (not filename.endswith('.py') or filename == MODELS_FILE
+                or filename.startswith(SKIP_PREFIXES)):
+            continue
+        tree = ast.parse(open(_path(filename)).read(), filename)
+        queried = _queriedModels(tree, models)
+        for node in ast.walk(tree):
+            where = '%s:%d' % (filename, getattr(node, 'lineno', 0))
+            if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+                    and node.value.id in models):
+                use(node.value.id, node.attr, where)
+            elif (isinstance(node, ast.Tuple) and len(node.elts) == 3
+                    and isinstance(node.elts[0], ast.Str)
+                    and isinstance(node.elts[1], ast.Str)
+                    and node.elts[1].s in OPERATORS):
+                for model in queried:
+                    use(model, node.elts[0].s, where)
+            elif (isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict)
+                    and [getattr(t, 'id', None) for t in node.targets] in (['FIELDS'], ['PROJECTIONS'])):
+                for key, value in zip(node.value.keys, node.value.values):
+                    if node.targets[0].id == 'PROJECTIONS':
+                        for name in _strings(value):
+                            use(key.s, name, where)
+                    else:
+                        for name in _strings(value):
+                            for model in queried:
+                                use(model, name, where)
+
+    for kind, _, props in indexes:
+        for name in props:
+            use(kind, name, INDEX_FILE)
+    return sites
+
+
+def _values(model, name, repeated):
+    if not repeated:
+        return 1
+    return REPEATED_SIZES.get((model, name), DEFAULT_REPEATED_SIZE)
+
+
+def _compositeRows(model, props, index, changed=None):
+    """Rows one entity has in a composite index (those touching changed)."""
+    kind, ancestor, names = index
+    if changed is not None and not set(names) & set(changed):
+        return 0
+    sizes = dict((p[0], _values(model, p[0], p[3])) for p in props)
+    rows = KEY_DEPTH.get(kind, 1) if ancestor else 1
+    for name in names:
+        rows *= sizes.get(name, 1)
+    return rows
+
+
+def newPutCost(model, props, indexes):
+    indexed = sum(_values(model, p[0], p[3]) for p in props if p[2])
+    composite = sum(_compositeRows(model, props, i) for i in indexes if i[0] == model)
+    return 2 + 2 * indexed + composite
+
+
+def updateCost(model, props, indexes, changed, values=1):
+    """Write ops for a put that changes `values` values of each changed property."""
+    indexed = sum(values for p in props if p[0] in changed and p[2])
+    composite = sum(_compositeRows(model, props, i, changed)
+                    for i in indexes if i[0] == model)
+    return 1 + 4 * indexed + 2 * composite
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def report(baseline=False):
+    models = loadModels(baseline)
+    indexes = loadIndexes()
+    sites = querySites(loadModels(), indexes)
+    unused = []
+
+    for model in sorted(models):
+        props = models[model]
+        print '\n%s  new put/delete: %d write ops' % (model, newPutCost(model, props, indexes))
+        print '  %-24s %-18s %-8s %6s  %s' % ('property', 'type', 'indexed', 'update', 'queried at')
+        for name, type_, indexed, repeated in props:
+            where = sites.get((model, name), [])
+            print '  %-24s %-18s %-8s %6d  %s' % (
+                name + ('[]' if repeated else ''), type_, 'yes' if indexed else 'no',
+                updateCost(model, props, indexes, (name,)),
+                ', '.join(sorted(set(where))[:3]) + (' ...' if len(set(where)) > 3 else ''))
+            if indexed and not where:
+                unused.append('%s.%s' % (model, name))
+
+    print '\nhot writes'
+    for write, model, changed, values in HOT_WRITES:
+        if model in models:
+            print '  %-26s %-20s %3d write ops  (%s)' % (
+                write, model, updateCost(model, models[model], indexes, changed, values),
+                ', '.join(changed))
+
+    print '\nindexed but never queried (candidates for indexed=False):'
+    print '  ' + ('\n  '.join(unused) if unused else 'none')
+    return unused
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args not in ([], ['--baseline']):
+        sys.exit(__doc__)
+    report(baseline=bool(args))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+mailer.py -- coalesced confirmation email delivery
+
+createConference drops a compact JSON payload on a pull queue instead of
+pushing one task (and one mail API call) per conference. A cron driven
+worker leases the payloads in batches, folds them into one digest per
+recipient, sends the digests and deletes the leased tasks in bulk. When
+the mail API reports it is over quota the worker backs off exponentially
+and lets the unsent leases expire so they are picked up again later.
+
+Every recipient is sent on its own: a digest that fails for any other
+reason is left to its lease and retried, and dropped (logged with its
+payload) once its tasks have been leased MAX_SEND_ATTEMPTS times.
+Payloads that don't decode are dropped at once. Tasks whose digest went
+out are always deleted, even when a later recipient fails, so nothing
+is mailed twice and no bad payload holds up the queue.
+
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.runtime import apiproxy_errors
+
+MAIL_QUEUE = 'confirmation-mail'    # pull queue, see queue.yaml
+LEASE_SECONDS = 120
+LEASE_BATCH = 200                   # tasks per lease_tasks call
+MAX_BATCHES = 10                    # lease rounds per worker run
+MAX_SEND_ATTEMPTS = 5               # leases before a failing digest is dropped
+MEMCACHE_BACKOFF_KEY = 'MAIL_BACKOFF'
+BACKOFF_MIN_SECONDS = 60
+BACKOFF_MAX_SECONDS = 3600
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def queueConfirmation(email, conf, dedupe_id):
+    """Queue a confirmation for conf (a ConferenceForm) to email.
+
+    The task is named after dedupe_id, so queueing the same
+    confirmation twice sends one mail.
+    """
+    payload = json.dumps({
+        'email': email,
+        'name': conf.name,
+        'city': conf.city,
+        'startDate': conf.startDate,
+        'endDate': conf.endDate,
+        'maxAttendees': conf.maxAttendees,
+        'topics': list(conf.topics),
+    })
+    if isinstance(dedupe_id, unicode):
+        # request ids come from protorpc as unicode and may be non-ASCII
+        dedupe_id = dedupe_id.encode('utf-8')
+    name = 'confirm-%s' % hashlib.sha1(dedupe_id).hexdigest()
+    try:
+        taskqueue.Queue(MAIL_QUEUE).add(
+            taskqueue.Task(payload=payload, method='PULL', name=name))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('confirmation %s already queued', name)
+
+
+def _formatConference(conf):
+    """One digest line for a queued conference payload."""
+    line = '- %s' % conf['name']
+    if conf.get('city'):
+        line += ', %s' % conf['city']
+    if conf.get('startDate'):
+        line += ' (%s to %s)' % (conf['startDate'], conf.get('endDate') or '?')
+    if conf.get('topics'):
+        line += ' [%s]' % ', '.join(conf['topics'])
+    return line
+
+
+def _decode(task):
+    """The conference payload of a task, or None if it can't be mailed."""
+    try:
+        conf = json.loads(task.payload)
+    except ValueError:
+        return None
+    if not isinstance(conf, dict) or not conf.get('email') or not conf.get('name'):
+        return None
+    return conf
+
+
+def _sendDigest(email, confs):
+    """Send a single message listing every conference in confs."""
+    if len(confs) == 1:
+        subject = 'You created a new Conference!'
+        intro = 'Hi, you have created the following conference:'
+    else:
+        subject = 'You created %d new Conferences!' % len(confs)
+        intro = 'Hi, you have created the following conferences:'
+    mail.send_mail(
+        'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id()),     # from
+        email,                                      # to
+        subject,                                    # subj
+        '%s\r\n\r\n%s' % (intro, '\r\n'.join(       # body
+            _formatConference(conf) for conf in confs))
+    )
+
+
+def _backoffUntil():
+    """Return the time before which the worker should not send, or 0."""
+    backoff = memcache.get(MEMCACHE_BACKOFF_KEY)
+    return backoff['until'] if backoff else 0
+
+
+def _backOff():
+    """Double the backoff window after the mail API pushed back."""
+    backoff = memcache.get(MEMCACHE_BACKOFF_KEY)
+    seconds = min(backoff['seconds'] * 2, BACKOFF_MAX_SECONDS) \
+        if backoff else BACKOFF_MIN_SECONDS
+    memcache.set(MEMCACHE_BACKOFF_KEY,
+                 {'seconds': seconds, 'until': time.time() + seconds},
+                 time=BACKOFF_MAX_SECONDS * 2)
+    logging.warning('mail quota exceeded, backing off %ds', seconds)
+
+
+def sendConfirmationDigests():
+    """Lease queued confirmations, send one digest per recipient.
+
+    Returns the number of digest messages sent.
+    """
+    if _backoffUntil() > time.time():
+        return 0
+
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sent = 0
+    for _ in range(MAX_BATCHES):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+
+        # group payloads by recipient, keeping lease order
+        recipients = OrderedDict()
+        done = []
+        for task in tasks:
+            conf = _decode(task)
+            if conf is None:
+                logging.error('dropping malformed mail payload %r', task.payload)
+                done.append(task)
+                continue
+            recipients.setdefault(conf['email'], []).append((task, conf))
+
+        try:
+            for email, items in recipients.iteritems():
+                try:
+                    _sendDigest(email, [conf for task, conf in items])
+                except apiproxy_errors.OverQuotaError:
+                    # unsent tasks come back once their lease runs out
+                    _backOff()
+                    return sent
+                except Exception:
+                    attempts = max(task.retry_count or 0 for task, conf in items)
+                    if attempts < MAX_SEND_ATTEMPTS:
+                        logging.exception('digest to %s failed, retrying after the lease', email)
+                        continue
+                    logging.exception('dropping digest to %s after %d attempts: %r', email,
+                                      attempts, [conf for task, conf in items])
+                else:
+                    sent += 1
+                done.extend(task for task, conf in items)
+        finally:
+            if done:
+                queue.delete_tasks(done)
+
+        if len(tasks) < LEASE_BATCH:
+            break
+
+    memcache.delete(MEMCACHE_BACKOFF_KEY)
+    return sent
@@ -13,20 +13,43 @@ created by wesc on 2014 may 24
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
+
+# Handlers import what they use when they run, so a task or cron hitting
+# a fresh instance doesn't pay for loading the Endpoints services.
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load the API, prime caches and open RPC channels."""
+        from endpoints import api_config
+        from google.appengine.api import memcache
+        import announcements
+        import catalog
+        import services
+
+        # build the API config the SPI serves on the first request
+        api_config.ApiConfigGenerator().pretty_print_config_to_json(
+            [services.ConferenceApi, services.SessionApi])
+        # the cache reads open the memcache and datastore channels too
+        memcache.get_multi([announcements.MEMCACHE_ANNOUNCEMENTS_KEY])
+        announcements.ANNOUNCEMENT_CACHE.get()
+        announcements.FEATURED_SPEAKER_CACHE.get()
+        catalog.warm()
+        self.response.set_status(200)
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        import announcements
+        announcements.cacheAnnouncement()
         self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -38,7 +61,249 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class SendConfirmationDigestsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send batched confirmation emails from the pull queue."""
+        import mailer
+        mailer.sendConfirmationDigests()
+        self.response.set_status(204)
+
+
+class RefreshCacheHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a read-through cache entry in the background."""
+        import cache
+        cache.refreshCache(self.request.get('key'), self.request.get('rebuild'))
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self, kind, fmt):
+        """Stream one slice of an export; X-Export-Cursor resumes it."""
+        import export
+        if kind not in export.EXPORTS:
+            self.abort(404)
+        cursor = self.request.get('cursor') or None
+        self.response.headers['Content-Type'] = export.contentType(fmt)
+        next_cursor, more = export.exportSlice(
+            kind, fmt, self.response.out, cursor=cursor, header=not cursor)
+        if more:
+            self.response.headers['X-Export-Cursor'] = str(next_cursor)
+
+
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the nightly export of every kind."""
+        import export
+        fmt = self.request.get('format', 'ndjson')
+        if fmt not in export.EXPORT_FORMATS:
+            self.abort(400)
+        export.startExport(fmt)
+        self.response.set_status(204)
+
+
+class ExportTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export one slice of a kind and chain the next one."""
+        import export
+        export.exportTask(
+            self.request.get('exportId'),
+            self.request.get('kind'),
+            self.request.get('format'),
+            int(self.request.get('part')),
+            self.request.get('cursor') or None)
+
+
+class MigrationStatusHandler(webapp2.RequestHandler):
+    def get(self):
+        """Progress of one migration run (?run=), or the known migrations and runs."""
+        import json
+        import migrate
+        run_id = self.request.get('run')
+        if run_id:
+            body = migrate.status(run_id)
+        else:
+            body = {'migrations': sorted(migrate.MIGRATIONS), 'runs': migrate.runs()}
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(body, indent=2))
+
+
+class StartMigrationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Start a migration run; responds with its run id."""
+        import migrate
+        name = self.request.get('name')
+        if name not in migrate.MIGRATIONS:
+            self.abort(400)
+        run_id = migrate.startMigration(
+            name,
+            shards=int(self.request.get('shards', migrate.MIGRATION_SHARDS)),
+            dry_run=self.request.get('dryRun') in ('1', 'true'),
+            batch_size=int(self.request.get('batchSize', migrate.MIGRATION_BATCH_SIZE)),
+            delay=int(self.request.get('delay', migrate.MIGRATION_DELAY)))
+        self.response.write(run_id)
+
+
+class ResumeMigrationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Restart the unfinished shards of a migration run."""
+        import migrate
+        self.response.write(migrate.resumeMigration(self.request.get('run')))
+
+
+class MigrateTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a migration shard and chain the next one."""
+        import migrate
+        migrate.migrateTask(self.request.get('shard'),
+                            int(self.request.get('batch')))
+
+
+class ApplyRollupsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Add the queued rollup counter deltas to the shards."""
+        import rollups
+        rollups.applyPending()
+        self.response.set_status(204)
+
+
+class ReconcileRollupsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recompute the attendance and session rollups from scratch."""
+        import rollups
+        rollups.reconcile()
+        self.response.set_status(204)
+
+
+class RefreshAgendaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a user's agenda after a registration or wishlist change."""
+        import agenda
+        agenda.refreshTask(self.request.get('user'))
+
+
+class DeleteConferenceTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a conference delete cascade."""
+        import cascade
+        cascade.cascadeTask(self.request.get('conference'),
+                            self.request.get('stage'),
+                            int(self.request.get('batch')),
+                            self.request.get('cursor') or None)
+
+
+class ExpireRequestRecordsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete expired request id records."""
+        import idempotency
+        idempotency.expireRecords()
+        self.response.set_status(204)
+
+
+class ArchiveHandler(webapp2.RequestHandler):
+    def get(self):
+        """Archive conferences that have ended, with their sessions."""
+        import archive
+        archive.archivePast()
+        self.response.set_status(204)
+
+
+class ArchiveTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Archive the next batch of ended conferences."""
+        import archive
+        archive.archiveTask(self.request.get('today'))
+
+
+class RefreshResponseHandler(webapp2.RequestHandler):
+    def post(self):
+        """Redo a read that was answered from its stale copy."""
+        import stale
+        stale.refreshTask(self.request.get('method'), self.request.get('params'))
+
+
+def _serveFeed(handler, feed, *args):
+    """Answer a public feed request with caching headers or a 304."""
+    import feeds
+    try:
+        tag, modified, build = getattr(feeds, feed)(*args)
+    except feeds.FeedNotFound:
+        handler.abort(404)
+    feeds.respond(handler, tag, modified, build)
+
+
+class ConferencesFeedHandler(webapp2.RequestHandler):
+    def get(self):
+        """Current conferences as public, cacheable JSON."""
+        _serveFeed(self, 'conferences')
+
+
+class ConferenceFeedHandler(webapp2.RequestHandler):
+    def get(self, wsck):
+        """One conference as public, cacheable JSON."""
+        _serveFeed(self, 'conference', wsck)
+
+
+class ScheduleFeedHandler(webapp2.RequestHandler):
+    def get(self, wsck):
+        """A conference's schedule as public, cacheable JSON."""
+        _serveFeed(self, 'conferenceSchedule', wsck)
+
+
+class ReadTransportHandler(webapp2.RequestHandler):
+    def get(self, api_name, method_name):
+        """Call a read endpoint and answer in protobuf or JSON per Accept."""
+        import endpoints
+        from protorpc import messages
+        import transport
+        method = transport.resolve('%s.%s' % (api_name, method_name))
+        if method is None:
+            self.abort(404)
+        try:
+            request = transport.decode(method.remote.request_type,
+                                       self.request.headers.get('Content-Type'),
+                                       self.request.body, self.request.query_string)
+        except (messages.Error, ValueError):
+            self.abort(400)
+        try:
+            response = method(request)
+        except endpoints.ServiceException as e:
+            self.response.set_status(e.http_status)
+            if getattr(e, 'retryAfter', None):
+                self.response.headers['Retry-After'] = str(e.retryAfter)
+            self.response.write(str(e))
+            return
+        content_type, body = transport.encode(
+            response, transport.wantsProtobuf(self.request.headers.get('Accept')))
+        self.response.headers['Content-Type'] = content_type
+        self.response.headers['Vary'] = 'Accept'
+        self.response.write(body)
+
+    post = get
+
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/crons/send_confirmation_digests', SendConfirmationDigestsHandler),
+    ('/tasks/refresh_cache', RefreshCacheHandler),
+    ('/tasks/refresh_response', RefreshResponseHandler),
+    ('/tasks/refresh_agenda', RefreshAgendaHandler),
+    ('/crons/export', StartExportHandler),
+    ('/tasks/export', ExportTaskHandler),
+    (r'/export/(\w+)\.(ndjson|csv)', ExportHandler),
+    ('/migrations', MigrationStatusHandler),
+    ('/migrations/start', StartMigrationHandler),
+    ('/migrations/resume', ResumeMigrationHandler),
+    ('/tasks/migrate', MigrateTaskHandler),
+    ('/crons/apply_rollups', ApplyRollupsHandler),
+    ('/crons/reconcile_rollups', ReconcileRollupsHandler),
+    ('/crons/archive', ArchiveHandler),
+    ('/tasks/archive', ArchiveTaskHandler),
+    ('/tasks/delete_conference', DeleteConferenceTaskHandler),
+    ('/crons/expire_request_records', ExpireRequestRecordsHandler),
+    (r'/feeds/conferences\.json', ConferencesFeedHandler),
+    (r'/feeds/conferences/([\w-]+)\.json', ConferenceFeedHandler),
+    (r'/feeds/conferences/([\w-]+)/schedule\.json', ScheduleFeedHandler),
+    (r'/api/(\w+)/(\w+)', ReadTransportHandler),
 ], debug=True)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+migrate.py -- sharded, resumable backfills over a whole kind
+
+A migration is a transform run on every entity of one kind. Starting a
+run splits the kind into key ranges from the datastore's __scatter__
+sample, stores a MigrationShard checkpoint per range and chains
+fetch_page batches per shard through the 'migrations' task queue. Every
+batch writes its changes with put_multi and then moves the shard's
+cursor forward in a transaction, so a failed or resumed run continues
+from the last finished batch. Transforms must be idempotent: a batch
+that fails after its put is run again.
+
+Throughput is bounded by the queue rate, the batch size and the delay
+between the batches of a shard. A dry run reads and transforms but
+writes nothing except the counts.
+
+"""
+
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from google.appengine.api import datastore
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import MigrationShard
+from models import Profile
+from models import Session
+
+MIGRATION_QUEUE = 'migrations'
+MIGRATION_SHARDS = 8
+MIGRATION_BATCH_SIZE = 100
+MIGRATION_DELAY = 0              # seconds between two batches of a shard
+SCATTER_OVERSAMPLE = 32          # scatter keys sampled per shard
+
+# transform(entity) -> True if it changed the entity
+# onWrite(entities) runs after a batch of changed entities was put
+Migration = namedtuple('Migration', ['model', 'transform', 'onWrite'])
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _conferenceMonth(conf):
+    """month was added after some conferences were written."""
+    month = conf.startDate.month if conf.startDate else 0
+    if conf.month == month:
+        return False
+    conf.month = month
+    return True
+
+
+def _sessionType(session):
+    """Sessions written before the default have no type."""
+    if session.typeofsession:
+        return False
+    session.typeofsession = 'NOT_SPECIFIED'
+    return True
+
+
+def _dedupe(values):
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+def _profileLists(prof):
+    """Drop repeated registrations and wishlist entries."""
+    keys = _dedupe(prof.conferenceKeysToAttend)
+    favorites = _dedupe(prof.favoriteSessions)
+    if (len(keys) == len(prof.conferenceKeysToAttend) and
+            len(favorites) == len(prof.favoriteSessions)):
+        return False
+    prof.conferenceKeysToAttend = keys
+    prof.favoriteSessions = favorites
+    return True
+
+
+def _resave(entity):
+    """Rewrite as is, e.g. to index a property that was unindexed."""
+    return True
+
+
+def _conferencesWritten(confs):
+    import catalog
+    catalog.invalidate()
+
+
+def _sessionsWritten(sessions):
+    import schedule
+    schedule.dropSchedules(set(session.key.parent() for session in sessions))
+
+
+MIGRATIONS = {
+    'conference_month': Migration(Conference, _conferenceMonth, _conferencesWritten),
+    'session_type': Migration(Session, _sessionType, _sessionsWritten),
+    'profile_dedupe': Migration(Profile, _profileLists, None),
+    'resave_conferences': Migration(Conference, _resave, _conferencesWritten),
+    'resave_sessions': Migration(Session, _resave, _sessionsWritten),
+    'resave_profiles': Migration(Profile, _resave, None),
+}
+
+
+def _splitPoints(model, shards):
+    """Up to shards-1 sorted keys that cut the kind into similar ranges."""
+    query = datastore.Query(model._get_kind(), keys_only=True)
+    query.Order('__scatter__')
+    sample = sorted(ndb.Key.from_old_key(key)
+                    for key in query.Get(shards * SCATTER_OVERSAMPLE))
+    if len(sample) < shards:
+        return sample
+    step = len(sample) / float(shards)
+    return [sample[int(step * i)] for i in range(1, shards)]
+
+
+def _rangeQuery(model, start, end):
+    query = model.query()
+    if start:
+        query = query.filter(model._key >= start)
+    if end:
+        query = query.filter(model._key < end)
+    return query.order(model._key)
+
+
+def _enqueueBatch(shard, suffix=''):
+    """Enqueue the next batch of a shard; named so a retried task can't fork it."""
+    try:
+        taskqueue.add(name='migrate-%s-%d%s' % (shard.key.id(), shard.batches, suffix),
+                      queue_name=MIGRATION_QUEUE, url='/tasks/migrate',
+                      params={'shard': shard.key.id(), 'batch': shard.batches},
+                      countdown=shard.delay)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def startMigration(name, shards=MIGRATION_SHARDS, dry_run=False,
+                   batch_size=MIGRATION_BATCH_SIZE, delay=MIGRATION_DELAY):
+    """Split the kind, checkpoint every shard and start them; return the run id."""
+    if name not in MIGRATIONS:
+        raise ValueError('Unknown migration: %s' % name)
+    model = MIGRATIONS[name].model
+    run_id = '%s-%s' % (name, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    bounds = [None] + _splitPoints(model, max(1, shards)) + [None]
+    shard_list = [MigrationShard(id='%s-%03d' % (run_id, i), migration=name,
+                                 runId=run_id, shard=i, startKey=bounds[i],
+                                 endKey=bounds[i + 1], batchSize=batch_size,
+                                 delay=delay, dryRun=dry_run)
+                  for i in range(len(bounds) - 1)]
+    ndb.put_multi(shard_list)
+    for shard in shard_list:
+        _enqueueBatch(shard)
+    logging.info('migration %s started with %d shards (dry run: %s)',
+                 run_id, len(shard_list), dry_run)
+    return run_id
+
+
+def resumeMigration(run_id):
+    """Re-enqueue every unfinished shard of a run; return how many."""
+    shards = [s for s in MigrationShard.query(MigrationShard.runId == run_id)
+              if not s.done]
+    # a task still queued for the same batch finds its checkpoint moved
+    # on and stops, so resuming a live run doesn't double it
+    suffix = '-r%d' % time.time()
+    for shard in shards:
+        _enqueueBatch(shard, suffix)
+    return len(shards)
+
+
+def _recordError(shard_key, error):
+    shard = shard_key.get()
+    shard.error = '%s: %s' % (type(error).__name__, error)
+    shard.put()
+
+
+def migrateTask(shard_id, batch):
+    """Run one batch of a shard, checkpoint it and chain the next one."""
+    shard = MigrationShard.get_by_id(shard_id)
+    if not shard or shard.done or shard.batches != batch:
+        # finished, or a duplicate of a batch that already went through
+        return
+    migration = MIGRATIONS[shard.migration]
+
+    query = _rangeQuery(migration.model, shard.startKey, shard.endKey)
+    start = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+    entities, cursor, more = query.fetch_page(shard.batchSize, start_cursor=start)
+    try:
+        changed = [entity for entity in entities if migration.transform(entity)]
+        if changed and not shard.dryRun:
+            ndb.put_multi(changed)
+            if migration.onWrite:
+                migration.onWrite(changed)
+    except Exception as e:
+        # the task queue retries the batch; keep the reason for /migrations
+        _recordError(shard.key, e)
+        raise
+    if changed and shard.dryRun:
+        logging.info('%s dry run would change %s', shard_id,
+                     ', '.join(entity.key.urlsafe() for entity in changed[:10]))
+
+    @ndb.transactional
+    def checkpoint():
+        current = shard.key.get()
+        if current.batches != batch:
+            return None
+        current.cursor = cursor.urlsafe() if more and cursor else None
+        current.batches += 1
+        current.processed += len(entities)
+        current.changed += len(changed)
+        current.done = not more
+        current.error = None
+        current.put()
+        return current
+
+    current = checkpoint()
+    if current and not current.done:
+        _enqueueBatch(current)
+
+
+def status(run_id):
+    """Progress of a run as a dict of totals and per shard counts."""
+    shards = sorted(MigrationShard.query(MigrationShard.runId == run_id),
+                    key=lambda s: s.shard)
+    return {
+        'runId': run_id,
+        'migration': shards[0].migration if shards else None,
+        'dryRun': shards[0].dryRun if shards else None,
+        'done': bool(shards) and all(s.done for s in shards),
+        'processed': sum(s.processed for s in shards),
+        'changed': sum(s.changed for s in shards),
+        'shards': [{
+            'shard': s.shard,
+            'batches': s.batches,
+            'processed': s.processed,
+            'changed': s.changed,
+            'done': s.done,
+            'error': s.error,
+            'updated': s.updated.isoformat() if s.updated else None,
+        } for s in shards],
+    }
+
+
+def runs(limit=50):
+    """Most recent runs, newest first."""
+    firsts = MigrationShard.query(MigrationShard.shard == 0).fetch(limit)
+    firsts.sort(key=lambda s: s.runId.rsplit('-', 1)[-1], reverse=True)
+    return [{'runId': s.runId, 'migration': s.migration, 'dryRun': s.dryRun}
+            for s in firsts]
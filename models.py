@@ -24,11 +24,12 @@ class ConflictException(endpoints.ServiceException):
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
-    displayName = ndb.StringProperty()
-    mainEmail = ndb.StringProperty()
-    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    favoriteSessions = ndb.KeyProperty(kind='Session', repeated=True)
+    displayName = ndb.StringProperty(indexed=False)
+    mainEmail = ndb.StringProperty(indexed=False)
+    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED', indexed=False)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True, indexed=False)
+    favoriteSessions = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -53,8 +54,8 @@ class BooleanMessage(messages.Message):
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
-    description     = ndb.StringProperty()
-    organizerUserId = ndb.StringProperty()
+    description     = ndb.StringProperty(indexed=False)
+    organizerUserId = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -62,6 +63,8 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    updated         = ndb.DateTimeProperty(auto_now=True)
+    archived        = ndb.BooleanProperty(default=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,10 +80,13 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    stale           = messages.BooleanField(13)
+    requestId       = messages.StringField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    stale = messages.BooleanField(2)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -109,18 +115,39 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    fieldMask = messages.StringField(2)
+    includeArchived = messages.BooleanField(3)
 
 
 
 class Speaker(ndb.Model):
-	""" Speaker obect - could be extended later """
+	""" Speaker obect with profile and an index of its sessions """
 	name = ndb.StringProperty(required=True)
+	bio = ndb.TextProperty()
+	organization = ndb.StringProperty(indexed=False)
+	photoUrl = ndb.StringProperty(indexed=False)
+	creatorUserId = ndb.StringProperty(indexed=False)
+	# True once the SpeakerSession children hold all its sessions (speakers.py)
+	sessionsIndexed = ndb.BooleanProperty(indexed=False)
+
+class SpeakerSession(ndb.Model):
+	""" SpeakerSession - one session in a speaker's index, child of the Speaker, id is the websafe session key """
+	date = ndb.DateProperty()
+	starttime = ndb.TimeProperty()
 
 class SpeakerForm(messages.Message):
 	""" SpeakerForm - inbound/outbound Speaker info """
 	name = messages.StringField(1)
 	websafeKey = messages.StringField(2)
 
+class SpeakerProfileForm(messages.Message):
+	""" SpeakerProfileForm - inbound/outbound Speaker with profile fields """
+	name = messages.StringField(1)
+	websafeKey = messages.StringField(2)
+	bio = messages.StringField(3)
+	organization = messages.StringField(4)
+	photoUrl = messages.StringField(5)
+
 
 class SpeakerForms(messages.Message):
 	""" SpeakerForms - multiple outboug SpeakForm message """
@@ -132,13 +159,14 @@ class Session(ndb.Model):
     #but the task says enable, so....
 	_use_memcache=True
 	name = ndb.StringProperty(required=True)
-	highlights = ndb.StringProperty()
+	highlights = ndb.StringProperty(indexed=False)
 	speaker = ndb.KeyProperty(kind="Speaker")
 	duration = ndb.IntegerProperty()
     #Since EnumProperty is in 'Alpha', use string for now
 	typeofsession = ndb.StringProperty(default='NOT_SPECIFIED')
 	date = ndb.DateProperty()
 	starttime = ndb.TimeProperty()
+	archived = ndb.BooleanProperty(default=False)
 
 class SessionForm(messages.Message):
 	""" SessionForm - Form for session entity"""
@@ -149,12 +177,21 @@ class SessionForm(messages.Message):
 	typeofsession = messages.EnumField('SessionType',5)
 	date = messages.StringField(6)
 	starttime = messages.StringField(7)
+	websafeKey = messages.StringField(8)
 
 class SessionForms(messages.Message):
     """
         SessionForms - For returning multiple session forms
     """
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    stale = messages.BooleanField(2)
+    nextPageToken = messages.StringField(3)
+
+class SpeakerPageForm(messages.Message):
+	""" SpeakerPageForm - a speaker's profile and one page of their sessions """
+	speaker = messages.MessageField(SpeakerProfileForm, 1)
+	items = messages.MessageField(SessionForm, 2, repeated=True)
+	nextPageToken = messages.StringField(3)
 
 class SpeakerQueryForm(messages.Message):
 	""" SpeakerQueryForm - inbound form for speak query """
@@ -171,3 +208,158 @@ class SessionType(messages.Enum):
 	NOT_SPECIFIED = 1
 	WORKSHOP = 2
 	LECTURE = 3
+
+
+class SearchQueryForm(messages.Message):
+    """SearchQueryForm -- full text, range and facet search inbound form message"""
+    text             = messages.StringField(1)
+    filters          = messages.MessageField(ConferenceQueryForm, 2, repeated=True)
+    facetRefinements = messages.StringField(3, repeated=True)
+    sortBy           = messages.StringField(4)
+    descending       = messages.BooleanField(5)
+    limit            = messages.IntegerField(6)
+    cursor           = messages.StringField(7)
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- one facet value and its match count"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- facet outbound form message"""
+    name = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class ConferenceSearchForms(messages.Message):
+    """ConferenceSearchForms -- one page of Conference search results"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
+    cursor = messages.StringField(3)
+    source = messages.StringField(4)
+
+class SessionSearchForms(messages.Message):
+    """SessionSearchForms -- one page of Session search results"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
+    cursor = messages.StringField(3)
+    source = messages.StringField(4)
+
+
+class BatchOperationForm(messages.Message):
+    """BatchOperationForm -- one API call inside a batch request"""
+    id = messages.StringField(1)
+    method = messages.StringField(2)        # e.g. conference.getConference
+    params = messages.StringField(3)        # JSON encoded request fields
+
+class BatchRequestForm(messages.Message):
+    """BatchRequestForm -- multiple BatchOperationForm inbound form message"""
+    operations = messages.MessageField(BatchOperationForm, 1, repeated=True)
+
+class BatchResultForm(messages.Message):
+    """BatchResultForm -- status and JSON encoded response of one operation"""
+    id = messages.StringField(1)
+    status = messages.IntegerField(2)
+    error = messages.StringField(3)
+    body = messages.StringField(4)
+
+class BatchResponseForm(messages.Message):
+    """BatchResponseForm -- multiple BatchResultForm outbound form message"""
+    results = messages.MessageField(BatchResultForm, 1, repeated=True)
+
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- one slice of a nightly NDJSON/CSV export"""
+    exportId    = ndb.StringProperty()
+    kind        = ndb.StringProperty(indexed=False)
+    format      = ndb.StringProperty(indexed=False)
+    part        = ndb.IntegerProperty(indexed=False)
+    data        = ndb.TextProperty()
+    nextCursor  = ndb.StringProperty(indexed=False)
+    final       = ndb.BooleanProperty(default=False, indexed=False)
+    created     = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class ConferenceSchedule(ndb.Model):
+    """ConferenceSchedule -- sorted session tuples of one conference, child of the Conference"""
+    # memcached explicitly by schedule.py
+    _use_memcache = False
+    entries     = ndb.JsonProperty(indexed=False)
+    updated     = ndb.DateTimeProperty(auto_now=True, indexed=False)
+    version     = ndb.IntegerProperty(default=0, indexed=False)
+
+class ScheduleEntryForm(messages.Message):
+    """ScheduleEntryForm -- one session in a conference schedule"""
+    date            = messages.StringField(1)
+    starttime       = messages.StringField(2)
+    duration        = messages.IntegerField(3)
+    typeofsession   = messages.StringField(4)
+    speaker         = messages.StringField(5)
+    websafeKey      = messages.StringField(6)
+    name            = messages.StringField(7)
+
+class ScheduleForm(messages.Message):
+    """ScheduleForm -- a conference schedule, optionally narrowed to a day/time window"""
+    websafeConferenceKey = messages.StringField(1)
+    items = messages.MessageField(ScheduleEntryForm, 2, repeated=True)
+
+class RequestRecord(ndb.Model):
+    """RequestRecord -- response of a create, kept to replay client retries"""
+    response    = ndb.TextProperty()
+    requestHash = ndb.StringProperty(indexed=False)
+    created     = ndb.DateTimeProperty(auto_now_add=True)
+
+class AgendaItemForm(messages.Message):
+    """AgendaItemForm -- one conference or wishlisted session in a user's agenda"""
+    kind            = messages.StringField(1)
+    start           = messages.StringField(2)
+    end             = messages.StringField(3)
+    websafeKey      = messages.StringField(4)
+    name            = messages.StringField(5)
+    websafeConferenceKey = messages.StringField(6)
+    city            = messages.StringField(7)
+    speaker         = messages.StringField(8)
+    typeofsession   = messages.StringField(9)
+    overlaps        = messages.BooleanField(10)
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- a user's conferences and wishlisted sessions in time order"""
+    items = messages.MessageField(AgendaItemForm, 1, repeated=True)
+
+class MigrationShard(ndb.Model):
+    """MigrationShard -- checkpoint of one key range of a migration run"""
+    migration   = ndb.StringProperty(indexed=False)
+    runId       = ndb.StringProperty()
+    shard       = ndb.IntegerProperty()
+    startKey    = ndb.KeyProperty(indexed=False)
+    endKey      = ndb.KeyProperty(indexed=False)
+    cursor      = ndb.StringProperty(indexed=False)
+    batchSize   = ndb.IntegerProperty(indexed=False)
+    delay       = ndb.IntegerProperty(indexed=False)
+    dryRun      = ndb.BooleanProperty(default=False, indexed=False)
+    batches     = ndb.IntegerProperty(default=0, indexed=False)
+    processed   = ndb.IntegerProperty(default=0, indexed=False)
+    changed     = ndb.IntegerProperty(default=0, indexed=False)
+    done        = ndb.BooleanProperty(default=False, indexed=False)
+    error       = ndb.TextProperty()
+    updated     = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class RollupShard(ndb.Model):
+    """RollupShard -- one shard of the global conference/session counters"""
+    counts      = ndb.JsonProperty(indexed=False)
+    updated     = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class ConferenceRollup(ndb.Model):
+    """ConferenceRollup -- session counts of one conference, child of the Conference"""
+    sessionsByType = ndb.JsonProperty(indexed=False)
+
+class RollupForm(messages.Message):
+    """RollupForm -- aggregates for one value of a dimension (city, month, topic, type)"""
+    dimension   = messages.StringField(1)
+    value       = messages.StringField(2)
+    conferences = messages.IntegerField(3)
+    capacity    = messages.IntegerField(4)
+    seatsSold   = messages.IntegerField(5)
+    sessions    = messages.IntegerField(6)
+
+class RollupForms(messages.Message):
+    """RollupForms -- multiple RollupForm outbound form message"""
+    items = messages.MessageField(RollupForm, 1, repeated=True)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+profile_endpoints.py -- endpoint CPU profile with storage taken out
+
+Loads conferences, sessions, speakers and profiles into the in-memory
+repository (or the datastore stub with --ndb, to compare) and runs the
+main read and registration endpoints under cProfile, printing the time
+per call and the functions that cost the most. Memcache, task queue and
+search still run on their SDK stubs.
+
+    python profile_endpoints.py /path/to/google_appengine [conferences] [--ndb]
+
+"""
+
+import cProfile
+import os
+import pstats
+import random
+import sys
+import time
+from datetime import date
+from datetime import time as daytime
+
+CONFERENCES = 10000
+SESSIONS_PER_CONFERENCE = 10
+SPEAKERS = 200
+USERS = 500
+CALLS = 200
+TOP = 15
+CITIES = ['London', 'Paris', 'Berlin', 'Tokyo', 'Chicago', 'Austin']
+TOPICS = ['Web', 'Cloud', 'Mobile', 'Data', 'Security', 'Games']
+TYPES = ['LECTURE', 'WORKSHOP', 'NOT_SPECIFIED']    # models.SessionType
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _setup(sdk_path, use_ndb):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(ENDPOINTS_AUTH_EMAIL='bench@example.com',
+                 ENDPOINTS_AUTH_DOMAIN='', overwrite=True)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=sys.path[0] or '.')
+    tb.init_search_stub()
+    tb.init_urlfetch_stub()
+    if use_ndb:
+        tb.init_datastore_v3_stub()
+    else:
+        import repository
+        repository.use(repository.MemoryRepository())
+    return tb
+
+
+def _populate(n):
+    import repository
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import Speaker
+    rnd = random.Random(n)
+    speakers = [Speaker(name='Speaker %d' % i) for i in range(SPEAKERS)]
+    speakers.append(Speaker(name='Undefined'))
+    repository.putMulti(speakers)
+    profiles = [Profile(id='user%d' % i, displayName='User %d' % i,
+                        mainEmail='user%d@example.com' % i)
+                for i in range(USERS)]
+    repository.putMulti(profiles)
+
+    confs, sessions = [], []
+    for i in xrange(n):
+        month = rnd.randint(1, 12)
+        seats = rnd.randint(50, 1000)
+        conf = Conference(id=i + 1, parent=profiles[i % USERS].key,
+                          name='Conference %06d' % i, city=rnd.choice(CITIES),
+                          organizerUserId=profiles[i % USERS].key.id(),
+                          topics=rnd.sample(TOPICS, 2), month=month,
+                          startDate=date(2026, month, 1), endDate=date(2026, month, 3),
+                          maxAttendees=seats, seatsAvailable=seats)
+        confs.append(conf)
+        for j in range(SESSIONS_PER_CONFERENCE):
+            sessions.append(Session(
+                parent=conf.key, name='Session %d.%d' % (i, j),
+                speaker=rnd.choice(speakers).key, duration=rnd.choice([30, 60]),
+                typeofsession=rnd.choice(TYPES), date=date(2026, month, 1 + j % 3),
+                starttime=daytime(9 + j % 10, 0)))
+    for start in xrange(0, len(confs), 500):
+        repository.putMulti(confs[start:start + 500])
+    for start in xrange(0, len(sessions), 500):
+        repository.putMulti(sessions[start:start + 500])
+    return [conf.key.urlsafe() for conf in confs]
+
+
+def _signIn(user_id):
+    """Act as user_id for the next call (auth.getUserId's request memo)."""
+    import auth
+    os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % user_id
+    os.environ[auth.USER_AUTH_ENV] = os.environ['HTTP_AUTHORIZATION']
+    os.environ[auth.USER_ID_ENV] = user_id
+
+
+def _profile(label, call):
+    profiler = cProfile.Profile()
+    start = time.time()
+    profiler.enable()
+    for i in range(CALLS):
+        call(i)
+    profiler.disable()
+    elapsed = time.time() - start
+    print '\n== %s: %.2f ms/call' % (label, elapsed * 1000 / CALLS)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(TOP)
+
+
+def main(sdk_path, n, use_ndb):
+    tb = _setup(sdk_path, use_ndb)
+    import endpoints
+    from conference import CONF_GET_REQUEST
+    from conference import ConferenceApi
+    from con_session import SESSION_FOR_CONFERENCE_GET_REQUEST
+    from con_session import SCHEDULE_GET_REQUEST
+    from con_session import SessionApi
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+
+    keys = _populate(n)
+    rnd = random.Random(0)
+    conf_api, session_api = ConferenceApi(), SessionApi()
+    conf_request = lambda i: CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=rnd.choice(keys))
+
+    def register(i):
+        _signIn('user%d' % (i % USERS))
+        try:
+            conf_api.registerForConference(conf_request(i))
+        except endpoints.ServiceException:
+            pass
+
+    print 'storage: %s, %d conferences' % ('datastore stub' if use_ndb else 'memory', n)
+    _profile('getConference', lambda i: conf_api.getConference(conf_request(i)))
+    _profile('queryConferences', lambda i: conf_api.queryConferences(ConferenceQueryForms(
+        filters=[ConferenceQueryForm(field='CITY', operator='EQ', value=rnd.choice(CITIES)),
+                 ConferenceQueryForm(field='MONTH', operator='GT', value='6')])))
+    _profile('sessionByConf', lambda i: session_api.sessionByConf(
+        SESSION_FOR_CONFERENCE_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=rnd.choice(keys))))
+    _profile('getSchedule', lambda i: session_api.getSchedule(
+        SCHEDULE_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=rnd.choice(keys), startTime='10:00', endTime='14:00')))
+    _profile('registerForConference', register)
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--ndb']
+    if not 1 <= len(args) <= 2:
+        sys.exit(__doc__)
+    main(args[0], int(args[1]) if len(args) > 1 else CONFERENCES, '--ndb' in sys.argv)
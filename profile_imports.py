@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+profile_imports.py -- cold start import cost of each entry point
+
+Every measurement runs in a fresh interpreter, the way a new instance
+would load it. Run it against two checkouts to compare before/after:
+
+    python profile_imports.py /path/to/google_appengine
+
+"""
+
+import os
+import subprocess
+import sys
+
+# (label, modules a cold instance loads for that request)
+ENTRY_POINTS = [
+    ('main.app (module only)', ['main']),
+    ('cron set_announcement', ['main', 'announcements']),
+    ('cron confirmation digests', ['main', 'mailer']),
+    ('task refresh_cache', ['main', 'cache', 'announcements']),
+    ('task export', ['main', 'export']),
+    ('services.api (Endpoints)', ['services']),
+    ('warmup', ['main', 'services', 'announcements', 'catalog']),
+]
+REPEAT = 5
+
+TIMER = r'''
+import sys, time
+sys.path.insert(0, %(sdk)r)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, %(app)r)
+start = time.time()
+for name in %(modules)r:
+    __import__(name)
+elapsed = time.time() - start
+print '%%.1f %%d' %% (elapsed * 1000, len(sys.modules))
+'''
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _measure(sdk, app, modules):
+    """Best of REPEAT cold imports: (ms, modules loaded)."""
+    best = None
+    for _ in range(REPEAT):
+        out = subprocess.check_output([sys.executable, '-c', TIMER % {
+            'sdk': sdk, 'app': app, 'modules': modules}],
+            stderr=open(os.devnull, 'w'))
+        ms, loaded = out.split()
+        result = (float(ms), int(loaded))
+        best = result if best is None or result < best else best
+    return best
+
+
+def main(sdk):
+    app = sys.path[0] or '.'
+    print '%-28s %10s %10s' % ('entry point', 'import ms', 'modules')
+    for label, modules in ENTRY_POINTS:
+        try:
+            ms, loaded = _measure(sdk, app, modules)
+        except subprocess.CalledProcessError:
+            # older checkouts don't have every module
+            print '%-28s %10s %10s' % (label, 'n/a', 'n/a')
+            continue
+        print '%-28s %10.1f %10d' % (label, ms, loaded)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+query_planner.py -- plans queryConferences filters against a small index set
+
+Every combination of city/topics/month/maxAttendees used to need its own
+composite index (plus the sort on name), and each Conference put paid for
+all of them. The planner only sends filters to the datastore that can be
+answered from the built-in single property indexes:
+
+  - all equality filters together, which the datastore serves with a
+    zigzag merge join and no composite index, or
+  - the range filters on one property when there are no equalities.
+
+Anything else (ranges next to equalities, '!=' filters) is applied
+in memory, and the name ordering is done after the fetch. Each execution
+logs the chosen plan with its cost so index.yaml can be kept trimmed.
+
+"""
+
+import logging
+import time
+from datetime import datetime
+
+import endpoints
+
+from models import Conference
+import repository
+
+# convert filter values from their string form to the property type
+CONVERTERS = {
+    'month': int,
+    'maxAttendees': int,
+    'duration': int,
+    'startDate': lambda v: datetime.strptime(v[:10], '%Y-%m-%d').date(),
+    'endDate': lambda v: datetime.strptime(v[:10], '%Y-%m-%d').date(),
+    'date': lambda v: datetime.strptime(v[:10], '%Y-%m-%d').date(),
+    'starttime': lambda v: datetime.strptime(v, '%H:%M').time(),
+}
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _matches(entity, filtr):
+    """Evaluate one formatted filter against an entity, datastore style."""
+    value = getattr(entity, filtr['field'])
+    op = filtr['operator']
+    # a repeated property matches if any of its values does
+    if isinstance(value, list):
+        return any(repository.compare(op, v, filtr['value']) for v in value)
+    return repository.compare(op, value, filtr['value'])
+
+
+def _describeFilter(filtr):
+    return '%s %s %r' % (filtr['field'], filtr['operator'], filtr['value'])
+
+
+class QueryPlan(object):
+    """A query split into datastore and in-memory filters."""
+
+    def __init__(self, datastore_filters, memory_filters, inequality_field,
+                 model=Conference, ancestor=None):
+        self.model = model
+        self.ancestor = ancestor
+        self.datastore_filters = datastore_filters
+        self.memory_filters = memory_filters
+        self.inequality_field = inequality_field
+        self.stats = {}
+
+    @property
+    def strategy(self):
+        """Name of the index strategy the datastore part uses."""
+        if not self.datastore_filters:
+            return 'scan'
+        if self.datastore_filters[0]['operator'] != '=':
+            return 'single-property-range'
+        if len(self.datastore_filters) > 1:
+            return 'zigzag-merge'
+        return 'single-property-equality'
+
+    def describe(self):
+        """Human readable summary of the plan."""
+        return '%s %s datastore=[%s] memory=[%s] order=[%s]' % (
+            self.model._get_kind(), self.strategy,
+            ', '.join(_describeFilter(f) for f in self.datastore_filters),
+            ', '.join(_describeFilter(f) for f in self.memory_filters),
+            ', '.join(self._orderFields()))
+
+    def _orderFields(self):
+        if self.inequality_field:
+            return [self.inequality_field, 'name']
+        return ['name']
+
+    def matches(self, entity):
+        """True if entity passes the in-memory part of the plan."""
+        for filtr in self.memory_filters:
+            if not _matches(entity, filtr):
+                return False
+        return True
+
+    def fetch(self):
+        """Run the plan and return the ordered list of entities."""
+        start = time.time()
+        fetched = repository.query(
+            self.model, self.ancestor,
+            [(f['field'], f['operator'], f['value']) for f in self.datastore_filters])
+        results = [e for e in fetched if self.matches(e)]
+        fields = self._orderFields()
+        results.sort(key=lambda e: [repository.sortKey(getattr(e, f)) for f in fields])
+
+        self.stats = {
+            'plan': self.describe(),
+            'fetched': len(fetched),
+            'returned': len(results),
+            'ms': int((time.time() - start) * 1000),
+        }
+        logging.info('query plan: %(plan)s fetched=%(fetched)d '
+                     'returned=%(returned)d ms=%(ms)d', self.stats)
+        return results
+
+
+def convertFilters(filters):
+    """Convert string filter values in place to their property types."""
+    for filtr in filters:
+        if filtr['field'] in CONVERTERS and isinstance(filtr['value'], basestring):
+            try:
+                filtr['value'] = CONVERTERS[filtr['field']](filtr['value'])
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Invalid value for %s: %s" % (filtr['field'], filtr['value']))
+    return filters
+
+
+def plan(filters, inequality_field=None, model=Conference, ancestor=None,
+         include_archived=False):
+    """Build a QueryPlan from filters formatted by _formatFilters.
+
+    Queries across conferences skip archived entities unless
+    include_archived is set.
+    """
+    convertFilters(filters)
+
+    equalities = [f for f in filters if f['operator'] == '=']
+    ranges = [f for f in filters if f['operator'] not in ('=', '!=')]
+    others = [f for f in filters if f['operator'] == '!=']
+
+    if ancestor is None and not include_archived:
+        live = {'field': 'archived', 'operator': '=', 'value': False}
+        # joins the other equalities; next to a range it would need a
+        # composite index, so it is checked in memory instead
+        if ranges and not equalities:
+            others.append(live)
+        else:
+            equalities.append(live)
+
+    if equalities:
+        # equalities merge-join on built-in indexes; ranges would need
+        # a composite index so they are checked in memory
+        datastore_filters = equalities
+        memory_filters = ranges + others
+    elif ranges:
+        # a range scan covers one property; ranges on any other
+        # property are checked in memory
+        field = inequality_field or ranges[0]['field']
+        datastore_filters = [f for f in ranges if f['field'] == field]
+        memory_filters = [f for f in ranges if f['field'] != field] + others
+    else:
+        datastore_filters = []
+        memory_filters = others
+
+    return QueryPlan(datastore_filters, memory_filters, inequality_field,
+                     model, ancestor)
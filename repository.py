@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+"""
+repository.py -- storage access for the Conference and Session APIs
+
+The endpoints read and write Conference, Profile, Session and Speaker
+entities (and their rollups and schedules) through the module functions
+below instead of calling ndb themselves. They delegate to a backend:
+
+  - NdbRepository, the datastore, used in production;
+  - MemoryRepository, a thread-safe in-memory store that follows the
+    datastore's rules, so endpoint logic can be benchmarked and
+    profiled at scale without the datastore stub's serialization cost.
+
+Entities are ndb models either way. Filters are (property, operator,
+value) tuples with the property's own Python value types. page() returns
+one page and an opaque cursor for the next; a cursor that can't be
+decoded raises ValueError.
+
+"""
+
+import copy
+import itertools
+import operator
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+QUERY_BATCH_SIZE = 500
+TRANSACTION_RETRIES = 3
+XG_MAX_GROUPS = 25
+
+COMPARATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class NdbRepository(object):
+    """Datastore backend."""
+
+    def get(self, key):
+        return key.get()
+
+    def getMulti(self, keys):
+        return ndb.get_multi(keys)
+
+    def getMultiAsync(self, keys):
+        return ndb.get_multi_async(keys)
+
+    def put(self, entity):
+        return entity.put()
+
+    def putMulti(self, entities):
+        return ndb.put_multi(entities)
+
+    def deleteMulti(self, keys):
+        ndb.delete_multi(keys)
+
+    def _query(self, model, ancestor, filters):
+        q = model.query(ancestor=ancestor)
+        for name, op, value in filters:
+            # the property converts the value to its datastore type
+            q = q.filter(model._properties[name]._comparison(op, value))
+        return q
+
+    def query(self, model, ancestor=None, filters=(), limit=None, projection=None):
+        q = self._query(model, ancestor, filters)
+        if projection:
+            return q.fetch(limit, projection=projection, batch_size=QUERY_BATCH_SIZE)
+        return q.fetch(limit, batch_size=QUERY_BATCH_SIZE)
+
+    def page(self, model, ancestor=None, filters=(), order=(), limit=None, cursor=None):
+        q = self._query(model, ancestor, filters)
+        for name in order:
+            q = q.order(model._properties[name])
+        try:
+            start = Cursor(urlsafe=cursor) if cursor else None
+        except datastore_errors.BadValueError:
+            raise ValueError('Invalid cursor %r' % cursor)
+        results, next_cursor, more = q.fetch_page(limit, start_cursor=start)
+        return results, next_cursor.urlsafe() if more and next_cursor else None
+
+    def allocateId(self, model, parent=None):
+        return model.allocate_ids(size=1, parent=parent)[0]
+
+    def transaction(self, fn, xg=False):
+        if ndb.in_transaction():
+            return fn()
+        return ndb.transaction(fn, xg=xg, retries=TRANSACTION_RETRIES)
+
+
+def _group(key):
+    """Root key of a key's entity group."""
+    return ndb.Key(pairs=key.pairs()[:1])
+
+
+def compare(op, actual, value):
+    """Apply a filter operator datastore style.
+
+    None only satisfies '=' and '!='; the datastore's range scans never
+    return it, and dates can't be compared with None in python.
+    """
+    if (actual is None or value is None) and op not in ('=', '!='):
+        return False
+    return COMPARATORS[op](actual, value)
+
+
+def sortKey(value):
+    """Sort key that orders None first, as the datastore orders null."""
+    return (value is not None, value)
+
+
+def _matches(entity, name, op, value):
+    """Evaluate one filter against an entity, datastore style."""
+    actual = getattr(entity, name, None)
+    # a repeated property matches if any of its values does
+    if isinstance(actual, list):
+        return any(compare(op, v, value) for v in actual)
+    return compare(op, actual, value)
+
+
+def _copy(entity):
+    """Detached copy, so callers never share state with the store."""
+    values = {}
+    for name, value in entity.to_dict().iteritems():
+        values[name] = copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+    clone = type(entity)(key=entity.key)
+    clone.populate(**values)
+    return clone
+
+
+class _Transaction(object):
+    def __init__(self, xg):
+        self.xg = xg
+        self.groups = {}                # entity group -> version read
+        self.writes = OrderedDict()     # key -> entity, or None to delete
+
+
+class MemoryRepository(object):
+    """Thread-safe in-memory backend with the datastore's consistency rules.
+
+    Gets and ancestor queries see every committed write. Non-ancestor
+    queries may lag by global_query_lag seconds, like the datastore's
+    eventually consistent indexes. Transactions are optimistic: reads see
+    committed data (not the transaction's own writes), writes are
+    buffered, and the commit fails if an entity group the transaction
+    touched has changed since, after which it is retried. A transaction
+    may touch one entity group, or XG_MAX_GROUPS when cross-group, and
+    may only run ancestor queries.
+    """
+
+    def __init__(self, global_query_lag=0.0):
+        self.lag = global_query_lag
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._store = {}        # key -> (entity, committed at, previous entity)
+        self._kinds = {}        # kind -> set of keys
+        self._versions = {}     # entity group -> commit count
+
+    def _txn(self):
+        return getattr(self._local, 'txn', None)
+
+    def _enlist(self, txn, key):
+        group = _group(key)
+        if group in txn.groups:
+            return
+        if len(txn.groups) >= (XG_MAX_GROUPS if txn.xg else 1):
+            raise datastore_errors.BadRequestError(
+                'Too many entity groups in a %stransaction' % ('cross-group ' if txn.xg else ''))
+        txn.groups[group] = self._versions.get(group, 0)
+
+    def _complete(self, entity):
+        key = entity.key
+        if key is None or key.id() is None:
+            with self._lock:
+                new_id = next(self._ids)
+            entity.key = ndb.Key(entity._get_kind(), new_id,
+                                 parent=key.parent() if key else None)
+        return entity.key
+
+    def _commit(self, writes):
+        """Apply writes; the caller holds the lock."""
+        now = time.time()
+        for key, entity in writes.iteritems():
+            previous = self._store.get(key, (None,))[0]
+            self._store[key] = (entity, now, previous)
+            self._kinds.setdefault(key.kind(), set()).add(key)
+            group = _group(key)
+            self._versions[group] = self._versions.get(group, 0) + 1
+
+    def get(self, key):
+        return self.getMulti([key])[0]
+
+    def getMulti(self, keys):
+        with self._lock:
+            txn = self._txn()
+            results = []
+            for key in keys:
+                if txn:
+                    self._enlist(txn, key)
+                entity = self._store.get(key, (None,))[0]
+                results.append(_copy(entity) if entity else None)
+            return results
+
+    def getMultiAsync(self, keys):
+        futures = []
+        for entity in self.getMulti(keys):
+            future = ndb.Future()
+            future.set_result(entity)
+            futures.append(future)
+        return futures
+
+    def put(self, entity):
+        return self.putMulti([entity])[0]
+
+    def putMulti(self, entities):
+        keys = []
+        writes = OrderedDict()
+        for entity in entities:
+            entity._prepare_for_put()
+            key = self._complete(entity)
+            writes[key] = _copy(entity)
+            keys.append(key)
+        with self._lock:
+            txn = self._txn()
+            if txn:
+                for key in writes:
+                    self._enlist(txn, key)
+                txn.writes.update(writes)
+            else:
+                self._commit(writes)
+        return keys
+
+    def deleteMulti(self, keys):
+        writes = OrderedDict((key, None) for key in keys)
+        with self._lock:
+            txn = self._txn()
+            if txn:
+                for key in writes:
+                    self._enlist(txn, key)
+                txn.writes.update(writes)
+            else:
+                self._commit(writes)
+
+    def query(self, model, ancestor=None, filters=(), limit=None, projection=None):
+        """Matching entities in key order; projection is ignored and
+        whole entities are returned."""
+        txn = self._txn()
+        if txn and ancestor is None:
+            raise datastore_errors.BadRequestError(
+                'Only ancestor queries are allowed inside transactions')
+        with self._lock:
+            if txn:
+                self._enlist(txn, ancestor)
+            cutoff = time.time() - self.lag
+            results = []
+            for key in self._kinds.get(model._get_kind(), ()):
+                entity, committed, previous = self._store[key]
+                if ancestor is not None:
+                    if key.pairs()[:len(ancestor.pairs())] != ancestor.pairs():
+                        continue
+                elif committed > cutoff:
+                    # not in the global indexes yet
+                    entity = previous
+                if entity is None:
+                    continue
+                if all(_matches(entity, name, op, value) for name, op, value in filters):
+                    results.append(entity)
+            results.sort(key=lambda e: e.key.pairs())
+            return [_copy(e) for e in results[:limit]]
+
+    def page(self, model, ancestor=None, filters=(), order=(), limit=None, cursor=None):
+        """Matching entities sorted on order, then key; cursors are offsets."""
+        results = self.query(model, ancestor, filters)
+        # stable: ties keep key order
+        results.sort(key=lambda e: [sortKey(getattr(e, name)) for name in order])
+        try:
+            start = int(cursor) if cursor else 0
+        except ValueError:
+            raise ValueError('Invalid cursor %r' % cursor)
+        end = start + limit if limit else len(results)
+        return results[start:end], str(end) if end < len(results) else None
+
+    def allocateId(self, model, parent=None):
+        with self._lock:
+            return next(self._ids)
+
+    def transaction(self, fn, xg=False):
+        if self._txn():
+            return fn()
+        for _ in range(TRANSACTION_RETRIES + 1):
+            txn = self._local.txn = _Transaction(xg)
+            try:
+                result = fn()
+            finally:
+                self._local.txn = None
+            with self._lock:
+                if all(self._versions.get(group, 0) == version
+                       for group, version in txn.groups.iteritems()):
+                    self._commit(txn.writes)
+                    return result
+        raise datastore_errors.TransactionFailedError(
+            'The transaction could not be committed. Please try again.')
+
+
+_backend = NdbRepository()
+
+
+def use(backend):
+    """Switch every caller to backend; returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+def get(key):
+    return _backend.get(key)
+
+
+def getMulti(keys):
+    return _backend.getMulti(keys)
+
+
+def getMultiAsync(keys):
+    """Start a batch get; returns one future per key, for ndb tasklets."""
+    return _backend.getMultiAsync(keys)
+
+
+def put(entity):
+    return _backend.put(entity)
+
+
+def putMulti(entities):
+    return _backend.putMulti(entities)
+
+
+def deleteMulti(keys):
+    return _backend.deleteMulti(keys)
+
+
+def query(model, ancestor=None, filters=(), limit=None, projection=None):
+    return _backend.query(model, ancestor, filters, limit, projection)
+
+
+def page(model, ancestor=None, filters=(), order=(), limit=None, cursor=None):
+    """(entities, cursor of the next page or None) for one page of a query."""
+    return _backend.page(model, ancestor, filters, order, limit, cursor)
+
+
+def first(model, ancestor=None, filters=()):
+    """The first matching entity, or None."""
+    results = _backend.query(model, ancestor, filters, 1)
+    return results[0] if results else None
+
+
+def allocateId(model, parent=None):
+    return _backend.allocateId(model, parent)
+
+
+def transaction(fn, xg=False):
+    """Run fn in a transaction, joining the current one if there is one."""
+    return _backend.transaction(fn, xg)
+
+
+def transactional(xg=False):
+    """Decorator form of transaction()."""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            return _backend.transaction(lambda: fn(*args, **kwargs), xg)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+rollups.py -- incrementally maintained attendance and capacity rollups
+
+Conferences, seats (maxAttendees) and seats sold (maxAttendees -
+seatsAvailable) by city, month and topic, and sessions by type, are kept
+as counters spread over ROLLUP_SHARDS RollupShard entities. A write that
+changes them doesn't touch a shard: it adds its deltas as a
+transactional task on the ROLLUP_QUEUE pull queue, which only exists if
+the write commits. Registrations therefore share no entity group with
+each other, and their rate isn't capped by the shards' commit rate.
+Every minute applyPending() leases the queued deltas in batches, merges
+each batch and adds it to one shard in a single transaction. The global
+counters lag the writes by up to a minute.
+
+Sessions per type of a single conference live in a ConferenceRollup
+child of the conference and are updated in the session's transaction.
+
+reconcile() recomputes everything from the datastore to correct drift,
+including deltas applied twice because their tasks outlived a commit.
+
+"""
+
+import json
+import logging
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceRollup
+from models import RollupShard
+from models import Session
+import repository
+
+ROLLUP_SHARDS = 20
+ROLLUP_ID = 'rollup'
+MEMCACHE_ROLLUPS_KEY = 'ROLLUPS'
+ROLLUPS_CACHE_SECONDS = 30
+ROLLUP_QUEUE = 'rollup-deltas'      # pull queue, see queue.yaml
+LEASE_SECONDS = 60
+LEASE_BATCH = 1000                  # tasks per lease_tasks call
+MAX_BATCHES = 20                    # lease rounds per applyPending run
+
+CONFERENCE_DIMENSIONS = ('city', 'month', 'topic')
+CONFERENCE_METRICS = ('conferences', 'capacity', 'seatsSold')
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _shardKeys():
+    return [ndb.Key(RollupShard, 'shard-%02d' % i) for i in range(ROLLUP_SHARDS)]
+
+
+def conferenceRollupKey(c_key):
+    return ndb.Key(ConferenceRollup, ROLLUP_ID, parent=c_key)
+
+
+def _dimensionValues(conf):
+    """(dimension, value) pairs a conference is counted under."""
+    pairs = [('city', conf.city or ''), ('month', str(conf.month or 0))]
+    pairs.extend(('topic', topic) for topic in set(conf.topics or []))
+    return pairs
+
+
+def _add(counts, dimension, value, metric, delta):
+    metrics = counts.setdefault(dimension, {}).setdefault(value, {})
+    metrics[metric] = metrics.get(metric, 0) + delta
+
+
+def conferenceDeltas(conf, sign=1, counts=None):
+    """Counter deltas for adding (sign=1) or removing (sign=-1) a conference."""
+    counts = {} if counts is None else counts
+    capacity = conf.maxAttendees or 0
+    sold = capacity - (conf.seatsAvailable or 0)
+    for dimension, value in _dimensionValues(conf):
+        _add(counts, dimension, value, 'conferences', sign)
+        _add(counts, dimension, value, 'capacity', sign * capacity)
+        _add(counts, dimension, value, 'seatsSold', sign * sold)
+    return counts
+
+
+def seatDeltas(conf, sold):
+    """Counter deltas for sold more seats (negative to give them back)."""
+    counts = {}
+    for dimension, value in _dimensionValues(conf):
+        _add(counts, dimension, value, 'seatsSold', sold)
+    return counts
+
+
+def sessionTypeDeltas(by_type, sign=1, counts=None):
+    """Counter deltas for adding or removing sessions counted {type: n}."""
+    counts = {} if counts is None else counts
+    for type_, n in by_type.iteritems():
+        _add(counts, 'type', type_, 'sessions', sign * n)
+    return counts
+
+
+def _merge(into, counts):
+    for dimension, values in counts.iteritems():
+        for value, metrics in values.iteritems():
+            for metric, delta in metrics.iteritems():
+                _add(into, dimension, value, metric, delta)
+    return into
+
+
+def increment(counts):
+    """Queue counter deltas for applyPending.
+
+    Inside a transaction the task is transactional, so the deltas are
+    only counted if the caller's write commits.
+    """
+    taskqueue.Queue(ROLLUP_QUEUE).add(
+        taskqueue.Task(payload=json.dumps(counts), method='PULL'),
+        transactional=ndb.in_transaction())
+
+
+def _applyBatch(tasks):
+    """Add one batch of queued deltas to a random shard in one commit."""
+    counts = {}
+    for task in tasks:
+        try:
+            _merge(counts, json.loads(task.payload))
+        except (ValueError, AttributeError):
+            logging.error('dropping malformed rollup deltas: %r', task.payload)
+    key = random.choice(_shardKeys())
+
+    @repository.transactional()
+    def apply():
+        shard = repository.get(key) or RollupShard(key=key, counts={})
+        _merge(shard.counts, counts)
+        repository.put(shard)
+    apply()
+
+
+def applyPending():
+    """Apply queued deltas to the shards; run by a cron every minute.
+
+    A batch whose transaction fails keeps its leases and is retried when
+    they expire. Returns the number of deltas applied.
+    """
+    queue = taskqueue.Queue(ROLLUP_QUEUE)
+    applied = 0
+    for _ in range(MAX_BATCHES):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+        _applyBatch(tasks)
+        queue.delete_tasks(tasks)
+        applied += len(tasks)
+        if len(tasks) < LEASE_BATCH:
+            break
+    return applied
+
+
+@repository.transactional(xg=True)
+def addSession(session):
+    """Count a new session globally and in its conference's rollup."""
+    key = conferenceRollupKey(session.key.parent())
+    rollup = repository.get(key) or ConferenceRollup(key=key, sessionsByType={})
+    type_ = session.typeofsession or 'NOT_SPECIFIED'
+    rollup.sessionsByType[type_] = rollup.sessionsByType.get(type_, 0) + 1
+    repository.put(rollup)
+    counts = {}
+    _add(counts, 'type', type_, 'sessions', 1)
+    increment(counts)
+
+
+def totals():
+    """All global counters, summed over the shards; a minute or so behind."""
+    counts = memcache.get(MEMCACHE_ROLLUPS_KEY)
+    if counts is None:
+        counts = {}
+        for shard in repository.getMulti(_shardKeys()):
+            if shard:
+                _merge(counts, shard.counts)
+        # short expiry instead of invalidation: counters move on every
+        # registration and a few seconds of lag is fine for reports
+        memcache.set(MEMCACHE_ROLLUPS_KEY, counts, time=ROLLUPS_CACHE_SECONDS)
+    return counts
+
+
+def sessionsByType(c_key):
+    """Session counts per type for one conference."""
+    rollup = repository.get(conferenceRollupKey(c_key))
+    return rollup.sessionsByType if rollup else {}
+
+
+def reconcile():
+    """Recompute every rollup from scratch and overwrite the counters.
+
+    Writes that land while the scan runs can be counted twice or not at
+    all; the next reconcile corrects them.
+    """
+    counts = {}
+    for conf in Conference.query().iter(batch_size=500):
+        conferenceDeltas(conf, counts=counts)
+
+    by_conference = {}
+    for session in Session.query().iter(projection=[Session.typeofsession], batch_size=500):
+        type_ = session.typeofsession or 'NOT_SPECIFIED'
+        _add(counts, 'type', type_, 'sessions', 1)
+        types = by_conference.setdefault(session.key.parent(), {})
+        types[type_] = types.get(type_, 0) + 1
+
+    keys = _shardKeys()
+    shards = [RollupShard(key=keys[0], counts=counts)]
+    shards.extend(RollupShard(key=key, counts={}) for key in keys[1:])
+    ndb.transaction(lambda: ndb.put_multi(shards), xg=True)
+
+    stale = []
+    rollups = ndb.get_multi([conferenceRollupKey(c_key) for c_key in by_conference])
+    for c_key, rollup in zip(by_conference, rollups):
+        if not rollup or rollup.sessionsByType != by_conference[c_key]:
+            stale.append(ConferenceRollup(key=conferenceRollupKey(c_key),
+                                          sessionsByType=by_conference[c_key]))
+    ndb.put_multi(stale)
+    memcache.delete(MEMCACHE_ROLLUPS_KEY)
+    return len(stale)
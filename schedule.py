@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- materialized session schedule per conference
+
+Every conference has one ConferenceSchedule child entity holding its
+sessions as sorted (date, starttime, duration, type, speakerName,
+websafeKey, name) tuples. createSession inserts into it in the same
+transaction that writes the Session (they share the conference's entity
+group), so reading a whole agenda is one memcache or datastore get
+instead of an ancestor query plus a speaker lookup per session.
+
+The memcache copy carries the entity's version, which every write bumps.
+Readers only add() it, so they never replace a copy; after its commit a
+writer publishes its schedule with gets/cas unless a newer version is
+already cached, which also replaces a stale copy that a reader added
+while the write was in flight. Schedules dropped outside createSession
+(migrations, conference delete) are deleted from memcache, and any copy
+a concurrent reader puts back expires after SCHEDULE_CACHE_SECONDS.
+
+"""
+
+import bisect
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import ConferenceSchedule
+from models import Session
+import repository
+import rollups
+import speakers
+
+SCHEDULE_ID = 'schedule'
+# holds {'entries': tuples, 'updated': datetime}; the key changed from
+# SCHEDULE: when the timestamp was added
+MEMCACHE_SCHEDULE_KEY = 'SCHEDULE2:%s'
+SCHEDULE_CACHE_SECONDS = 10 * 60
+CAS_RETRIES = 3
+
+# positions in a schedule tuple
+DATE, STARTTIME, DURATION, TYPE, SPEAKER, KEY, NAME = range(7)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def scheduleKey(c_key):
+    """Key of the schedule entity of a conference."""
+    return ndb.Key(ConferenceSchedule, SCHEDULE_ID, parent=c_key)
+
+
+def entryFor(session, speakerName):
+    """Schedule tuple for a session; dates/times as sortable strings."""
+    return [session.date.isoformat() if session.date else None,
+            session.starttime.strftime('%H:%M') if session.starttime else None,
+            session.duration,
+            session.typeofsession,
+            speakerName,
+            session.key.urlsafe(),
+            session.name]
+
+
+def _build(c_key):
+    """Schedule tuples for every session of a conference."""
+    sessions = repository.query(Session, ancestor=c_key)
+    names = dict((speaker.key, speaker.name) for speaker in
+                 repository.getMulti(list(set(s.speaker for s in sessions if s.speaker)))
+                 if speaker)
+    return sorted(entryFor(s, names.get(s.speaker)) for s in sessions)
+
+
+def ensureSchedule(c_key):
+    """Create the schedule of a conference that predates schedules.
+
+    Speaker names live in other entity groups, so the tuples are built
+    outside the transaction; the transaction only stores them if nobody
+    else did first. Sessions added afterwards go in through addSession.
+    """
+    key = scheduleKey(c_key)
+    if repository.get(key) is not None:
+        return
+    # don't recreate part of a deleted conference's entity group
+    if repository.get(c_key) is None:
+        return
+
+    entries = _build(c_key)
+
+    @repository.transactional()
+    def store():
+        if repository.get(key) is None:
+            repository.put(ConferenceSchedule(key=key, entries=entries))
+    store()
+
+
+def addSession(session, speakerName):
+    """Put a new session, its schedule tuple, its speaker's index entry and
+    its rollup counts in one transaction.
+
+    session must be a child of its conference; returns the session key.
+    """
+    c_key = session.key.parent()
+    ensureSchedule(c_key)
+    key = scheduleKey(c_key)
+
+    @repository.transactional(xg=True)
+    def txn():
+        schedule = repository.get(key) or ConferenceSchedule(key=key, entries=[])
+        s_key = repository.put(session)
+        bisect.insort(schedule.entries, entryFor(session, speakerName))
+        schedule.version += 1
+        repository.put(schedule)
+        speakers.addSession(session, speakerName)
+        rollups.addSession(session)
+        return s_key, schedule
+
+    s_key, schedule = txn()
+    _publish(c_key, schedule)
+    return s_key
+
+
+def _cacheValue(schedule):
+    return {'entries': schedule.entries, 'updated': schedule.updated,
+            'version': schedule.version}
+
+
+def _publish(c_key, schedule):
+    """Cache a just-committed schedule unless a newer version is cached."""
+    mc_key = MEMCACHE_SCHEDULE_KEY % c_key.urlsafe()
+    value = _cacheValue(schedule)
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        cached = client.gets(mc_key)
+        if cached is None:
+            if client.add(mc_key, value, time=SCHEDULE_CACHE_SECONDS):
+                return
+        elif cached.get('version', -1) >= schedule.version:
+            return
+        elif client.cas(mc_key, value, time=SCHEDULE_CACHE_SECONDS):
+            return
+    # lost every race: let the next read load it
+    memcache.delete(mc_key)
+
+
+def dropSchedules(c_keys):
+    """Forget the schedules of conferences whose sessions were rewritten
+    outside createSession; they are rebuilt on the next read."""
+    c_keys = list(c_keys)
+    repository.deleteMulti([scheduleKey(c_key) for c_key in c_keys])
+    memcache.delete_multi([MEMCACHE_SCHEDULE_KEY % c_key.urlsafe() for c_key in c_keys])
+
+
+def _cached(c_key):
+    mc_key = MEMCACHE_SCHEDULE_KEY % c_key.urlsafe()
+    cached = memcache.get(mc_key)
+    if cached is None:
+        schedule = repository.get(scheduleKey(c_key))
+        if schedule is None:
+            ensureSchedule(c_key)
+            schedule = repository.get(scheduleKey(c_key))
+        if schedule is None:
+            # the conference is gone
+            return {'entries': [], 'updated': None}
+        cached = _cacheValue(schedule)
+        # add, not set: never replace what a writer published
+        memcache.add(mc_key, cached, time=SCHEDULE_CACHE_SECONDS)
+    return cached
+
+
+def getSchedule(c_key):
+    """All schedule tuples of a conference, from memcache if possible."""
+    return _cached(c_key)['entries']
+
+
+def lastModified(c_key):
+    """When the schedule of a conference last changed."""
+    return _cached(c_key)['updated']
+
+
+def window(entries, date=None, start=None, end=None):
+    """Entries on date (YYYY-MM-DD) starting in [start, end) (HH:MM)."""
+    if date is not None:
+        # tuples are sorted by date first
+        lo = bisect.bisect_left(entries, [date])
+        hi = bisect.bisect_left(entries, [date + '\x00'])
+        entries = entries[lo:hi]
+    return [e for e in entries
+            if (start is None or (e[STARTTIME] is not None and e[STARTTIME] >= start))
+            and (end is None or (e[STARTTIME] is not None and e[STARTTIME] < end))]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""
+search_index.py -- Search API mirror of Conference and Session entities
+
+The datastore only allows an inequality on one property per query. The
+Search API has no such limit, so conferences and sessions are mirrored into
+search documents (doc_id is the entity's websafe key) whenever they are
+created or updated, and searchConferences/searchSessions answer multi-field
+range, full-text and faceted queries from there. Results are loaded back
+from the datastore with a single get_multi.
+
+"""
+
+import logging
+from datetime import datetime
+
+import endpoints
+from google.appengine.api import search
+from google.appengine.ext import ndb
+
+from repository import sortKey
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+DATASTORE_CURSOR_PREFIX = 'offset:'
+
+OPERATORS = {
+            'EQ':   '=',
+            'GT':   '>',
+            'GTEQ': '>=',
+            'LT':   '<',
+            'LTEQ': '<=',
+            'NE':   '!='
+            }
+
+# request field -> (document field, value type)
+CONFERENCE_FIELDS = {
+            'CITY': ('city', 'atom'),
+            'TOPIC': ('topics', 'atom'),
+            'MONTH': ('month', 'number'),
+            'MAX_ATTENDEES': ('maxAttendees', 'number'),
+            'START_DATE': ('startDate', 'date'),
+            'END_DATE': ('endDate', 'date'),
+            }
+
+SESSION_FIELDS = {
+            'TYPE': ('typeofsession', 'atom'),
+            'SPEAKER': ('speaker', 'atom'),
+            'CONFERENCE': ('conference', 'atom'),
+            'DATE': ('date', 'date'),
+            'START_TIME': ('starttime', 'time'),
+            'DURATION': ('duration', 'number'),
+            }
+
+CONFERENCE_SORTS = {
+            'NAME': ('name', ''),
+            'START_DATE': ('startDate', datetime(1970, 1, 1)),
+            'MAX_ATTENDEES': ('maxAttendees', 0),
+            'MONTH': ('month', 0),
+            }
+
+SESSION_SORTS = {
+            'NAME': ('name', ''),
+            'DATE': ('date', datetime(1970, 1, 1)),
+            'START_TIME': ('starttime', 0),
+            'DURATION': ('duration', 0),
+            }
+
+NUMBER_FACETS = ('month',)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _minutes(t):
+    """Minutes since midnight for a time, so it can live in a NumberField."""
+    return t.hour * 60 + t.minute
+
+
+def _put(index_name, doc):
+    """Write doc, logging rather than failing the datastore write."""
+    try:
+        search.Index(name=index_name).put(doc)
+    except search.Error:
+        logging.exception('could not index %s in %s', doc.doc_id, index_name)
+
+
+def unindex(index_name, keys):
+    """Remove the documents of deleted entities, logging failures."""
+    doc_ids = [key.urlsafe() for key in keys]
+    try:
+        search.Index(name=index_name).delete(doc_ids)
+    except search.Error:
+        logging.exception('could not remove %d documents from %s', len(doc_ids), index_name)
+
+
+def indexConference(conf):
+    """Mirror a Conference entity into the conferences index."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description or ''),
+        search.AtomField(name='city', value=conf.city or ''),
+        search.NumberField(name='month', value=conf.month or 0),
+        search.NumberField(name='maxAttendees', value=conf.maxAttendees or 0),
+    ]
+    facets = [
+        search.AtomFacet(name='city', value=conf.city or ''),
+        search.NumberFacet(name='month', value=conf.month or 0),
+    ]
+    for topic in conf.topics:
+        fields.append(search.AtomField(name='topics', value=topic))
+        facets.append(search.AtomFacet(name='topics', value=topic))
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    if conf.endDate:
+        fields.append(search.DateField(name='endDate', value=conf.endDate))
+    _put(CONFERENCE_INDEX, search.Document(
+        doc_id=conf.key.urlsafe(), fields=fields, facets=facets))
+
+
+def indexSession(session, speakerName):
+    """Mirror a Session entity into the sessions index."""
+    fields = [
+        search.TextField(name='name', value=session.name),
+        search.TextField(name='highlights', value=session.highlights or ''),
+        search.AtomField(name='speaker', value=speakerName or ''),
+        search.AtomField(name='conference',
+                         value=session.key.parent().urlsafe()),
+        search.AtomField(name='typeofsession', value=session.typeofsession),
+        search.NumberField(name='duration', value=session.duration or 0),
+    ]
+    facets = [
+        search.AtomFacet(name='speaker', value=speakerName or ''),
+        search.AtomFacet(name='typeofsession', value=session.typeofsession),
+    ]
+    if session.date:
+        fields.append(search.DateField(name='date', value=session.date))
+    if session.starttime:
+        fields.append(search.NumberField(name='starttime',
+                                         value=_minutes(session.starttime)))
+    _put(SESSION_INDEX, search.Document(
+        doc_id=session.key.urlsafe(), fields=fields, facets=facets))
+
+
+def _formatValue(kind, value):
+    """Render a filter value in search query syntax."""
+    try:
+        if kind == 'number':
+            return str(int(value))
+        if kind == 'date':
+            return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+        if kind == 'time':
+            return str(_minutes(datetime.strptime(value, '%H:%M').time()))
+    except (TypeError, ValueError):
+        raise endpoints.BadRequestException(
+            "Invalid %s value: %s" % (kind, value))
+    return '"%s"' % (value or '').replace('"', '\\"')
+
+
+def _queryString(text, filters, fields):
+    """Build a search query string from free text and structured filters."""
+    parts = []
+    if text:
+        parts.append('(%s)' % text)
+    for f in filters:
+        try:
+            name, kind = fields[f.field]
+            op = OPERATORS[f.operator]
+        except KeyError:
+            raise endpoints.BadRequestException(
+                "Filter contains invalid field or operator.")
+        value = _formatValue(kind, f.value)
+        if op == '!=':
+            parts.append('NOT %s:%s' % (name, value))
+        elif op == '=':
+            parts.append('%s:%s' % (name, value))
+        else:
+            parts.append('%s %s %s' % (name, op, value))
+    return ' AND '.join(parts)
+
+
+def _refinements(request):
+    """Parse 'name:value' facet refinements from the request."""
+    refinements = []
+    for refinement in request.facetRefinements:
+        name, sep, value = refinement.partition(':')
+        if not sep:
+            raise endpoints.BadRequestException(
+                "Facet refinement must look like name:value")
+        if name in NUMBER_FACETS:
+            try:
+                value = int(value)
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Facet %s takes a number" % name)
+        refinements.append(search.FacetRefinement(name, value=value))
+    return refinements
+
+
+def _search(index_name, request, fields, sorts):
+    """Run request against index_name.
+
+    Returns (entity keys, [(facet, [(value, count)])], websafe cursor).
+    Raises search.Error if the Search API is unavailable.
+    """
+    limit = min(request.limit or SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    try:
+        expression, default = sorts[request.sortBy or 'NAME']
+    except KeyError:
+        raise endpoints.BadRequestException("Invalid sort field.")
+    direction = search.SortExpression.DESCENDING if request.descending \
+        else search.SortExpression.ASCENDING
+
+    options = search.QueryOptions(
+        limit=limit,
+        cursor=search.Cursor(web_safe_string=request.cursor)
+            if request.cursor else search.Cursor(),
+        sort_options=search.SortOptions(expressions=[search.SortExpression(
+            expression=expression, direction=direction,
+            default_value=default)]),
+        ids_only=True)
+    query = search.Query(
+        query_string=_queryString(request.text, request.filters, fields),
+        options=options,
+        enable_facet_discovery=True,
+        facet_refinements=_refinements(request))
+    results = search.Index(name=index_name).search(query)
+
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    facets = [(facet.name, [(v.label, v.count) for v in facet.values])
+              for facet in results.facets]
+    cursor = results.cursor.web_safe_string if results.cursor else None
+    return keys, facets, cursor
+
+
+def isDatastoreCursor(cursor):
+    """True if cursor was handed out by the datastore fallback."""
+    return bool(cursor) and cursor.startswith(DATASTORE_CURSOR_PREFIX)
+
+
+def datastorePage(entities, request, text_fields, sorts):
+    """Text match, sort and page entities in memory.
+
+    This is the fallback when the Search API is unavailable; cursors are
+    plain offsets. Returns (page of entities, websafe cursor).
+    """
+    if request.text:
+        words = request.text.lower().split()
+        entities = [e for e in entities if all(
+            any(w in (getattr(e, f) or '').lower() for f in text_fields)
+            for w in words)]
+    try:
+        expression, default = sorts[request.sortBy or 'NAME']
+    except KeyError:
+        raise endpoints.BadRequestException("Invalid sort field.")
+    # conferences and sessions may have no date or start time
+    entities.sort(key=lambda e: sortKey(getattr(e, expression)),
+                  reverse=bool(request.descending))
+
+    offset = 0
+    if request.cursor:
+        try:
+            offset = int(request.cursor[len(DATASTORE_CURSOR_PREFIX):])
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid cursor.")
+    end = offset + min(request.limit or SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    cursor = DATASTORE_CURSOR_PREFIX + str(end) if end < len(entities) else None
+    return entities[offset:end], cursor
+
+
+def searchConferences(request):
+    """Search the conferences index with a SearchQueryForm."""
+    return _search(CONFERENCE_INDEX, request, CONFERENCE_FIELDS,
+                   CONFERENCE_SORTS)
+
+
+def searchSessions(request):
+    """Search the sessions index with a SearchQueryForm."""
+    return _search(SESSION_INDEX, request, SESSION_FIELDS, SESSION_SORTS)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+speakers.py -- speaker profiles and their cross-conference session index
+
+Every session of a speaker has a SpeakerSession child entity under the
+Speaker, keyed by the websafe session key and carrying the session's
+date and starttime. createSession puts it in the cross-group transaction
+that also writes the session and its conference schedule
+(schedule.addSession). It is a blind put of a new entity, so creates for
+different speakers don't touch the same entity, and the index has no size
+limit. A speaker page or sessionBySpeaker is one ancestor query page on
+(date, starttime) plus one get_multi of the page's sessions instead of a
+Session.speaker query across every conference.
+
+The shared 'Undefined' speaker stands in for every session without one,
+so indexing it would put all of those creates in one entity group. It
+is not indexed and its pages come from the Session query.
+
+Speakers written before the index existed have sessionsIndexed unset;
+the first read builds their children from the Session query once, in
+batches of BACKFILL_BATCH so no commit exceeds the datastore's entity
+limit, and sets sessionsIndexed after the last one.
+Sessions of a deleted conference leave the index when a read finds they
+no longer resolve.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Session
+from models import SpeakerSession
+import repository
+
+UNDEFINED_SPEAKER = 'Undefined'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# conferences looked at when checking whether a user organizes one of a
+# speaker's conferences
+OWNER_CHECK_LIMIT = 500
+# index entries put per commit when building a pre-existing speaker's index
+BACKFILL_BATCH = 200
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def entryFor(session):
+    """Index entity of a session that has a key and a speaker."""
+    return SpeakerSession(id=session.key.urlsafe(), parent=session.speaker,
+                          date=session.date, starttime=session.starttime)
+
+
+def sessionKey(entry):
+    return ndb.Key(urlsafe=entry.key.id())
+
+
+def ensureIndex(sp_key):
+    """Return the Speaker, building its session index if it predates it.
+
+    The entries are put page by page outside any transaction: ids are the
+    session keys, so a concurrent build or addSession writes the same
+    values. A build cut short leaves sessionsIndexed unset and the next
+    read starts over. Returns None if there is no such speaker.
+    """
+    speaker = repository.get(sp_key)
+    if speaker is None or speaker.sessionsIndexed or speaker.name == UNDEFINED_SPEAKER:
+        return speaker
+
+    cursor = None
+    while True:
+        sessions, cursor = repository.page(
+            Session, filters=[('speaker', '=', sp_key)],
+            limit=BACKFILL_BATCH, cursor=cursor)
+        repository.putMulti([entryFor(s) for s in sessions])
+        if cursor is None:
+            break
+
+    @repository.transactional()
+    def store():
+        current = repository.get(sp_key)
+        if current is not None and not current.sessionsIndexed:
+            current.sessionsIndexed = True
+            repository.put(current)
+        return current
+    return store()
+
+
+def addSession(session, speakerName):
+    """Put the index entry of a new session.
+
+    Runs inside schedule.addSession's transaction, after the session got
+    its key. Nothing is read, so it doesn't matter whether the speaker's
+    index has been built yet.
+    """
+    if session.speaker is None or speakerName == UNDEFINED_SPEAKER:
+        return
+    repository.put(entryFor(session))
+
+
+def page(sp_key, cursor=None, size=DEFAULT_PAGE_SIZE, include_archived=False):
+    """One page of a speaker's sessions in date and time order.
+
+    Returns (speaker, sessions, cursor of the next page or None); speaker
+    is None if there is no such speaker. Archived sessions are left out
+    of an indexed page unless include_archived, so a page can be short;
+    follow the cursor until it is None. Raises ValueError for a bad cursor.
+    """
+    speaker = ensureIndex(sp_key)
+    if speaker is None:
+        return None, [], None
+    size = max(1, min(size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+    if not speaker.sessionsIndexed:
+        filters = [('speaker', '=', sp_key)]
+        if not include_archived:
+            filters.append(('archived', '=', False))
+        sessions, cursor = repository.page(Session, filters=filters, limit=size, cursor=cursor)
+        return speaker, sessions, cursor
+
+    entries, cursor = repository.page(SpeakerSession, ancestor=sp_key,
+                                      order=('date', 'starttime'), limit=size, cursor=cursor)
+    sessions = repository.getMulti([sessionKey(e) for e in entries])
+    gone = [e.key for e, s in zip(entries, sessions) if s is None]
+    if gone:
+        repository.deleteMulti(gone)
+    sessions = [s for s in sessions
+                if s is not None and (include_archived or not s.archived)]
+    return speaker, sessions, cursor
+
+
+def organizes(sp_key, user_id):
+    """True if user_id organizes a conference the speaker has a session in."""
+    ensureIndex(sp_key)
+    entries = repository.query(SpeakerSession, ancestor=sp_key)
+    c_keys = list(set(sessionKey(e).parent() for e in entries))[:OWNER_CHECK_LIMIT]
+    return any(conf is not None and conf.organizerUserId == user_id
+               for conf in repository.getMulti(c_keys))
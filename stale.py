@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+stale.py -- stale-while-revalidate for read endpoints
+
+serve() runs an endpoint's read under one deadline budget for the whole
+read. A datastore pre-call hook gives every RPC the read makes a deadline
+of what is left of the budget and fails the RPC at once when nothing is
+left, so a read of N RPCs still gives up after the budget, not N times
+it. The hook leaves the request's ndb context alone, so its cache and
+pending batches carry over. A read that finishes stores its serialized
+response in memcache as the last known-good copy. A read that runs out
+of budget answers with that copy marked stale=True and queues a task
+that redoes the read without a budget, so the next caller gets fresh
+data. With no copy to fall back on the caller gets a 503.
+
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.runtime import apiproxy_errors
+from protorpc import protojson
+
+from admission import ServiceUnavailableException
+
+READ_BUDGET = 0.5               # seconds for all datastore RPCs of a read
+REFRESH_DEDUPE_SECONDS = 30     # at most one refresh per response per window
+MEMCACHE_STALE_KEY = 'STALE:%s:%s'
+REFRESH_ENV = 'CONFERENCE_STALE_REFRESH'
+
+DEADLINE_ERRORS = (datastore_errors.Timeout,
+                   apiproxy_errors.DeadlineExceededError)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+_budget = threading.local()
+
+
+def _boundRpc(service, call, request, response, rpc):
+    """Datastore pre-call hook: cap an RPC at what is left of the read's budget."""
+    deadline = getattr(_budget, 'deadline', None)
+    if deadline is None or rpc is None:
+        return
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise apiproxy_errors.DeadlineExceededError('read budget spent before %s' % call)
+    rpc.deadline = min(rpc.deadline or remaining, remaining)
+
+def _withDeadline(budget, build):
+    """Run build with all of its datastore RPCs bounded by budget seconds."""
+    # a no-op once installed; done here because testbed swaps the apiproxy
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'stale_read_budget', _boundRpc, 'datastore_v3')
+    outer = getattr(_budget, 'deadline', None)
+    deadline = time.time() + budget
+    _budget.deadline = deadline if outer is None else min(outer, deadline)
+    try:
+        return build()
+    finally:
+        _budget.deadline = outer
+
+
+def _enqueueRefresh(method_name, params, digest):
+    try:
+        taskqueue.add(name='stale-%s-%d' % (digest, time.time() // REFRESH_DEDUPE_SECONDS),
+                      url='/tasks/refresh_response',
+                      params={'method': method_name, 'params': params})
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def serve(method_name, request, response_type, build, budget=READ_BUDGET):
+    """Return build() if it beats the budget, else the last good response.
+
+    method_name is 'api.method' ('conference.getConference'), so the
+    refresh task can call the endpoint again with the same request.
+    """
+    params = protojson.encode_message(request)
+    digest = hashlib.sha1('%s:%s' % (method_name, params)).hexdigest()
+    key = MEMCACHE_STALE_KEY % (method_name, digest)
+
+    if os.environ.get(REFRESH_ENV):
+        # the refresh task itself waits as long as it takes
+        response = build()
+    else:
+        started = time.time()
+        try:
+            response = _withDeadline(budget, build)
+        except DEADLINE_ERRORS:
+            cached = memcache.get(key)
+            if cached is None:
+                raise ServiceUnavailableException('Datastore is slow, retry after 1 second',
+                                                  retryAfter=1)
+            logging.warning('%s over budget after %dms, serving stale copy',
+                            method_name, (time.time() - started) * 1000)
+            _enqueueRefresh(method_name, params, digest)
+            response = protojson.decode_message(response_type, cached)
+            response.stale = True
+            return response
+    memcache.set(key, protojson.encode_message(response))
+    return response
+
+
+def refreshTask(method_name, params):
+    """Redo a read that ran out of budget so its stored copy is fresh."""
+    import services
+    apis = {'conference': services.ConferenceApi, 'session': services.SessionApi}
+    api_name, _, name = method_name.partition('.')
+    method = getattr(apis[api_name](), name)
+    os.environ[REFRESH_ENV] = '1'
+    try:
+        method(protojson.decode_message(method.remote.request_type, params))
+    finally:
+        del os.environ[REFRESH_ENV]
@@ -33,7 +33,8 @@ var app = angular.module('conferenceApp',
                     controller: 'MyProfileCtrl'
                 }).
                 when('/', {
-                    templateUrl: '/partials/home.html'
+                    templateUrl: '/partials/home.html',
+                    controller: 'HomeCtrl'
                 }).
                 otherwise({
                     redirectTo: '/'
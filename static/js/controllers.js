@@ -554,19 +554,32 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConference and conference.getProfile methods in one conference.batch call
+     * and sets the returned conference in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
+        gapi.client.conference.batch({
+            operations: [
+                {id: 'conference', method: 'conference.getConference',
+                    params: JSON.stringify({websafeConferenceKey: $routeParams.websafeConferenceKey})},
+                {id: 'profile', method: 'conference.getProfile', params: '{}'}
+            ]
         }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
-                if (resp.error) {
+                var results = {};
+                if (!resp.error) {
+                    angular.forEach(resp.result.results, function (result) {
+                        results[result.id] = result;
+                    });
+                }
+                var conferenceResult = results['conference'];
+                if (!conferenceResult || conferenceResult.status != 200) {
                     // The request has failed.
-                    var errorMessage = resp.error.message || '';
+                    var errorMessage = (resp.error && resp.error.message) ||
+                        (conferenceResult && conferenceResult.error) || '';
                     $scope.messages = 'Failed to get the conference : ' + $routeParams.websafeKey
                         + ' ' + errorMessage;
                     $scope.alertStatus = 'warning';
@@ -574,22 +587,16 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    $scope.conference = JSON.parse(conferenceResult.body);
                 }
-            });
-        });
 
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
+                // If the user is attending the conference, updates the status message and available function.
+                var profileResult = results['profile'];
+                if (profileResult && profileResult.status == 200) {
+                    var profile = JSON.parse(profileResult.body);
+                    var conferenceKeysToAttend = profile.conferenceKeysToAttend || [];
+                    for (var i = 0; i < conferenceKeysToAttend.length; i++) {
+                        if ($routeParams.websafeConferenceKey == conferenceKeysToAttend[i]) {
                             // The user is attending the conference.
                             $scope.alertStatus = 'info';
                             $scope.messages = 'You are attending this conference';
@@ -682,6 +689,67 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 });
 
 
+/**
+ * @ngdoc controller
+ * @name HomeCtrl
+ *
+ * @description
+ * A controller used for the home page.
+ */
+conferenceApp.controllers.controller('HomeCtrl', function ($scope, $log, oauth2Provider) {
+    $scope.announcement = '';
+
+    $scope.profile = null;
+
+    $scope.conferences = [];
+
+    /**
+     * Invokes the conference.getAnnouncement, conference.getProfile and conference.getConferencesToAttend
+     * methods in one conference.batch call. The profile and conferences need a signed in user.
+     */
+    $scope.init = function () {
+        var operations = [{id: 'announcement', method: 'conference.getAnnouncement', params: '{}'}];
+        if (oauth2Provider.signedIn) {
+            operations.push({id: 'profile', method: 'conference.getProfile', params: '{}'});
+            operations.push({id: 'attending', method: 'conference.getConferencesToAttend', params: '{}'});
+        }
+        $scope.loading = true;
+        gapi.client.conference.batch({operations: operations}).execute(function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    $log.error('Failed to load the home page : ' + (resp.error.message || ''));
+                    return;
+                }
+                angular.forEach(resp.result.results, function (result) {
+                    if (result.status != 200) {
+                        $log.error('Failed to get ' + result.id + ' : ' + (result.error || ''));
+                        return;
+                    }
+                    var body = JSON.parse(result.body);
+                    if (result.id == 'announcement') {
+                        $scope.announcement = body.data;
+                    } else if (result.id == 'profile') {
+                        $scope.profile = body;
+                    } else if (result.id == 'attending') {
+                        $scope.conferences = body.items || [];
+                    }
+                });
+            });
+        });
+    };
+
+    // reload once the user signs in or out
+    $scope.$watch(function () {
+        return oauth2Provider.signedIn;
+    }, function (signedIn, previous) {
+        if (signedIn !== previous) {
+            $scope.init();
+        }
+    });
+});
+
+
 /**
  * @ngdoc controller
  * @name RootCtrl
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+transport.py -- protocol buffer encoding of the read endpoints
+
+The mobile clients can call the read endpoints through /api/<api>/<method>
+instead of the Endpoints JSON API. The request is taken from the query
+string (GET) or the body (POST, protobuf or JSON by Content-Type), the
+protorpc method runs unchanged, and the response is encoded with
+protorpc.protobuf when the Accept header asks for it and as JSON
+otherwise. Protobuf drops the repeated field names, which is most of a
+ConferenceForms or SessionForms payload.
+
+Only methods that need no signed-in user are served here; everything
+else stays on the Endpoints API.
+
+"""
+
+from protorpc import protobuf
+from protorpc import protojson
+from protorpc import protourlencode
+
+PROTOBUF_TYPES = ('application/x-protobuf', 'application/x-google-protobuf')
+PROTOBUF_CONTENT_TYPE = PROTOBUF_TYPES[0]
+JSON_CONTENT_TYPE = 'application/json'
+
+READ_METHODS = frozenset([
+    'conference.getConference',
+    'conference.queryConferences',
+    'conference.getRollups',
+    'conference.getConferenceRollup',
+    'session.sessionByConf',
+    'session.sessionByType',
+    'session.sessionBySpeaker',
+    'session.getSchedule',
+    'session.getSpeaker',
+])
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def resolve(method_name):
+    """Return the bound protorpc method for 'api.method', or None."""
+    if method_name not in READ_METHODS:
+        return None
+    import services
+    apis = {'conference': services.ConferenceApi, 'session': services.SessionApi}
+    api_name, _, name = method_name.partition('.')
+    return getattr(apis[api_name](), name)
+
+
+def wantsProtobuf(accept):
+    """Content negotiation: protobuf only when the client asks for it."""
+    return any(t in (accept or '') for t in PROTOBUF_TYPES)
+
+
+def decode(request_type, content_type, body, query_string):
+    """Decode a request from the body, or the query string if there is none."""
+    if body:
+        if any(t in (content_type or '') for t in PROTOBUF_TYPES):
+            return protobuf.decode_message(request_type, body)
+        return protojson.decode_message(request_type, body)
+    return protourlencode.decode_message(request_type, query_string or '')
+
+
+def encode(response, protobuf_wanted):
+    """Return (content type, encoded body) for a response message."""
+    if protobuf_wanted:
+        return PROTOBUF_CONTENT_TYPE, protobuf.encode_message(response)
+    return JSON_CONTENT_TYPE, protojson.encode_message(response)